@@ -0,0 +1,187 @@
+#Microbenchmark: instructions per second on PONG2 with the precomputed decode tables,
+#against the if/elif ladder that execute_opcode used to walk for every instruction.
+#Run from the repository root: python benchmarks/dispatch.py [cycles]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import chip8
+
+ROM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PONG2")
+
+def ladder_execute(cpu, opcode):
+    #The old decode path: range comparisons on the top nibble, then a second ladder inside each family
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    if opcode < 0x1000:
+        if opcode == 0x00E0:
+            cpu.op_00E0()
+        elif opcode == 0x00EE:
+            cpu.op_00EE()
+        elif opcode == 0x0000:
+            cpu.op_0000()
+        else:
+            cpu.op_0nnn(opcode & 0x0FFF)
+    elif opcode < 0x2000:
+        cpu.op_1nnn(opcode & 0x0FFF)
+    elif opcode < 0x3000:
+        cpu.op_2nnn(opcode & 0x0FFF)
+    elif opcode < 0x4000:
+        cpu.op_3xkk(x, opcode & 0x00FF)
+    elif opcode < 0x5000:
+        cpu.op_4xkk(x, opcode & 0x00FF)
+    elif opcode < 0x6000:
+        cpu.op_5xy0(x, y)
+    elif opcode < 0x7000:
+        cpu.op_6xkk(x, opcode & 0x00FF)
+    elif opcode < 0x8000:
+        cpu.op_7xkk(x, opcode & 0x00FF)
+    elif opcode < 0x9000:
+        last = opcode & 0x000F
+        if last == 0x0:
+            cpu.op_8xy0(x, y)
+        elif last == 0x1:
+            cpu.op_8xy1(x, y)
+        elif last == 0x2:
+            cpu.op_8xy2(x, y)
+        elif last == 0x3:
+            cpu.op_8xy3(x, y)
+        elif last == 0x4:
+            cpu.op_8xy4(x, y)
+        elif last == 0x5:
+            cpu.op_8xy5(x, y)
+        elif last == 0x6:
+            cpu.op_8xy6(x, y)
+        elif last == 0x7:
+            cpu.op_8xy7(x, y)
+        elif last == 0xE:
+            cpu.op_8xyE(x, y)
+        else:
+            cpu.op_skip_word()
+    elif opcode < 0xA000:
+        cpu.op_9xy0(x, y)
+    elif opcode < 0xB000:
+        cpu.op_Annn(opcode & 0x0FFF)
+    elif opcode < 0xC000:
+        cpu.op_Bnnn(opcode & 0x0FFF)
+    elif opcode < 0xD000:
+        cpu.op_Cxkk(x, opcode & 0x00FF)
+    elif opcode < 0xE000:
+        cpu.op_Dxyn(x, y, opcode & 0x000F)
+    elif opcode < 0xF000:
+        last = opcode & 0x00FF
+        if last == 0x9E:
+            cpu.op_Ex9E(x)
+        elif last == 0xA1:
+            cpu.op_ExA1(x)
+        else:
+            cpu.op_stall()
+    else:
+        last = opcode & 0x00FF
+        if last == 0x07:
+            cpu.op_Fx07(x)
+        elif last == 0x0A:
+            cpu.op_Fx0A(x)
+        elif last == 0x15:
+            cpu.op_Fx15(x)
+        elif last == 0x18:
+            cpu.op_Fx18(x)
+        elif last == 0x1E:
+            cpu.op_Fx1E(x)
+        elif last == 0x29:
+            cpu.op_Fx29(x)
+        elif last == 0x33:
+            cpu.op_Fx33(x)
+        elif last == 0x55:
+            cpu.op_Fx55(x)
+        elif last == 0x65:
+            cpu.op_Fx65(x)
+        else:
+            cpu.op_skip_word()
+    return
+
+def run_ladder(cpu, cycles):
+    #Same loop shape as PETChip8CPU.run_cycles, but decoding through the ladder
+    memory = cpu.memory
+    executed = 0
+    centicycles = cpu.timer_centicycles
+    while executed < cycles:
+        if cpu.blocking_keypress:
+            break
+        pc = cpu.program_counter
+        ladder_execute(cpu, (memory[pc] << 8) | memory[pc + 1])
+        executed += 1
+        centicycles += cpu.CENTICYCLES_PER_INSTRUCTION
+        if centicycles >= cpu.TIMER_PERIOD_CENTICYCLES:
+            centicycles -= cpu.TIMER_PERIOD_CENTICYCLES
+            cpu.tick_timers()
+    cpu.timer_centicycles = centicycles
+    return executed
+
+def run_once(runner, cycles):
+    #One timed run on a freshly loaded PONG2 with a fixed random seed
+    cpu = chip8.PETChip8CPU(2000)
+    cpu.load(ROM)
+    cpu.rng.seed(0)
+    start = time.perf_counter()
+    executed = runner(cpu, cycles)
+    return executed / (time.perf_counter() - start)
+
+def measure(runners, cycles, repeats=7):
+    #Interleaves the runners so background load hits them evenly, and keeps the best rate of each
+    best = [0.0] * len(runners)
+    for _ in range(repeats):
+        for i in range(0, len(runners)):
+            best[i] = max(best[i], run_once(runners[i], cycles))
+    return best
+
+class NullHandlerCPU(chip8.PETChip8CPU):
+    #Every handler is a no-op, so replaying a trace through it times the decode and dispatch alone
+    pass
+
+def null_handler(self, *operands):
+    return
+
+for name in set(chip8.build_decode_tables()[0]):
+    setattr(NullHandlerCPU, name, null_handler)
+
+def record_trace(cycles):
+    #The opcodes PONG2 actually executes, in order
+    cpu = chip8.PETChip8CPU(2000)
+    cpu.load(ROM)
+    cpu.rng.seed(0)
+    trace = []
+    for _ in range(cycles):
+        pc = cpu.program_counter
+        opcode = (cpu.memory[pc] << 8) | cpu.memory[pc + 1]
+        trace.append(opcode)
+        cpu.run_cycles(1)
+    return trace
+
+def measure_decode(trace, repeats=7):
+    #Nanoseconds per instruction spent decoding and dispatching, for the ladder and for the decode tables
+    cpu = NullHandlerCPU(2000)
+    best_ladder = best_table = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for opcode in trace:
+            ladder_execute(cpu, opcode)
+        best_ladder = min(best_ladder, time.perf_counter() - start)
+        start = time.perf_counter()
+        for opcode in trace:
+            cpu.execute_opcode(opcode)
+        best_table = min(best_table, time.perf_counter() - start)
+    return (best_ladder * 1e9 / len(trace), best_table * 1e9 / len(trace))
+
+if __name__ == '__main__':
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    before, after = measure([run_ladder, lambda cpu, n: cpu.run_cycles(n)], cycles)
+    print("PONG2, %d instructions" % cycles)
+    print("if/elif ladder:  %10.0f instructions/s" % before)
+    print("decode tables:   %10.0f instructions/s" % after)
+    print("speedup:         %10.2fx" % (after / before))
+    ladder_ns, table_ns = measure_decode(record_trace(min(cycles, 100000)))
+    print("decode and dispatch only, per instruction:")
+    print("if/elif ladder:  %10.1f ns" % ladder_ns)
+    print("decode tables:   %10.1f ns" % table_ns)
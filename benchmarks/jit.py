@@ -0,0 +1,61 @@
+#Interpreter against the basic-block translator (PETChip8CPU(..., jit=True)) on PONG2 and on a DRW-free arithmetic loop.
+#Both engines run the same number of cycles from the same seed, and the full machine state is compared afterwards.
+#Run from the repository root: python benchmarks/jit.py [cycles]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import chip8
+
+ROM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PONG2")
+
+#A tight loop of register arithmetic and skips, with no drawing
+ALU_LOOP = bytes([0x60, 0x00,   #200: LD V0, 0
+                  0x61, 0x03,   #202: LD V1, 3
+                  0x70, 0x01,   #204: ADD V0, 1
+                  0x82, 0x00,   #206: LD V2, V0
+                  0x82, 0x14,   #208: ADD V2, V1
+                  0x83, 0x25,   #20A: SUB V3, V2
+                  0x84, 0x36,   #20C: SHR V4, V3
+                  0x85, 0x42,   #20E: AND V5, V4
+                  0x30, 0xFF,   #210: SE V0, 255
+                  0x12, 0x04,   #212: JP 204
+                  0x12, 0x00])  #214: JP 200
+
+def machine_state(cpu):
+    return (bytes(cpu.V), cpu.address_register, cpu.program_counter, cpu.stack_pointer, bytes(cpu.stack),
+            bytes(cpu.memory), bytes(cpu.framebuffer), cpu.delay_timer, cpu.sound_timer, cpu.timer_centicycles,
+            cpu.instruction_count, cpu.blocking_keypress)
+
+def run_once(rom, jit, cycles):
+    #Returns (instructions per second, final state) for one run on a fresh CPU
+    cpu = chip8.PETChip8CPU(2000, jit=jit)
+    cpu.memory[512:512 + len(rom)] = rom
+    cpu.rng.seed(0)
+    start = time.perf_counter()
+    executed = cpu.run_cycles(cycles)
+    return (executed / (time.perf_counter() - start), machine_state(cpu))
+
+def compare(name, rom, cycles, repeats=5):
+    best = {False: 0.0, True: 0.0}
+    states = {}
+    for _ in range(repeats):
+        for jit in (False, True):
+            rate, states[jit] = run_once(rom, jit, cycles)
+            best[jit] = max(best[jit], rate)
+    print("%s, %d instructions" % (name, cycles))
+    print("interpreter:  %10.0f instructions/s" % best[False])
+    print("block cache:  %10.0f instructions/s" % best[True])
+    print("speedup:      %10.2fx" % (best[True] / best[False]))
+    print("final state identical:", states[False] == states[True])
+    return states[False] == states[True]
+
+if __name__ == '__main__':
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    fin = open(ROM, "rb")
+    pong = fin.read()
+    fin.close()
+    identical = compare("PONG2", pong, cycles)
+    identical = compare("ALU loop", ALU_LOOP, cycles) and identical
+    sys.exit(0 if identical else 1)
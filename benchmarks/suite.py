@@ -0,0 +1,236 @@
+#Benchmark suite: PONG2 and synthetic ROMs that each lean on one kind of opcode, run headless for a fixed number of cycles on
+#every engine. Reports instructions/s, emulated 60 Hz frames/s, per-opcode-class cost and peak memory, and writes the results
+#as JSON so runs from different releases can be compared with --compare.
+#Run from the repository root: python benchmarks/suite.py [--cycles N] [--output results.json] [--compare baseline.json]
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import chip8
+import chip8jit
+try:
+    import chip8batch
+except ImportError:
+    chip8batch = None #The batch engine needs NumPy; without it the suite runs the other engines only
+
+ROM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PONG2")
+
+#Register arithmetic and skips, no drawing
+ALU_ROM = bytes([0x60, 0x00,   #200: LD V0, 0
+                 0x61, 0x03,   #202: LD V1, 3
+                 0x70, 0x01,   #204: ADD V0, 1
+                 0x82, 0x00,   #206: LD V2, V0
+                 0x82, 0x14,   #208: ADD V2, V1
+                 0x83, 0x25,   #20A: SUB V3, V2
+                 0x84, 0x36,   #20C: SHR V4, V3
+                 0x85, 0x42,   #20E: AND V5, V4
+                 0x30, 0xFF,   #210: SE V0, 255
+                 0x12, 0x04,   #212: JP 204
+                 0x12, 0x00])  #214: JP 200
+
+#Font sprites drawn all over the screen, wrapping at the edges
+DRW_ROM = bytes([0x60, 0x00,   #200: LD V0, 0
+                 0x61, 0x00,   #202: LD V1, 0
+                 0x62, 0x00,   #204: LD V2, 0
+                 0xF2, 0x29,   #206: LD F, V2
+                 0xD0, 0x15,   #208: DRW V0, V1, 5
+                 0x70, 0x05,   #20A: ADD V0, 5
+                 0x71, 0x03,   #20C: ADD V1, 3
+                 0x72, 0x01,   #20E: ADD V2, 1
+                 0x32, 0x10,   #210: SE V2, 16
+                 0x12, 0x06,   #212: JP 206
+                 0x62, 0x00,   #214: LD V2, 0
+                 0x12, 0x06])  #216: JP 206
+
+#Nested subroutine calls and returns
+CALL_ROM = bytes([0x22, 0x06,  #200: CALL 206
+                  0x12, 0x00,  #202: JP 200
+                  0x00, 0x00,  #204: (unused)
+                  0x22, 0x0C,  #206: CALL 20C
+                  0x70, 0x01,  #208: ADD V0, 1
+                  0x00, 0xEE,  #20A: RET
+                  0x71, 0x01,  #20C: ADD V1, 1
+                  0x00, 0xEE]) #20E: RET
+
+#Register file stores and loads, plus BCD, against a scratch area well away from the code
+MEM_ROM = bytes([0xA3, 0x00,   #200: LD I, 300
+                 0xFF, 0x55,   #202: LD [I], V0..VF
+                 0xFF, 0x65,   #204: LD V0..VF, [I]
+                 0x70, 0x01,   #206: ADD V0, 1
+                 0xF0, 0x33,   #208: LD B, V0
+                 0x12, 0x00])  #20A: JP 200
+
+#Handler name -> opcode class, for the per-class cost breakdown
+OPCODE_CLASSES = {"op_6xkk": "alu", "op_7xkk": "alu", "op_8xy0": "alu", "op_8xy1": "alu", "op_8xy2": "alu", "op_8xy3": "alu",
+                  "op_8xy4": "alu", "op_8xy5": "alu", "op_8xy6": "alu", "op_8xy7": "alu", "op_8xyE": "alu",
+                  "op_3xkk": "skip", "op_4xkk": "skip", "op_5xy0": "skip", "op_9xy0": "skip", "op_Ex9E": "skip", "op_ExA1": "skip",
+                  "op_00EE": "flow", "op_1nnn": "flow", "op_2nnn": "flow", "op_Bnnn": "flow", "op_0nnn": "flow", "op_0000": "flow",
+                  "op_00E0": "draw", "op_Dxyn": "draw",
+                  "op_Annn": "memory", "op_Fx1E": "memory", "op_Fx29": "memory", "op_Fx33": "memory", "op_Fx55": "memory",
+                  "op_Fx65": "memory",
+                  "op_Fx07": "timer", "op_Fx15": "timer", "op_Fx18": "timer",
+                  "op_Fx0A": "input", "op_Cxkk": "random"}
+
+def workloads():
+    fin = open(ROM, "rb")
+    pong = fin.read()
+    fin.close()
+    return [("PONG2", pong), ("alu", ALU_ROM), ("drw", DRW_ROM), ("call", CALL_ROM), ("mem", MEM_ROM)]
+
+def make_cpu(rom, jit):
+    cpu = chip8.PETChip8CPU(0, jit=jit)
+    cpu.memory[512:512 + len(rom)] = rom
+    cpu.rng.seed(0)
+    return cpu
+
+def time_scalar(rom, jit, cycles, repeats):
+    #Best instructions/s over the repeats, each on a fresh CPU. The JIT's compiled blocks are shared between CPUs, so later
+    #repeats measure the warm cache; the peak memory pass below starts cold.
+    best = 0.0
+    for _ in range(repeats):
+        cpu = make_cpu(rom, jit)
+        start = time.perf_counter()
+        executed = cpu.run_cycles(cycles)
+        best = max(best, executed / (time.perf_counter() - start))
+    return best
+
+def peak_scalar(rom, jit, cycles):
+    #Peak bytes allocated by Python while building the CPU and running it, translation included
+    chip8jit._compiled_blocks.clear()
+    tracemalloc.start()
+    cpu = make_cpu(rom, jit)
+    cpu.run_cycles(cycles)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def make_batch(rom, lanes):
+    batch = chip8batch.Chip8Batch(lanes, seeds=range(lanes))
+    batch.memory[:, 512:512 + len(rom)] = list(rom)
+    return batch
+
+def time_batch(rom, lanes, cycles, repeats):
+    #Best lane-instructions/s: every lane executes one opcode per step
+    best = 0.0
+    for _ in range(repeats):
+        batch = make_batch(rom, lanes)
+        start = time.perf_counter()
+        batch.run_cycles(cycles)
+        best = max(best, lanes * cycles / (time.perf_counter() - start))
+    return best
+
+def peak_batch(rom, lanes, cycles):
+    tracemalloc.start()
+    batch = make_batch(rom, lanes)
+    batch.run_cycles(cycles)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def class_costs(rom, cycles):
+    #Times every handler call on the interpreter and charges it to its opcode class, less the cost of timing an empty call.
+    #Returns {class: {"count", "ns_per_op", "share"}}, share being the fraction of handler time spent in that class.
+    cpu = make_cpu(rom, False)
+    clock = time.perf_counter_ns
+    empty = lambda: None
+    overhead = min(_timed_call(clock, empty) for _ in range(10000))
+    totals = {}
+    counts = {}
+    memory = cpu.memory
+    for _ in range(cycles):
+        if cpu.blocking_keypress:
+            break
+        pc = cpu.program_counter
+        opcode = (memory[pc] << 8) | memory[pc + 1]
+        handler = cpu.opcode_cache.get(opcode) or cpu.bind_opcode(opcode)
+        elapsed = _timed_call(clock, handler) - overhead
+        kind = OPCODE_CLASSES.get(cpu.opcode_names[opcode], "other")
+        totals[kind] = totals.get(kind, 0) + max(elapsed, 0)
+        counts[kind] = counts.get(kind, 0) + 1
+        memory = cpu.memory
+    grand = sum(totals.values()) or 1
+    return {kind: {"count": counts[kind], "ns_per_op": totals[kind] / counts[kind], "share": totals[kind] / grand}
+            for kind in sorted(totals)}
+
+def _timed_call(clock, function):
+    start = clock()
+    function()
+    return clock() - start
+
+def run_suite(cycles, repeats, lanes):
+    engines = ["interpreter", "jit"] + (["batch"] if chip8batch is not None else [])
+    results = {"python": platform.python_version(), "implementation": platform.python_implementation(),
+               "machine": platform.machine(), "cycles": cycles, "batch_lanes": lanes, "workloads": {}}
+    for name, rom in workloads():
+        entry = {"engines": {}, "opcode_classes": class_costs(rom, min(cycles, 50000))}
+        for engine in engines:
+            if engine == "batch":
+                #The batch engine steps every lane in lock step, so it gets a shorter run
+                batch_cycles = max(1, cycles // 20)
+                rate = time_batch(rom, lanes, batch_cycles, repeats)
+                peak = peak_batch(rom, lanes, batch_cycles)
+            else:
+                rate = time_scalar(rom, engine == "jit", cycles, repeats)
+                peak = peak_scalar(rom, engine == "jit", cycles)
+            entry["engines"][engine] = {"instructions_per_second": rate,
+                                        "frames_per_second": rate * chip8.PETChip8CPU.CENTICYCLES_PER_INSTRUCTION / chip8.PETChip8CPU.TIMER_PERIOD_CENTICYCLES,
+                                        "peak_bytes": peak}
+        results["workloads"][name] = entry
+    return results
+
+def print_report(results, out):
+    out.write("%-8s %-12s %14s %10s %12s\n" % ("rom", "engine", "instr/s", "frames/s", "peak KiB"))
+    for name, entry in results["workloads"].items():
+        for engine, numbers in entry["engines"].items():
+            out.write("%-8s %-12s %14.0f %10.0f %12.1f\n" % (name, engine, numbers["instructions_per_second"],
+                                                              numbers["frames_per_second"], numbers["peak_bytes"] / 1024))
+    out.write("\n%-8s %-8s %10s %10s %7s\n" % ("rom", "class", "count", "ns/op", "share"))
+    for name, entry in results["workloads"].items():
+        for kind, numbers in entry["opcode_classes"].items():
+            out.write("%-8s %-8s %10d %10.0f %6.1f%%\n" % (name, kind, numbers["count"], numbers["ns_per_op"], numbers["share"] * 100))
+    return
+
+def compare(results, baseline, tolerance, out):
+    #Lists every workload and engine whose throughput fell by more than tolerance against the baseline; returns how many did
+    regressions = 0
+    for name, entry in results["workloads"].items():
+        for engine, numbers in entry["engines"].items():
+            try:
+                before = baseline["workloads"][name]["engines"][engine]["instructions_per_second"]
+            except KeyError:
+                continue
+            ratio = numbers["instructions_per_second"] / before
+            if ratio < 1 - tolerance:
+                regressions += 1
+                out.write("REGRESSION %s/%s: %.0f -> %.0f instructions/s (%.2fx)\n" % (name, engine, before,
+                                                                                       numbers["instructions_per_second"], ratio))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless CHIP-8 benchmark suite.")
+    parser.add_argument("--cycles", type=int, default=200000, help="opcodes per run")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per workload and engine; the best is kept")
+    parser.add_argument("--lanes", type=int, default=64, help="machines in the batch engine")
+    parser.add_argument("--output", default=None, help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", default=None, help="baseline JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed throughput drop against the baseline")
+    args = parser.parse_args()
+    results = run_suite(args.cycles, args.repeats, args.lanes)
+    print_report(results, sys.stderr)
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        fout = open(args.output, "w")
+        json.dump(results, fout, indent=2)
+        fout.close()
+    regressions = 0
+    if args.compare is not None:
+        fin = open(args.compare)
+        regressions = compare(results, json.load(fin), args.tolerance, sys.stderr)
+        fin.close()
+    sys.exit(1 if regressions else 0)
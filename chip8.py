@@ -1,32 +1,214 @@
 import random
 import os
 import math
+import functools
+import array
+import struct
+from collections.abc import Mapping, MutableMapping
+
+#Sub-dispatch for the opcode families that share a top nibble, keyed by the low nibble (8xy?) or low byte (Ex??, Fx??)
+EIGHT_SERIES_HANDLERS = {0x0: "op_8xy0", 0x1: "op_8xy1", 0x2: "op_8xy2", 0x3: "op_8xy3", 0x4: "op_8xy4",
+                         0x5: "op_8xy5", 0x6: "op_8xy6", 0x7: "op_8xy7", 0xE: "op_8xyE"}
+FOURTEEN_SERIES_HANDLERS = {0x9E: "op_Ex9E", 0xA1: "op_ExA1"}
+FIFTEEN_SERIES_HANDLERS = {0x07: "op_Fx07", 0x0A: "op_Fx0A", 0x15: "op_Fx15", 0x18: "op_Fx18", 0x1E: "op_Fx1E",
+                           0x29: "op_Fx29", 0x33: "op_Fx33", 0x55: "op_Fx55", 0x65: "op_Fx65"}
+
+#The eight pixels of each possible framebuffer byte, as one byte per pixel
+PIXEL_BYTES = [bytes((byte >> (7 - bit)) & 1 for bit in range(0, 8)) for byte in range(0, 256)]
+
+#Save-state layout, little-endian: magic, version, PC, I, SP, delay timer, sound timer, timer accumulator, Fx0A target register,
+#flags (bit 0 blocking on a keypress, bit 1 sound just started), instruction count, 16 stack words, V0-VF, keys, framebuffer, memory
+STATE_MAGIC = b"C8ST"
+STATE_VERSION = 1
+STATE_FORMAT = struct.Struct("<4sBHHbBBHbBQ16H16s16s256s4096s")
+STATE_SIZE = STATE_FORMAT.size
+
+#Every opcode decoded once per process: the handler name and the operand tuple it is called with
+_opcode_names = None
+_opcode_operands = None
+
+def decode_opcode(opcode):
+    #Returns the name of the PETChip8CPU method that executes the opcode, and the operands to call it with
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    n = opcode & 0x000F
+    kk = opcode & 0x00FF
+    nnn = opcode & 0x0FFF
+    series = opcode >> 12
+    if series == 0x0:
+        if opcode == 0x00E0:
+            return ("op_00E0", ())
+        elif opcode == 0x00EE:
+            return ("op_00EE", ())
+        elif opcode == 0x0000:
+            return ("op_0000", ())
+        return ("op_0nnn", (nnn,))
+    elif series == 0x1:
+        return ("op_1nnn", (nnn,))
+    elif series == 0x2:
+        return ("op_2nnn", (nnn,))
+    elif series == 0x3:
+        return ("op_3xkk", (x, kk))
+    elif series == 0x4:
+        return ("op_4xkk", (x, kk))
+    elif series == 0x5:
+        return ("op_5xy0", (x, y))
+    elif series == 0x6:
+        return ("op_6xkk", (x, kk))
+    elif series == 0x7:
+        return ("op_7xkk", (x, kk))
+    elif series == 0x8:
+        if n in EIGHT_SERIES_HANDLERS:
+            return (EIGHT_SERIES_HANDLERS[n], (x, y))
+        return ("op_skip_word", ())
+    elif series == 0x9:
+        return ("op_9xy0", (x, y))
+    elif series == 0xA:
+        return ("op_Annn", (nnn,))
+    elif series == 0xB:
+        return ("op_Bnnn", (nnn,))
+    elif series == 0xC:
+        return ("op_Cxkk", (x, kk))
+    elif series == 0xD:
+        return ("op_Dxyn", (x, y, n))
+    elif series == 0xE:
+        if kk in FOURTEEN_SERIES_HANDLERS:
+            return (FOURTEEN_SERIES_HANDLERS[kk], (x,))
+        return ("op_stall", ())
+    if kk in FIFTEEN_SERIES_HANDLERS:
+        return (FIFTEEN_SERIES_HANDLERS[kk], (x,))
+    return ("op_skip_word", ())
+
+def build_decode_tables():
+    #Returns (names, operands): two 65536-entry lists indexed by opcode, built on first use and shared by every CPU
+    global _opcode_names, _opcode_operands
+    if _opcode_names is None:
+        interned = {} #Many opcodes share operand tuples, so keep one copy of each
+        names = []
+        operands = []
+        for opcode in range(0x10000):
+            name, args = decode_opcode(opcode)
+            names.append(name)
+            operands.append(interned.setdefault(args, args))
+        _opcode_names = names
+        _opcode_operands = operands
+    return (_opcode_names, _opcode_operands)
+
+class RegisterView(MutableMapping):
+    #Dictionary-style view of the register file, so code written against the old {"V0": ..., "V15": ...} dictionary keeps working
+    __slots__ = ("V",)
+
+    def __init__(self, V):
+        self.V = V
+        return
+
+    def __getitem__(self, name):
+        return self.V[self.index(name)]
+
+    def __setitem__(self, name, value):
+        self.V[self.index(name)] = value
+        return
+
+    def __delitem__(self, name):
+        raise TypeError("CHIP-8 registers cannot be deleted")
+
+    def __iter__(self):
+        return iter(["V" + str(i) for i in range(0, 16)])
+
+    def __len__(self):
+        return 16
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def index(self, name):
+        if isinstance(name, str) and name[:1] == "V" and name[1:].isdigit() and int(name[1:]) < 16:
+            return int(name[1:])
+        raise KeyError(name)
+
+class SnapshotRing:
+    #The last few save states of a machine, kept in preallocated buffers so taking a snapshot allocates nothing
+    def __init__(self, capacity):
+        self.buffers = [bytearray(STATE_SIZE) for _ in range(0, capacity)]
+        self.next = 0 #Buffer the next snapshot goes into
+        self.count = 0
+        return
+
+    def __len__(self):
+        return self.count
+
+    def push(self, cpu):
+        #Snapshots cpu, overwriting the oldest snapshot once the ring is full
+        cpu.save_state(self.buffers[self.next])
+        self.next = (self.next + 1) % len(self.buffers)
+        self.count = min(self.count + 1, len(self.buffers))
+        return
+
+    def peek(self, age=0):
+        #The snapshot taken age pushes before the latest one, as a read-only view
+        if age < 0 or age >= self.count:
+            raise IndexError("Only %d snapshots are held" % self.count)
+        return memoryview(self.buffers[(self.next - 1 - age) % len(self.buffers)]).toreadonly()
+
+    def rewind(self, cpu, age=0):
+        #Restores cpu to an earlier snapshot and forgets every snapshot newer than it
+        cpu.load_state(self.peek(age))
+        self.next = (self.next - age) % len(self.buffers)
+        self.count -= age
+        return
 
 class PETChip8CPU:
-    def __init__(self, speed):
+    #Fixed attribute layout so hundreds of instances in one process stay small
+    __slots__ = ("program_counter", "refresh_pointer", "call_stack", "V", "address_register", "stack_pointer", "stack",
+                 "memory", "framebuffer", "dirty", "delay_timer", "sound_timer", "keys", "blocking_keypress", "draw_flag",
+                 "cycle_deltasum", "delay_deltasum", "sound_deltasum", "timer_centicycles", "instruction_count",
+                 "rts_keypress", "sound_just_started", "CYCLE_LENGTH_MICROS", "opcode_names", "opcode_operands",
+                 "opcode_cache", "jit", "rng", "memory_share", "rng_share", "profiler", "hasher", "cfg", "idle_loops")
+
+    #The timers run at 60 Hz against a ~500 Hz processor, so they tick once every 8.33 instructions.
+    #Headless execution counts this in hundredths of an instruction so the ratio stays exact without a wall clock.
+    TIMER_PERIOD_CENTICYCLES = 833
+    CENTICYCLES_PER_INSTRUCTION = 100
+
+    def __init__(self, speed, jit=False):
         #The chip8 had 4096 (0x1000) memory locations, all of which are 1 byte
         self.program_counter = 0x200 #The chip 8 interpreter itself occupies the first 512 bytes
         self.refresh_pointer = 0xF00 #The uppermost 256 bytes are reserved for display refresh
         self.call_stack = 0xEA0 #The 96 bytes below that are reserved for call stack, internal use and other variables
-        #The chip8 has 16 bit data registers named from V0 to VF. I decided to store it as a dictionary instead of a list for semantic purposes
-        self.registers = {"V0":0, "V1":0, "V2":0, "V3":0, "V4":0, "V5":0, "V6":0, "V7":0, "V8":0, "V9":0, "V10":0, "V11":0, "V12":0, "V13":0, "V14":0, "V15":0}
+        #The chip8 has 8 bit data registers named from V0 to VF. They are stored as 16 bytes; self.registers gives the old "V0".."V15" dictionary view
+        self.V = bytearray(16)
         self.address_register = 0 #There is also an address register called I, I decided to store this separately
         self.stack_pointer = 0
-        self.stack = [0] * 16 #The stack is used to store return addresses when subroutines are called
-        self.memory = [0] * 4096 #The chip8 has 4k of memory in total
-        self.graphics = [0] * 2048 #The screen has a total of 2048 pixels
+        self.stack = array.array("H", [0] * 16) #The stack is used to store return addresses when subroutines are called
+        self.memory = bytearray(4096) #The chip8 has 4k of memory in total
+        self.framebuffer = bytearray(256) #The 64x32 screen, one bit per pixel: 8 bytes per row, most significant bit leftmost
+        self.dirty = bytearray(b"\xff" * 256) #Same layout as the framebuffer, a bit is set when that pixel changed since consume_dirty_regions
         self.delay_timer = 0
         self.sound_timer = 0 #The two timers count down to zero at a rate of 60 Hz if they are nonzero
-        self.keys = [False] * 16 #The chip8 has a hex-based keypad with 16 keys
+        self.keys = bytearray(16) #The chip8 has a hex-based keypad with 16 keys, 1 when pressed
         self.blocking_keypress = False #Set to true if the chip8 is blocking and waiting for a keypress
         self.draw_flag = True #Says that we updated the screen so we need to redraw
         self.cycle_deltasum = 0
         self.delay_deltasum = 0
         self.sound_deltasum = 0
+        self.timer_centicycles = 0 #Instruction-count based timer accumulator used by run_cycles and run_until
+        self.instruction_count = 0 #Total number of opcodes executed since construction
         self.rts_keypress = -1 #The register number to store the blocking keypress value in
         self.sound_just_started = False
         self.CYCLE_LENGTH_MICROS = speed
-        random.seed()
+        self.opcode_names, self.opcode_operands = build_decode_tables()
+        self.opcode_cache = {} #Opcode -> handler already bound to this CPU and its operands, filled in as opcodes are first seen
+        self.jit = None #Basic-block translation cache, only created when jit=True
+        if jit:
+            import chip8jit
+            self.jit = chip8jit.BlockCache()
+        self.rng = random.Random() #Each CPU draws Cxkk bytes from its own generator, seeded from system entropy unless reseeded
+        self.memory_share = None #While memory is shared with forks: a one-element list counting the CPUs sharing it
+        self.rng_share = None #The same for the Cxkk generator
+        self.profiler = None #chip8profile.Profiler that run_cycles goes through while profiling is on
+        self.hasher = None #chip8statehash.StateHasher keeping the state hash current while hashing is on
+        self.cfg = None #chip8analysis.ControlFlowGraph of the last ROM loaded: blocks, jump targets and subroutines
+        self.idle_loops = {} #Address -> register of the delay-timer spin loops found in the last ROM loaded
         self.memory[0:80] = [0xF0, 0x90, 0x90, 0x90, 0xF0, 
                           0x20, 0x60, 0x20, 0x20, 0x70,
                           0xF0, 0x10, 0xF0, 0x80, 0xF0,
@@ -51,319 +233,423 @@ class PETChip8CPU:
     def split_word(self, word):
         return (word >> 8, word & 0xF0)
 
-    def execute_zero_series(self, opcode):
-        if opcode == 0x00E0:
-            self.graphics[0:2048] = [0] * 2048 #Clears the screen
+    def op_00E0(self):
+        #00E0 - Clears the screen. Only the pixels that were lit change, and nothing needs redrawing if the screen was already blank
+        lit = int.from_bytes(self.framebuffer, "big")
+        if lit:
+            self.dirty[0:256] = (int.from_bytes(self.dirty, "big") | lit).to_bytes(256, "big")
+            self.framebuffer[0:256] = bytes(256)
             self.draw_flag = True
-            self.program_counter += 2
-        elif opcode == 0x00EE:
-            #Return from subroutine; sets the program counter to the address at the top of the stack and subtracts 1 from the stack pointer (pops it)
-            self.program_counter = self.stack[self.stack_pointer] + 2
-            self.stack_pointer -= 1
-        elif opcode == 0x0000:
-            self.program_counter += 2
-        else:
-            #Old instruction to jump to a machine code routine at NNN, apparently said to be ignored by most modern interpreters
-            self.program_counter = opcode & 0x0FFF
+        self.program_counter += 2
         return
-    
-    def execute_one_series(self, opcode):
+
+    def op_00EE(self):
+        #00EE - Return from subroutine; sets the program counter to the address at the top of the stack and subtracts 1 from the stack pointer (pops it)
+        self.program_counter = self.stack[self.stack_pointer] + 2
+        self.stack_pointer -= 1
+        return
+
+    def op_0000(self):
+        self.program_counter += 2
+        return
+
+    def op_0nnn(self, nnn):
+        #Old instruction to jump to a machine code routine at NNN, apparently said to be ignored by most modern interpreters
+        self.program_counter = nnn
+        return
+
+    def op_1nnn(self, nnn):
         #Jump to opcode at NNN; I guess the modern equivalent of the other command?
-        self.program_counter = opcode & 0x0FFF
+        self.program_counter = nnn
         return
-    
-    def execute_two_series(self, opcode):
+
+    def op_2nnn(self, nnn):
         #Call subroutine at NNN; Increments the stack pointer then puts the current program counter at the top of the stack, then sets the program counter to NNN
         self.stack_pointer += 1
         self.stack[self.stack_pointer] = self.program_counter
-        self.program_counter = opcode & 0x0FFF
+        self.program_counter = nnn
         return
-    
-    def execute_three_series(self, opcode):
+
+    def op_3xkk(self, x, kk):
         #Skip next instruction if Vx == kk
-        register = (opcode & 0x0F00) >> 8
-        data = opcode & 0x00FF
-        if data == self.get_register(register):
+        if kk == self.V[x]:
             self.program_counter += 4
         else:
             self.program_counter += 2
         return
-    
-    def execute_four_series(self,opcode):
+
+    def op_4xkk(self, x, kk):
         #Skip next instruction if Vx != kk
-        register = (opcode & 0x0F00) >> 8
-        data = opcode & 0x00FF
-        if data != self.get_register(register):
+        if kk != self.V[x]:
             self.program_counter += 4
         else:
             self.program_counter += 2
         return
-    
-    def execute_five_series(self, opcode):
+
+    def op_5xy0(self, x, y):
         #Skip next instruction if Vx == Vy
-        register1 = (opcode & 0x0F00) >> 8
-        register2 = (opcode & 0x00F0) >> 4
-        if self.get_register(register1) == self.get_register(register2):
-            self.program_counter += 4 
+        if self.V[x] == self.V[y]:
+            self.program_counter += 4
         else:
             self.program_counter += 2
         return
-    
-    def execute_six_series(self, opcode):
+
+    def op_6xkk(self, x, kk):
         #Set Vx = kk
-        register = (opcode & 0x0F00) >> 8
-        data = opcode & 0x00FF
-        self.set_register(register, data)
+        self.V[x] = kk
         self.program_counter += 2
         return
-    
-    def execute_seven_series(self, opcode):
+
+    def op_7xkk(self, x, kk):
         #Set Vx += kk
-        register = (opcode & 0x0F00) >> 8
-        data = opcode & 0x00FF
-        value = data + self.get_register(register)
-        self.set_register(register, value % 256)
+        V = self.V
+        V[x] = (kk + V[x]) & 0xFF
         self.program_counter += 2
         return
-    
-    def execute_eight_series(self, opcode):
-        #A lot of different instructions here
-        last_byte = opcode & 0x000F
-        if last_byte == 0x0:
-            #8xy0 Set Vx = Vy
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            self.set_register(register1, self.get_register(register2))
-        elif last_byte == 0x1:
-            #8xy1 Set Vx |= Vy
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            self.set_register(register1, self.get_register(register1) | self.get_register(register2))
-        elif last_byte == 0x2:
-            #8xy2 Set Vx &= Vy
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            self.set_register(register1, self.get_register(register1) & self.get_register(register2))
-        elif last_byte == 0x3:
-            #8xy3 Set Vx ^= Vy
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            self.set_register(register1, self.get_register(register1) ^ self.get_register(register2))
-        elif last_byte == 0x4:
-            #8xy4 Set Vx = Vx + Vy, with a carry
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            data = self.get_register(register1) + self.get_register(register2)
-            if data > 255:
-                self.set_register(register1, data % 256)
-                self.set_register(15,1)
-            else:
-                self.set_register(15,0)
-                self.set_register(register1, data)
-        elif last_byte == 0x5:
-            #8xy5 Set Vx = Vx - Vy
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            if self.get_register(register1) > self.get_register(register2):
-                self.set_register(15,1)
-                self.set_register(register1, self.get_register(register1) - self.get_register(register2))
-            else:
-                self.set_register(15,0)
-                self.set_register(register1, self.get_register(register2) - self.get_register(register1))
-        elif last_byte == 0x6:
-            #8xy6 Vx = Vy = Vy >> 1, VF becomes the value of LSB of Vx before shift
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            data1 = self.get_register(register2)
-            self.set_register(15,data1 & 0x01)
-            self.set_register(register1, (data1 >> 1) % 256)
-            self.set_register(register2, (data1 >> 1) % 256)
-        elif last_byte == 0x7:
-            #8xy7 Vx = Vy - Vx, set VF = NOT borrow
-            register1 = (opcode & 0x00F0) >> 4
-            register2 = (opcode & 0x0F00) >> 8
-            if self.get_register(register1) > self.get_register(register2):
-                self.set_register(15,1)
-                self.set_register(register2, self.get_register(register1) - self.get_register(register2))
-            else:
-                self.set_register(15,0)
-                self.set_register(register2, self.get_register(register2) - self.get_register(register1))
-        elif last_byte == 0xE:
-            #8xyE Vx = Vy = Vy << 1, VF becomes the value of MSB of Vx before shift
-            register1 = (opcode & 0x0F00) >> 8
-            register2 = (opcode & 0x00F0) >> 4
-            data2 = self.get_register(register2)
-            self.set_register(15,data2 & 0x80)
-            self.set_register(register1, (data2 << 1) % 256)
-            self.set_register(register2, (data2 << 1) % 256)
+
+    def op_8xy0(self, x, y):
+        #8xy0 Set Vx = Vy
+        V = self.V
+        V[x] = V[y]
         self.program_counter += 2
         return
-    
-    def execute_nine_series(self, opcode):
+
+    def op_8xy1(self, x, y):
+        #8xy1 Set Vx |= Vy
+        V = self.V
+        V[x] |= V[y]
+        self.program_counter += 2
+        return
+
+    def op_8xy2(self, x, y):
+        #8xy2 Set Vx &= Vy
+        V = self.V
+        V[x] &= V[y]
+        self.program_counter += 2
+        return
+
+    def op_8xy3(self, x, y):
+        #8xy3 Set Vx ^= Vy
+        V = self.V
+        V[x] ^= V[y]
+        self.program_counter += 2
+        return
+
+    def op_8xy4(self, x, y):
+        #8xy4 Set Vx = Vx + Vy, with a carry
+        V = self.V
+        data = V[x] + V[y]
+        if data > 255:
+            V[x] = data & 0xFF
+            V[15] = 1
+        else:
+            V[15] = 0
+            V[x] = data
+        self.program_counter += 2
+        return
+
+    def op_8xy5(self, x, y):
+        #8xy5 Set Vx = Vx - Vy, set VF = NOT borrow
+        #Both operands are read before anything is written and VF is written last, so x or y being 15 is well defined
+        V = self.V
+        vx = V[x]
+        vy = V[y]
+        V[x] = (vx - vy) & 0xFF
+        V[15] = 1 if vx > vy else 0
+        self.program_counter += 2
+        return
+
+    def op_8xy6(self, x, y):
+        #8xy6 Vx = Vy = Vy >> 1, VF becomes the value of LSB of Vx before shift
+        V = self.V
+        data = V[y]
+        V[15] = data & 0x01
+        V[x] = data >> 1
+        V[y] = data >> 1
+        self.program_counter += 2
+        return
+
+    def op_8xy7(self, x, y):
+        #8xy7 Vx = Vy - Vx, set VF = NOT borrow
+        V = self.V
+        vx = V[x]
+        vy = V[y]
+        V[x] = (vy - vx) & 0xFF
+        V[15] = 1 if vy > vx else 0
+        self.program_counter += 2
+        return
+
+    def op_8xyE(self, x, y):
+        #8xyE Vx = Vy = Vy << 1, VF becomes the value of MSB of Vx before shift
+        V = self.V
+        data = V[y]
+        V[15] = data & 0x80
+        V[x] = (data << 1) & 0xFF
+        V[y] = (data << 1) & 0xFF
+        self.program_counter += 2
+        return
+
+    def op_skip_word(self):
+        #Unrecognised 8xy? and Fx?? opcodes are stepped over
+        self.program_counter += 2
+        return
+
+    def op_9xy0(self, x, y):
         #Skip next instruction if Vx != Vy
-        register1 = (opcode & 0x0F00) >> 8
-        register2 = (opcode & 0x00F0) >> 4
-        if self.get_register(register1) != self.get_register(register2):
+        if self.V[x] != self.V[y]:
             self.program_counter += 4
         else:
-            self.program_counter += 2   
+            self.program_counter += 2
         return
-    
-    def execute_ten_series(self, opcode):
-        #BNNN - Set I = nnn
-        self.address_register = opcode & 0x0FFF
+
+    def op_Annn(self, nnn):
+        #Annn - Set I = nnn
+        self.address_register = nnn
         self.program_counter += 2
         return
-    
-    def execute_eleven_series(opcode):
+
+    def op_Bnnn(self, nnn):
         #Bnnn - Jump to location nnn + V0
-        self.program_counter = (self.get_register(0) + (opcode & 0x0FFF)) + 512
+        self.program_counter = nnn + self.V[0]
         return
-    
-    def execute_twelve_series(self, opcode):
+
+    def op_Cxkk(self, x, kk):
         #Cxkk - Set Vx to random byte AND kk
-        random_byte = random.randint(0,255)
-        register = (opcode & 0x0F00) >> 8
-        kk = opcode & 0x00FF
-        data = random_byte & kk
-        self.set_register(register,data)
+        if self.rng_share is not None:
+            self.own_rng()
+        self.V[x] = self.rng.randint(0, 255) & kk
         self.program_counter += 2
         return
-    
-    def wrap_gfx(self, val):
-        if val < 2048:
-            return val
+
+    def op_Dxyn(self, x, y, n):
+        #Display n byte sprite starting at memory location I at Vx, Vy; VF is set if any lit pixel is turned off
+        #A sprite row covers at most two framebuffer bytes, so it is shifted into place once, collides with an AND per byte and is
+        #drawn with an XOR per byte. The sprite wraps around both edges of the screen.
+        V = self.V
+        framebuffer = self.framebuffer
+        dirty = self.dirty
+        memory = self.memory
+        address = self.address_register
+        xpos = V[x] & 63
+        ypos = V[y] & 31
+        column = xpos >> 3
+        next_column = (column + 1) & 7
+        shift = xpos & 7
+        collision = 0
+        drawn = False
+        for yline in range(0, n):
+            sprite = memory[address + yline]
+            if sprite == 0:
+                continue
+            drawn = True
+            row = ((ypos + yline) & 31) << 3
+            left = sprite >> shift
+            if framebuffer[row + column] & left:
+                collision = 1
+            framebuffer[row + column] ^= left
+            dirty[row + column] |= left
+            if shift:
+                right = (sprite << (8 - shift)) & 0xFF
+                if framebuffer[row + next_column] & right:
+                    collision = 1
+                framebuffer[row + next_column] ^= right
+                dirty[row + next_column] |= right
+        V[15] = collision
+        if drawn:
+            #An all-zero sprite XORs nothing, so the screen only needs redrawing when some row was non-zero
+            self.draw_flag = True
+        self.program_counter += 2
+        return
+
+    def op_Ex9E(self, x):
+        #Ex9E - Skip next instruction if key with value of Vx is pressed
+        key = self.V[x]
+        if self.keys[key]:
+            self.program_counter += 4
+            self.keys[key] = 0
         else:
-            return val & 0x6FF
-        
-    def execute_thirteen_series(self, opcode):
-        #Display n byte sprite starting at memory location I at Vx, Vy
-        register1 = (opcode & 0x0F00) >> 8
-        register2 = (opcode & 0x00F0) >> 4
-        x = self.get_register(register1)
-        y = self.get_register(register2)
-        height = (opcode & 0x000F)
-        pixel = 0
-        self.set_register(15,0)
-        for yline in range(0, height):
-            pixel = self.memory[self.address_register + yline]
-            for xline in range(0, 8):
-                if pixel & (0x80 >> xline) != 0:
-                    if self.graphics[self.wrap_gfx((y + yline)*64 + (x+xline))] == 1:
-                        self.set_register(15,1)
-                        self.graphics[self.wrap_gfx((y + yline)*64 + (x+xline))] = 0
-                    else:
-                        self.graphics[self.wrap_gfx((y + yline)*64 + (x+xline))] = 1
-        self.draw_flag = True                
+            self.program_counter += 2
+        return
+
+    def op_ExA1(self, x):
+        #ExA1 - Skip next instruction if key with value of Vx is NOT pressed
+        key = self.V[x]
+        if not self.keys[key]:
+            self.program_counter += 4
+        else:
+            self.program_counter += 2
+            self.keys[key] = 0
+        return
+
+    def op_stall(self):
+        #Unrecognised Ex?? opcodes leave the program counter where it is
+        return
+
+    def op_Fx07(self, x):
+        #Fx07 - Set Vx = delay timer value
+        self.V[x] = self.delay_timer
         self.program_counter += 2
         return
-    
-    def execute_fourteen_series(self, opcode):
-        last_byte = opcode & 0x00FF
-        register = (opcode & 0x0F00) >> 8
-        if last_byte == 0x9E:
-            #Ex9E - Skip next instruction if key with value of Vx is pressed
-            if self.keys[self.get_register(register)] == True:
-                self.program_counter += 4
-                self.keys[self.get_register(register)] = False
-            else:
-                self.program_counter += 2
-        elif last_byte == 0xA1:
-            #ExA1 - Skip next instruction if key with value of Vx is NOT pressed
-            if self.keys[self.get_register(register)] == False:
-                self.program_counter += 4
-            else:
-                self.program_counter += 2
-                self.keys[self.get_register(register)] = False
+
+    def op_Fx0A(self, x):
+        #Fx0A - Wait for a key press, store the value of the key in Vx
+        self.blocking_keypress = True
+        self.rts_keypress = x
+        self.program_counter += 2
         return
-    
-    def execute_fifteen_series(self, opcode):
-        last_byte = opcode & 0x00FF
-        register = (opcode & 0x0F00) >> 8
-        if last_byte == 0x07:
-            #Fx07 - Set Vx = delay timer value
-            self.set_register(register, self.delay_timer)
-        elif last_byte == 0x0A:
-            #Fx0A - Wait for a key press, store the value of the key in Vx
-            self.blocking_keypress = True
-            self.rts_keypress = register
-        elif last_byte == 0x15:
-            #Fx15 - Set delay timer = Vx
-            self.delay_timer = self.get_register(register)
-        elif last_byte == 0x18:
-            #Fx18 - Set sound timer = Vx
-            self.sound_timer = self.get_register(register)
-            self.sound_just_started = True
-        elif last_byte == 0x1E:
-            #Fx1E - Set I to I+Vx
-            #VF is set to 1 when there is a range overflow (the new value of I > 0xFFF; this is an undocumented feature used by Spaceflight 2091 (wiki)
-            self.address_register += self.get_register(register)
-            if self.address_register > 0xFFF:
-                self.address_register &= 0xFFF
-                self.set_register(15, 1)
-        elif last_byte == 0x29:
-            #Fx29 - Set I to memory location of sprite for digit Vx
-            self.address_register = self.get_register(register) * 5 #Remember we stored this data from 0 to 80 in the memory array
-        elif last_byte == 0x33:
-            #Fx33 - Store the BCD representation of Vx in memory locations I to I+2
-            #I is increased by 1 for each value written
-            data = self.get_register(register)
-            self.memory[self.address_register] = int(data/100)
-            self.memory[self.address_register + 1] = int((data/10) % 10)
-            self.memory[self.address_register + 2] = int(data % 10)
-        elif last_byte == 0x55:
-            #Fx55 - Store registers V0 through Vx in memory starting at location I
-            for i in range(0, register + 1):
-                self.memory[self.address_register] = self.get_register(i)
-                self.address_register += 1
-        elif last_byte == 0x65:
-            #Fx65 - Read registers V0 through Vx from memory starting at location I
-            for i in range(0, register + 1):
-                self.set_register(i, self.memory[self.address_register])
-                self.address_register += 1
+
+    def op_Fx15(self, x):
+        #Fx15 - Set delay timer = Vx
+        self.delay_timer = self.V[x]
         self.program_counter += 2
         return
-    
+
+    def op_Fx18(self, x):
+        #Fx18 - Set sound timer = Vx
+        self.sound_timer = self.V[x]
+        self.sound_just_started = True
+        self.program_counter += 2
+        return
+
+    def op_Fx1E(self, x):
+        #Fx1E - Set I to I+Vx
+        #VF is set to 1 when there is a range overflow (the new value of I > 0xFFF; this is an undocumented feature used by Spaceflight 2091 (wiki)
+        self.address_register += self.V[x]
+        if self.address_register > 0xFFF:
+            self.address_register &= 0xFFF
+            self.V[15] = 1
+        self.program_counter += 2
+        return
+
+    def op_Fx29(self, x):
+        #Fx29 - Set I to memory location of sprite for digit Vx
+        self.address_register = self.V[x] * 5 #Remember we stored this data from 0 to 80 in the memory array
+        self.program_counter += 2
+        return
+
+    def op_Fx33(self, x):
+        #Fx33 - Store the BCD representation of Vx in memory locations I to I+2
+        data = self.V[x]
+        address = self.address_register
+        if self.memory_share is not None:
+            self.own_memory()
+        self.memory[address] = data // 100
+        self.memory[address + 1] = (data // 10) % 10
+        self.memory[address + 2] = data % 10
+        if self.jit is not None:
+            self.jit.invalidate(address, address + 3)
+        self.program_counter += 2
+        return
+
+    def op_Fx55(self, x):
+        #Fx55 - Store registers V0 through Vx in memory starting at location I
+        #I is increased by 1 for each value written
+        address = self.address_register
+        if address + x >= len(self.memory):
+            raise IndexError("Fx55 writes past the end of memory")
+        if self.memory_share is not None:
+            self.own_memory()
+        self.memory[address:address + x + 1] = self.V[0:x + 1]
+        if self.jit is not None:
+            self.jit.invalidate(address, address + x + 1)
+        self.address_register = address + x + 1
+        self.program_counter += 2
+        return
+
+    def op_Fx65(self, x):
+        #Fx65 - Read registers V0 through Vx from memory starting at location I
+        address = self.address_register
+        if address + x >= len(self.memory):
+            raise IndexError("Fx65 reads past the end of memory")
+        self.V[0:x + 1] = self.memory[address:address + x + 1]
+        self.address_register = address + x + 1
+        self.program_counter += 2
+        return
+
+    def bind_opcode(self, opcode):
+        #Binds the decoded handler to this CPU with its operands already extracted, so dispatch is a single call
+        handler = functools.partial(getattr(self, self.opcode_names[opcode]), *self.opcode_operands[opcode])
+        self.opcode_cache[opcode] = handler
+        return handler
+
     def execute_opcode(self, opcode):
-        if opcode < 0x1000:
-            self.execute_zero_series(opcode)
-        elif opcode < 0x2000:
-            self.execute_one_series(opcode)
-        elif opcode < 0x3000:
-            self.execute_two_series(opcode)
-        elif opcode < 0x4000:
-            self.execute_three_series(opcode)
-        elif opcode < 0x5000:
-            self.execute_four_series(opcode)
-        elif opcode < 0x6000:
-            self.execute_five_series(opcode)
-        elif opcode < 0x7000:
-            self.execute_six_series(opcode)
-        elif opcode < 0x8000:
-            self.execute_seven_series(opcode)
-        elif opcode < 0x9000:
-            self.execute_eight_series(opcode)
-        elif opcode < 0xA000:
-            self.execute_nine_series(opcode)
-        elif opcode < 0xB000:
-            self.execute_ten_series(opcode)
-        elif opcode < 0xC000:
-            self.execute_eleven_series(opcode)
-        elif opcode < 0xD000:
-            self.execute_twelve_series(opcode)
-        elif opcode < 0xE000:
-            self.execute_thirteen_series(opcode)
-        elif opcode < 0xF000:
-            self.execute_fourteen_series(opcode)
-        elif opcode >= 0xF000:
-            self.execute_fifteen_series(opcode)
+        try:
+            handler = self.opcode_cache[opcode]
+        except KeyError:
+            handler = self.bind_opcode(opcode)
+        handler()
         return
     
+    @property
+    def graphics(self):
+        #Compatibility snapshot for code written against the old 2048 entry list: the screen unpacked to one byte per pixel
+        #(0 or 1) in row-major order. It is read-only bytes, so writing through it raises rather than changing a throwaway
+        #copy. Change the screen through framebuffer instead.
+        return self.unpacked_framebuffer()
+
+    def unpacked_framebuffer(self):
+        #The screen as 2048 bytes, one per pixel (0 or 1) in row-major order, ready for an 8-bit surface or a texture upload
+        return b"".join([PIXEL_BYTES[byte] for byte in self.framebuffer])
+
+    def get_pixel(self, x, y):
+        return (self.framebuffer[(y << 3) | (x >> 3)] >> (7 - (x & 7))) & 1
+
+    def consume_dirty_regions(self):
+        #Returns the screen areas that changed since the last call as (x, y, width, height) rectangles in CHIP-8 pixels, and resets the tracking.
+        #Within a row, each run of adjacent changed bytes becomes one span, trimmed to its first and last changed pixel; a sprite
+        #wrapping off the right edge therefore gives two small spans. Spans repeated on consecutive rows are merged.
+        regions = []
+        open_regions = {} #(x, width) -> index in regions of the rectangle that reached the previous row
+        dirty = self.dirty
+        for y in range(0, 32):
+            row = y << 3
+            if not any(dirty[row:row + 8]):
+                open_regions = {}
+                continue
+            still_open = {}
+            column = 0
+            while column < 8:
+                if dirty[row + column] == 0:
+                    column += 1
+                    continue
+                first = column
+                while column < 8 and dirty[row + column]:
+                    column += 1
+                left = (first << 3) + 8 - dirty[row + first].bit_length()
+                last_byte = dirty[row + column - 1]
+                right = (column << 3) - (last_byte & -last_byte).bit_length() + 1
+                span = (left, right - left)
+                if span in open_regions:
+                    index = open_regions[span]
+                    x, top, width, height = regions[index]
+                    regions[index] = (x, top, width, height + 1)
+                else:
+                    index = len(regions)
+                    regions.append((left, y, right - left, 1))
+                still_open[span] = index
+            open_regions = still_open
+        dirty[0:256] = bytes(256)
+        return regions
+
+    @property
+    def registers(self):
+        return RegisterView(self.V)
+
+    @registers.setter
+    def registers(self, values):
+        #Accepts either a {"V0": ...} mapping or a sequence of 16 values
+        if isinstance(values, Mapping):
+            for name, value in values.items():
+                self.V[RegisterView(self.V).index(name)] = value
+        else:
+            self.V[0:16] = bytes(values)
+        return
+
     def get_register(self, register):
-        return self.registers["V" + str(register)]
+        return self.V[register]
     
     def set_register(self, register, value):
-        self.registers["V" + str(register)] = value        
+        self.V[register] = value
         return
     
     def emulate_instruction(self, delta):
@@ -381,20 +667,250 @@ class PETChip8CPU:
                     self.sound_timer -= 1
                     self.sound_deltasum = 0
         if self.cycle_deltasum >= self.CYCLE_LENGTH_MICROS:
-            opcode = self.create_word(self.memory[self.program_counter], self.memory[self.program_counter+1])
-            self.execute_opcode(opcode)
+            self.step()
             self.cycle_deltasum = 0
             return True
         else:
             return False
+
+    def step(self):
+        #Fetches, decodes and executes a single opcode, without touching the timers
+        opcode = self.create_word(self.memory[self.program_counter], self.memory[self.program_counter+1])
+        self.execute_opcode(opcode)
+        self.instruction_count += 1
+        return
+
+    def tick_timers(self):
+        #Counts both timers down by one 60 Hz tick
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+        if self.sound_timer > 0:
+            self.sound_timer -= 1
+        return
+
+    def run_cycles(self, cycles, timers=True):
+        #Executes up to the given number of opcodes back to back, with no wall-clock gating.
+        #Stops early if the program blocks waiting for a keypress (Fx0A). Returns the number of opcodes executed.
+        #With timers=False the timers are left alone, for hosts that tick them once per frame themselves.
+        if self.hasher is not None:
+            return self.hasher.run_cycles(self, cycles, timers) #Runs the profiler's loop too when both are on
+        if self.profiler is not None:
+            return self.profiler.run_cycles(self, cycles, timers)
+        if self.jit is not None:
+            return self.jit.run_cycles(self, cycles, timers)
+        return self.interpret_cycles(cycles, timers)
+
+    def interpret_cycles(self, cycles, timers=True):
+        #The interpreter loop behind run_cycles: fetch, dispatch through the decode tables and account the timers, one opcode at a time
+        executed = 0
+        cache = self.opcode_cache
+        step = self.CENTICYCLES_PER_INSTRUCTION if timers else 0 #Without timers the accumulator never moves, so it never ticks
+        period = self.TIMER_PERIOD_CENTICYCLES
+        centicycles = self.timer_centicycles #Only the timers depend on this, so it is kept local and written back on the way out, even if an opcode raises
+        try:
+            while executed < cycles:
+                if self.blocking_keypress:
+                    break
+                pc = self.program_counter
+                memory = self.memory #Reread every opcode, since a write to memory shared with a fork swaps in a private copy
+                opcode = (memory[pc] << 8) | memory[pc + 1]
+                try:
+                    handler = cache[opcode]
+                except KeyError:
+                    handler = self.bind_opcode(opcode)
+                handler()
+                executed += 1
+                centicycles += step
+                if centicycles >= period:
+                    centicycles -= period
+                    self.tick_timers()
+                    #Only checked when the timers move, so the spin loop is caught within a few ticks at no cost to other opcodes
+                    if self.program_counter in self.idle_loops and executed < cycles:
+                        self.timer_centicycles = centicycles
+                        executed += self.skip_idle_loop(cycles - executed)
+                        centicycles = self.timer_centicycles
+        finally:
+            self.timer_centicycles = centicycles
+            self.instruction_count += executed
+        return executed
+
+    def skip_idle_loop(self, budget):
+        #With the program counter at the Fx07 of an idle loop "Fx07; SE Vx, 0; JP back", works out how many times the loop
+        #would go round before it reads a zero delay timer, and applies that many iterations to the timers and Vx at once.
+        #At most budget opcodes are skipped. Returns the number skipped, which the caller adds to its count.
+        pc = self.program_counter
+        x = self.idle_loops[pc]
+        memory = self.memory
+        delay = self.delay_timer
+        if (delay == 0 or memory[pc] != 0xF0 | x or memory[pc + 1] != 0x07 or memory[pc + 2] != 0x30 | x or memory[pc + 3] != 0x00
+                or memory[pc + 4] != 0x10 | (pc >> 8) or memory[pc + 5] != pc & 0xFF):
+            return 0 #The loop has been overwritten since it was found, or is about to exit anyway
+        period = self.TIMER_PERIOD_CENTICYCLES
+        lap = 3 * self.CENTICYCLES_PER_INSTRUCTION
+        start = self.timer_centicycles
+        #The Fx07 of lap i sees the delay timer after (start + i * lap) // period ticks; the loop exits on the first lap it reads 0
+        laps = min(-(-(delay * period - start) // lap), budget // 3)
+        if laps <= 0:
+            return 0
+        ticks = (start + laps * lap) // period
+        self.V[x] = delay - (start + (laps - 1) * lap) // period
+        self.delay_timer = delay - ticks
+        self.sound_timer = max(0, self.sound_timer - ticks)
+        self.timer_centicycles = start + laps * lap - ticks * period
+        return laps * 3
+
+    def run_until(self, predicate, max_cycles=None):
+        #Executes opcodes back to back until predicate(self) returns True, the program blocks on a keypress,
+        #or max_cycles opcodes have run. The predicate is checked before every opcode. Returns the number of opcodes executed.
+        executed = 0
+        while not predicate(self):
+            if max_cycles is not None and executed >= max_cycles:
+                break
+            if self.run_cycles(1) == 0:
+                break
+            executed += 1
+        return executed
     
+    def start_profiling(self, profiler=None):
+        #Routes run_cycles through an instrumented copy of the interpreter loop until stop_profiling. Returns the profiler,
+        #a fresh chip8profile.Profiler unless one is passed in to keep accumulating.
+        if profiler is None:
+            import chip8profile
+            profiler = chip8profile.Profiler()
+        self.profiler = profiler
+        return profiler
+
+    def stop_profiling(self):
+        profiler = self.profiler
+        self.profiler = None
+        return profiler
+
+    def start_hashing(self):
+        #Routes run_cycles through handlers that keep a Zobrist hash of the machine state up to date until stop_hashing.
+        #Returns the chip8statehash.StateHasher; hasher.hash(cpu) reads the hash, and forks carry their own copy.
+        import chip8statehash
+        self.hasher = chip8statehash.StateHasher(self)
+        return self.hasher
+
+    def stop_hashing(self):
+        hasher = self.hasher
+        self.hasher = None
+        return hasher
+
+    def press_key(self, key):
+        #Holds a key down for headless callers, and completes an Fx0A wait if the program is blocked on one
+        self.keys[key] = 1
+        if self.blocking_keypress:
+            self.V[self.rts_keypress] = key
+            self.blocking_keypress = False
+        return
+
+    def release_key(self, key):
+        self.keys[key] = 0
+        return
+
     def load(self, filename):
-        romsize = os.stat(filename).st_size
         fin = open(filename, "rb")
-        self.memory[512:512+romsize] = list(fin.read())
+        rom = fin.read(len(self.memory) - 512)
         fin.close()
+        if self.memory_share is not None:
+            self.own_memory()
+        self.memory[512:512+len(rom)] = rom
+        if self.jit is not None:
+            self.jit.invalidate(512, 512 + len(rom))
+        import chip8analysis
+        self.cfg = chip8analysis.analyze(self.memory, 0x200, 512 + len(rom))
+        self.idle_loops = chip8analysis.find_idle_loops(self.memory, self.cfg)
+        if self.hasher is not None:
+            self.hasher.reset(self)
         return
     
+    def fork(self):
+        #Returns an independent copy of the machine that can be run with different inputs.
+        #Memory and the Cxkk generator are shared with the parent until either side writes to them, and only then copied,
+        #so a fork costs the registers, stack, keys and screen. Handler bindings and translated blocks are rebuilt lazily.
+        child = object.__new__(type(self))
+        for name in PETChip8CPU.__slots__:
+            setattr(child, name, getattr(self, name))
+        if hasattr(self, "__dict__"):
+            child.__dict__.update(self.__dict__)
+        child.V = bytearray(self.V)
+        child.stack = array.array("H", self.stack)
+        child.keys = bytearray(self.keys)
+        child.framebuffer = bytearray(self.framebuffer)
+        child.dirty = bytearray(self.dirty)
+        child.opcode_cache = {}
+        child.profiler = None
+        if self.hasher is not None:
+            child.hasher = self.hasher.fork(child)
+        if self.jit is not None:
+            child.jit = type(self.jit)()
+        if self.memory_share is None:
+            self.memory_share = [1]
+        self.memory_share[0] += 1
+        if self.rng_share is None:
+            self.rng_share = [1]
+        self.rng_share[0] += 1
+        child.memory_share = self.memory_share
+        child.rng_share = self.rng_share
+        return child
+
+    def own_memory(self):
+        #Called before writing to memory that is shared with forks: the last CPU holding it keeps it, the others take a copy
+        self.memory_share[0] -= 1
+        if self.memory_share[0] > 0:
+            self.memory = bytearray(self.memory)
+        self.memory_share = None
+        return
+
+    def own_rng(self):
+        #As own_memory, for the Cxkk generator: a copy continues the same sequence from the point of the fork
+        self.rng_share[0] -= 1
+        if self.rng_share[0] > 0:
+            rng = random.Random()
+            rng.setstate(self.rng.getstate())
+            self.rng = rng
+        self.rng_share = None
+        return
+
+    def save_state(self, buffer=None):
+        #Serialises the whole machine into the fixed STATE_FORMAT layout, into buffer if one is given (it must hold STATE_SIZE bytes)
+        if buffer is None:
+            buffer = bytearray(STATE_SIZE)
+        flags = (1 if self.blocking_keypress else 0) | (2 if self.sound_just_started else 0)
+        STATE_FORMAT.pack_into(buffer, 0, STATE_MAGIC, STATE_VERSION, self.program_counter, self.address_register,
+                               self.stack_pointer, self.delay_timer, self.sound_timer, self.timer_centicycles, self.rts_keypress,
+                               flags, self.instruction_count, *self.stack, bytes(self.V), bytes(self.keys),
+                               bytes(self.framebuffer), bytes(self.memory))
+        return buffer
+
+    def load_state(self, state):
+        #Restores a machine saved by save_state. The whole screen is marked dirty so frontends repaint it.
+        #The Cxkk generator is not part of the state; reseed cpu.rng as well when a restored run has to be reproducible.
+        if len(state) < STATE_SIZE:
+            raise ValueError("Save state is %d bytes, expected %d" % (len(state), STATE_SIZE))
+        fields = STATE_FORMAT.unpack_from(state, 0)
+        if fields[0] != STATE_MAGIC or fields[1] != STATE_VERSION:
+            raise ValueError("Not a version %d CHIP-8 save state" % STATE_VERSION)
+        (self.program_counter, self.address_register, self.stack_pointer, self.delay_timer, self.sound_timer,
+         self.timer_centicycles, self.rts_keypress, flags, self.instruction_count) = fields[2:11]
+        self.blocking_keypress = bool(flags & 1)
+        self.sound_just_started = bool(flags & 2)
+        self.stack[0:16] = array.array("H", fields[11:27])
+        self.V[0:16] = fields[27]
+        self.keys[0:16] = fields[28]
+        self.framebuffer[0:256] = fields[29]
+        if self.memory_share is not None:
+            self.own_memory()
+        self.memory[0:4096] = fields[30]
+        self.dirty[0:256] = b"\xff" * 256
+        self.draw_flag = True
+        if self.jit is not None:
+            self.jit.clear()
+        if self.hasher is not None:
+            self.hasher.reset(self)
+        return
+
     def print_state(self):
         print(self.registers)
         print("Stack pointer", self.stack_pointer)
@@ -404,97 +920,18 @@ class PETChip8CPU:
         return
 
     def dump_disassembly(self, infile, outfile):
-        infile = open(infile, "rb")
-        fdata = list(infile.read())
-        infile.close()
-        outfile = open(outfile, "w")
-        for i in range(0, len(fdata), 2):
-            opcode = self.create_word(fdata[i],fdata[i+1])
-            outfile.write(str(i) + ": ")
-            if opcode < 0x1000:
-                if opcode == 0x00E0:
-                    outfile.write("CLS \n")
-                elif opcode == 0x00EE:
-                    outfile.write("RET \n")
-                else:
-                    outfile.write("SPACE \n")
-            elif opcode < 0x2000:
-                outfile.write("JMPOS " + str((opcode & 0x0FFF) - 512) + "\n")
-            elif opcode < 0x3000:
-                outfile.write("CALL " + str((opcode & 0x0FFF) - 512) + "\n")
-            elif opcode < 0x4000:
-                outfile.write("SE " + "V" + str((opcode & 0xF00) >> 8) + ", " + str(opcode & 0x00FF) + "\n")
-            elif opcode < 0x5000:
-                outfile.write("SNE V" + str((opcode & 0xF00) >> 8) + ", " + str(opcode & 0x00FF) + "\n")
-            elif opcode < 0x6000:
-                outfile.write("SE " + "V" + str((opcode & 0xF00) >> 8) + ", " + str(opcode & 0x00FF) + "\n")
-            elif opcode < 0x7000:
-                outfile.write("LD " + "V" + str((opcode & 0xF00) >> 8) + ", " + str(opcode & 0x00FF) + "\n")
-            elif opcode < 0x8000:
-                outfile.write("ADD V" + str((opcode & 0xF00) >> 8) + ", " + str(opcode & 0x00FF) + "\n")
-            elif opcode < 0x9000:
-                lesser = opcode & 0x1
-                if lesser == 0:
-                    outfile.write("LD V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 1:
-                    outfile.write("OR V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 2:
-                    outfile.write("AND V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 3:
-                    outfile.write("XOR V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 4:
-                    outfile.write("ADD V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 5:
-                    outfile.write("SUB V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 6:
-                    outfile.write("SHR V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 7:
-                    outfile.write("SUBN V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                elif lesser == 0xE:
-                    outfile.write("SHL V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-                else:
-                    outfile.write("Not implemented \n")
-            elif opcode < 0xA000:
-                outfile.write("SNE V" +  str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + "\n")
-            elif opcode < 0xB000:
-                outfile.write("LD I, " + str(opcode & 0xFFF) + "\n")
-            elif opcode < 0xC000:
-                outfile.write("JP V" + str(opcode & 0xFFF) + "\n")
-            elif opcode < 0xD000:
-                outfile.write("RAND V" + str((opcode & 0xF00) >> 8) + " " + str((opcode & 0x00FF)) + "\n")
-            elif opcode < 0xE000:
-                outfile.write("DRW V" + str((opcode & 0xF00) >> 8) + ", V" + str((opcode & 0x00F0) >> 4) + ", " + str(opcode & 0x000F) + "\n")
-            elif opcode < 0xF000:
-                lesser = opcode & 0xFF
-                if lesser == 0x9E:
-                    outfile.write("SKP V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0xA1:
-                    outfile.write("SKNP V" + str((opcode & 0x0F00) >> 8) + "\n")
-                else:
-                    outfile.write("Unimplemented \n")
-            else:
-                lesser = opcode & 0xFF
-                if lesser == 0x07:
-                    outfile.write("LD V" + str((opcode & 0x0F00) >> 8) + ", DT \n")
-                elif lesser == 0x0A:
-                    outfile.write("LD V" + str((opcode & 0x0F00) >> 8) + ", K \n")
-                elif lesser == 0x15:
-                    outfile.write("LD DT, V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0x18:
-                    outfile.write("LD ST, V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0x1E:
-                    outfile.write("ADD I, V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0x29:
-                    outfile.write("LD F, V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0x33:
-                    outfile.write("LD B, V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0x55:
-                    outfile.write("LD [I], V" + str((opcode & 0x0F00) >> 8) + "\n")
-                elif lesser == 0x65:
-                    outfile.write("LD V" + str((opcode & 0x0F00) >> 8) + ", [I]\n")
-                else:
-                    outfile.write(str(opcode) + "\n")
-        outfile.close()
+        #Writes an annotated listing of a ROM file, as loaded at 0x200: only code reachable from the entry point is decoded
+        #as instructions, with labels for subroutines, jump targets and sprite data, and everything else is listed as data
+        import chip8analysis
+        fin = open(infile, "rb")
+        rom = fin.read(len(self.memory) - 512)
+        fin.close()
+        image = bytearray(512) + rom
+        cfg = chip8analysis.analyze(image, 0x200, len(image))
+        lines = ["; " + os.path.basename(infile)] + chip8analysis.disassembly_lines(image, cfg)
+        fout = open(outfile, "w")
+        fout.write("\n".join(lines) + "\n")
+        fout.close()
         return
 
     def draw_screen(self): #To be implemented by the derived class
@@ -0,0 +1,308 @@
+import bisect
+import os
+import struct
+import sys
+
+import chip8
+
+#Static analysis of a CHIP-8 program.
+#analyze() follows every path from the entry point through jumps, calls, returns and skips, the way the CPU would,
+#and builds a ControlFlowGraph: which addresses hold reachable instructions, how they split into basic blocks, where
+#the jump targets and subroutines are, and which bytes are never executed and so are sprite or other data.
+#Self-modifying code and Bnnn jump tables cannot be followed statically; Bnnn sites are listed in indirect_jumps.
+
+#Opcodes after which execution does not simply fall through to the next instruction
+JUMPS = {"op_0nnn", "op_1nnn"}
+SKIPS = {"op_3xkk", "op_4xkk", "op_5xy0", "op_9xy0", "op_Ex9E", "op_ExA1"}
+DEAD_ENDS = {"op_00EE", "op_Bnnn", "op_stall"} #No statically known successor
+BLOCK_ENDS = JUMPS | SKIPS | DEAD_ENDS | {"op_2nnn"}
+
+#Handler name -> assembler template, in the common Cowgod syntax. {x}, {y}, {n} and {kk} are operands, {target} is an
+#address or its label.
+MNEMONICS = {"op_00E0": "CLS", "op_00EE": "RET", "op_0000": "NOP", "op_0nnn": "SYS {target}", "op_1nnn": "JP {target}",
+             "op_2nnn": "CALL {target}", "op_3xkk": "SE V{x:X}, {kk:#04x}", "op_4xkk": "SNE V{x:X}, {kk:#04x}",
+             "op_5xy0": "SE V{x:X}, V{y:X}", "op_6xkk": "LD V{x:X}, {kk:#04x}", "op_7xkk": "ADD V{x:X}, {kk:#04x}",
+             "op_8xy0": "LD V{x:X}, V{y:X}", "op_8xy1": "OR V{x:X}, V{y:X}", "op_8xy2": "AND V{x:X}, V{y:X}",
+             "op_8xy3": "XOR V{x:X}, V{y:X}", "op_8xy4": "ADD V{x:X}, V{y:X}", "op_8xy5": "SUB V{x:X}, V{y:X}",
+             "op_8xy6": "SHR V{x:X}, V{y:X}", "op_8xy7": "SUBN V{x:X}, V{y:X}", "op_8xyE": "SHL V{x:X}, V{y:X}",
+             "op_skip_word": "DW {opcode:#06x}", "op_9xy0": "SNE V{x:X}, V{y:X}", "op_Annn": "LD I, {target}",
+             "op_Bnnn": "JP V0, {target}", "op_Cxkk": "RND V{x:X}, {kk:#04x}", "op_Dxyn": "DRW V{x:X}, V{y:X}, {n}",
+             "op_Ex9E": "SKP V{x:X}", "op_ExA1": "SKNP V{x:X}", "op_stall": "DW {opcode:#06x}",
+             "op_Fx07": "LD V{x:X}, DT", "op_Fx0A": "LD V{x:X}, K", "op_Fx15": "LD DT, V{x:X}", "op_Fx18": "LD ST, V{x:X}",
+             "op_Fx1E": "ADD I, V{x:X}", "op_Fx29": "LD F, V{x:X}", "op_Fx33": "LD B, V{x:X}", "op_Fx55": "LD [I], V{x:X}",
+             "op_Fx65": "LD V{x:X}, [I]"}
+
+#Every opcode's (mnemonic, operands) pair, built on first use by build_mnemonic_table
+_mnemonic_table = None
+
+def operand_fields(opcode):
+    return {"opcode": opcode, "x": (opcode & 0x0F00) >> 8, "y": (opcode & 0x00F0) >> 4, "n": opcode & 0x000F,
+            "kk": opcode & 0x00FF, "nnn": opcode & 0x0FFF}
+
+def format_opcode(opcode, target=None):
+    #Assembler text for one opcode; target replaces the raw nnn address, e.g. with a label
+    fields = operand_fields(opcode)
+    fields["target"] = target if target is not None else "%#05x" % fields["nnn"]
+    return MNEMONICS[chip8.build_decode_tables()[0][opcode]].format(**fields)
+
+def build_mnemonic_table():
+    #Returns a 65536-entry list indexed by opcode of (mnemonic, operand strings), e.g. ("DRW", ("VA", "VB", "6")).
+    #Equal pairs are shared, so the table costs little more than its list.
+    global _mnemonic_table
+    if _mnemonic_table is None:
+        interned = {}
+        table = []
+        for opcode in range(0x10000):
+            text = format_opcode(opcode)
+            mnemonic, _, rest = text.partition(" ")
+            entry = (mnemonic, tuple(rest.split(", ")) if rest else ())
+            table.append(interned.setdefault(entry, entry))
+        _mnemonic_table = table
+    return _mnemonic_table
+
+def disassemble(buffer, origin=0x200):
+    #Generator over a linear sweep of buffer (bytes, bytearray, mmap or memoryview), loaded at origin, yielding
+    #(address, opcode, mnemonic, operands) for every two-byte word. A trailing odd byte comes out as (address, byte, "DB", (hex,)).
+    table = build_mnemonic_table()
+    view = memoryview(buffer)
+    even = len(view) & ~1
+    address = origin
+    for (opcode,) in struct.iter_unpack(">H", view[:even]):
+        mnemonic, operands = table[opcode]
+        yield (address, opcode, mnemonic, operands)
+        address += 2
+    if even < len(view):
+        yield (address, view[even], "DB", ("%#04x" % view[even],))
+    view.release()
+    return
+
+def disassemble_file(filename, origin=0x200):
+    #As disassemble, reading the ROM through a memory map instead of copying it into memory
+    import mmap
+    fin = open(filename, "rb")
+    try:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield from disassemble(mapped, origin)
+        finally:
+            mapped.close()
+    finally:
+        fin.close()
+    return
+
+class ControlFlowGraph:
+    #Queryable index of a program's reachable code. Addresses are absolute (the entry point is normally 0x200).
+    __slots__ = ("entry", "end", "instructions", "blocks", "block_starts", "jump_targets", "subroutines", "calls",
+                 "data_references", "indirect_jumps")
+
+    def __init__(self, entry, end):
+        self.entry = entry
+        self.end = end #One past the last byte of the program
+        self.instructions = {} #Address of every reachable instruction -> opcode
+        self.blocks = {} #Block start -> (end address, tuple of successor block starts)
+        self.block_starts = [] #Sorted block starts, for block_containing
+        self.jump_targets = set() #Destinations of JP, SYS and skips
+        self.subroutines = set() #CALL destinations
+        self.calls = set() #(call site, subroutine) pairs
+        self.data_references = set() #LD I, nnn operands, normally sprites
+        self.indirect_jumps = set() #Bnnn sites, whose destination depends on V0
+        return
+
+    def is_code(self, address):
+        return address in self.instructions
+
+    def is_block_start(self, address):
+        return address in self.blocks
+
+    def block_containing(self, address):
+        #Returns the start of the block holding the instruction at address, or None if it is not reachable code
+        if address not in self.instructions:
+            return None
+        index = bisect.bisect_right(self.block_starts, address) - 1
+        return self.block_starts[index]
+
+    def successors(self, start):
+        return self.blocks[start][1]
+
+    def code_bytes(self):
+        #Addresses of every byte covered by a reachable instruction
+        covered = set()
+        for address in self.instructions:
+            covered.add(address)
+            covered.add(address + 1)
+        return covered
+
+    def data_ranges(self):
+        #(start, end) runs of program bytes that are never executed
+        covered = self.code_bytes()
+        ranges = []
+        start = None
+        for address in range(self.entry, self.end):
+            if address in covered:
+                if start is not None:
+                    ranges.append((start, address))
+                    start = None
+            elif start is None:
+                start = address
+        if start is not None:
+            ranges.append((start, self.end))
+        return ranges
+
+    def label(self, address):
+        #The name the disassembly gives an address, or None
+        if address == self.entry:
+            return "main"
+        elif address in self.subroutines:
+            return "sub_%03X" % address
+        elif address in self.jump_targets and address in self.instructions:
+            return "L_%03X" % address
+        elif address in self.data_references:
+            return "data_%03X" % address
+        return None
+
+def analyze(memory, entry=0x200, end=None):
+    #Builds the ControlFlowGraph of the program in memory (a 4 KB image or anything indexable), starting at entry.
+    #Only addresses below end are followed; end defaults to the size of memory.
+    if end is None:
+        end = len(memory)
+    names = chip8.build_decode_tables()[0]
+    cfg = ControlFlowGraph(entry, end)
+    leaders = {entry}
+    pending = [entry]
+    while pending:
+        address = pending.pop()
+        while entry <= address and address + 1 < end and address not in cfg.instructions:
+            opcode = (memory[address] << 8) | memory[address + 1]
+            cfg.instructions[address] = opcode
+            name = names[opcode]
+            targets = ()
+            if name in JUMPS:
+                targets = (opcode & 0x0FFF,)
+                cfg.jump_targets.add(opcode & 0x0FFF)
+            elif name == "op_2nnn":
+                targets = (opcode & 0x0FFF, address + 2)
+                cfg.subroutines.add(opcode & 0x0FFF)
+                cfg.calls.add((address, opcode & 0x0FFF))
+            elif name in SKIPS:
+                targets = (address + 2, address + 4)
+                cfg.jump_targets.add(address + 4)
+            elif name == "op_Annn":
+                cfg.data_references.add(opcode & 0x0FFF)
+            elif name == "op_Bnnn":
+                cfg.indirect_jumps.add(address)
+            if name in BLOCK_ENDS:
+                for target in targets:
+                    leaders.add(target)
+                    pending.append(target)
+                break
+            address += 2
+    starts = sorted(address for address in leaders if address in cfg.instructions)
+    leader_set = set(starts)
+    for start in starts:
+        address = start
+        while True:
+            name = names[cfg.instructions[address]]
+            following = address + 2
+            if name in BLOCK_ENDS or following not in cfg.instructions or following in leader_set:
+                break
+            address = following
+        opcode = cfg.instructions[address]
+        if name in JUMPS:
+            successors = (opcode & 0x0FFF,)
+        elif name == "op_2nnn":
+            successors = (opcode & 0x0FFF, address + 2)
+        elif name in SKIPS:
+            successors = (address + 2, address + 4)
+        elif name in DEAD_ENDS:
+            successors = ()
+        else:
+            successors = (address + 2,)
+        cfg.blocks[start] = (address + 2, tuple(target for target in successors if target in cfg.instructions))
+    cfg.block_starts = starts
+    return cfg
+
+def find_idle_loops(memory, cfg):
+    #Returns {address: x} for every reachable delay-timer spin loop "Fx07; SE Vx, 0; JP address" in the program,
+    #which does nothing but wait for the delay timer to run out
+    loops = {}
+    for address, opcode in cfg.instructions.items():
+        if opcode & 0xF0FF == 0xF007:
+            x = (opcode & 0x0F00) >> 8
+            if cfg.instructions.get(address + 2) == 0x3000 | (x << 8) and cfg.instructions.get(address + 4) == 0x1000 | address:
+                loops[address] = x
+    return loops
+
+def disassembly_lines(memory, cfg):
+    #The annotated listing of a program as a list of lines: labels, one instruction per line, and never-executed bytes
+    #shown as DB rows of up to eight bytes, each row also drawn as pixels since these are usually sprites
+    lines = ["; %d instructions in %d blocks, %d subroutines, %d data bytes" %
+             (len(cfg.instructions), len(cfg.blocks), len(cfg.subroutines),
+              sum(stop - start for start, stop in cfg.data_ranges()))]
+    address = cfg.entry
+    while address < cfg.end:
+        label = cfg.label(address)
+        if label is not None:
+            lines.append("")
+            lines.append(label + ":")
+        if address in cfg.instructions:
+            opcode = cfg.instructions[address]
+            target = None
+            if opcode >> 12 in (0x0, 0x1, 0x2, 0xA, 0xB):
+                target = cfg.label(opcode & 0x0FFF)
+            lines.append("    %03X: %04X    %s" % (address, opcode, format_opcode(opcode, target)))
+            address += 2
+        else:
+            #A data run goes on to the next labelled address or reachable instruction, eight bytes at most per row
+            stop = address + 1
+            while stop < cfg.end and stop - address < 8 and stop not in cfg.instructions and cfg.label(stop) is None:
+                stop += 1
+            row = memory[address:stop]
+            lines.append("    %03X: DB %-39s ; %s" % (address, ", ".join("%#04x" % byte for byte in row),
+                                                    " ".join(format(byte, "08b").replace("0", ".").replace("1", "#") for byte in row)))
+            address = stop
+    return lines
+
+def write_listing(job):
+    #Disassembles one (rom, output, annotate) job and returns (rom, output, instructions)
+    rom, output, annotate = job
+    if annotate:
+        fin = open(rom, "rb")
+        image = bytearray(512) + fin.read(4096 - 512)
+        fin.close()
+        cfg = analyze(image, 0x200, len(image))
+        lines = ["; " + os.path.basename(rom)] + disassembly_lines(image, cfg)
+        count = len(cfg.instructions)
+    else:
+        lines = ["%03X: %-4s    %s %s" % (address, "%02X" % opcode if mnemonic == "DB" else "%04X" % opcode, mnemonic, ", ".join(operands))
+                 for address, opcode, mnemonic, operands in disassemble_file(rom)]
+        count = len(lines)
+    fout = open(output, "w")
+    fout.write("\n".join(lines) + "\n")
+    fout.close()
+    return (rom, output, count)
+
+def main(argv=None):
+    #The command line tool's imports live here, so that load() pulling in analyze() does not pay for them
+    import argparse
+    import concurrent.futures
+    parser = argparse.ArgumentParser(description="Disassemble every ROM in a directory on a process pool, one listing per ROM.")
+    parser.add_argument("roms", help="directory of ROMs, or a single ROM file")
+    parser.add_argument("output", help="directory to write the .asm listings to")
+    parser.add_argument("--annotate", action="store_true", help="follow the control flow and label code and data instead of a linear sweep")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+    if os.path.isdir(args.roms):
+        roms = sorted(os.path.join(args.roms, name) for name in os.listdir(args.roms) if os.path.isfile(os.path.join(args.roms, name)))
+    else:
+        roms = [args.roms]
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(rom, os.path.join(args.output, os.path.basename(rom) + ".asm"), args.annotate) for rom in roms]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for rom, output, count in executor.map(write_listing, jobs, chunksize=max(1, len(jobs) // ((args.workers or os.cpu_count() or 1) * 4))):
+            sys.stderr.write("%s: %d instructions -> %s\n" % (rom, count, output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import array
+import wave
+
+#Sound for the CHIP-8 buzzer.
+#The tone is synthesised once as a one-second loop of a square wave (a whole number of periods for any whole frequency, so it
+#repeats without a click). A sink is told the sound timer once per frame through update(), and starts or stops the tone only
+#when the timer crosses zero, so nothing ever waits for a beep to finish.
+
+SAMPLE_RATE = 44100
+
+def square_wave(frequency=440, sample_rate=SAMPLE_RATE, volume=0.25, channels=1):
+    #One second of a square wave as signed 16-bit samples, each repeated across the given number of interleaved channels
+    amplitude = int(32767 * volume)
+    half_period = sample_rate / (2 * frequency)
+    samples = array.array("h")
+    for index in range(sample_rate):
+        samples.extend([amplitude if int(index / half_period) % 2 == 0 else -amplitude] * channels)
+    return samples.tobytes()
+
+class AudioSink:
+    #Base class: subclasses implement start() and stop(), and may override frame() to do something every frame
+    def __init__(self):
+        self.playing = False
+        return
+
+    def update(self, sound_timer):
+        #Called once per frame with the sound timer; the buzzer sounds while it is above zero
+        playing = sound_timer > 0
+        if playing != self.playing:
+            self.playing = playing
+            if playing:
+                self.start()
+            else:
+                self.stop()
+        self.frame()
+        return
+
+    def start(self):
+        return
+
+    def stop(self):
+        return
+
+    def frame(self):
+        return
+
+    def close(self):
+        if self.playing:
+            self.playing = False
+            self.stop()
+        return
+
+class NullSink(AudioSink):
+    #Plays nothing; counts how often the buzzer started, for headless runs and tests
+    def __init__(self):
+        super().__init__()
+        self.starts = 0
+        return
+
+    def start(self):
+        self.starts += 1
+        return
+
+class WavSink(AudioSink):
+    #Writes what would have been heard to a WAV file, one frame's worth of tone or silence per update
+    def __init__(self, filename, frame_rate=60, frequency=440, sample_rate=SAMPLE_RATE):
+        super().__init__()
+        self.tone = square_wave(frequency, sample_rate)
+        self.silence = bytes(2 * (sample_rate // frame_rate))
+        self.frame_bytes = len(self.silence)
+        self.position = 0 #Byte offset into the tone loop, so the wave carries on smoothly across frames
+        self.output = wave.open(filename, "wb")
+        self.output.setnchannels(1)
+        self.output.setsampwidth(2)
+        self.output.setframerate(sample_rate)
+        return
+
+    def frame(self):
+        if not self.playing:
+            self.output.writeframesraw(self.silence)
+            return
+        end = self.position + self.frame_bytes
+        if end <= len(self.tone):
+            self.output.writeframesraw(self.tone[self.position:end])
+        else:
+            end -= len(self.tone)
+            self.output.writeframesraw(self.tone[self.position:] + self.tone[:end])
+        self.position = end
+        return
+
+    def close(self):
+        super().close()
+        self.output.close()
+        return
+
+class PygameSink(AudioSink):
+    #Loops the tone on a pygame mixer channel; starting and stopping it returns immediately
+    def __init__(self, frequency=440, sample_rate=SAMPLE_RATE):
+        super().__init__()
+        import pygame
+        if pygame.mixer.get_init() is None:
+            pygame.mixer.init(sample_rate, -16, 1)
+        rate, size, channels = pygame.mixer.get_init() #The mixer may already be open with other settings, so match them
+        self.sound = pygame.mixer.Sound(buffer=square_wave(frequency, rate, channels=channels))
+        self.channel = None
+        return
+
+    def start(self):
+        self.channel = self.sound.play(loops=-1)
+        return
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+            self.channel = None
+        return
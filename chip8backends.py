@@ -0,0 +1,199 @@
+import argparse
+import importlib
+import json
+import sys
+import time
+
+import chip8
+import chip8framestream
+import chip8scheduler
+
+#Pluggable frontends.
+#A frontend is four separate components: a display (draws the screen), an input (feeds keys, reports quit, and can wait for a
+#key during Fx0A), an audio sink (chip8audio) and a clock (what the frame scheduler reads and sleeps on). Each is registered
+#by name as "module:attribute" and imported only when chosen, so a headless worker never imports pygame or opens a window.
+#
+#Display:  open(cpu), draw(cpu), close()
+#Input:    open(cpu); poll(cpu, target) -> False to quit; wait(cpu, target) blocks until something happens; close()
+#          target is the object keys are pressed on: the CPU itself, or a chip8replay.InputRecorder wrapping it
+#Audio:    update(sound_timer), close()
+#Clock:    now() -> nanoseconds, sleep(seconds)
+
+BACKENDS = {"display": {"headless": "chip8backends:NullDisplay", "pygame": "chip8pygame:PygameDisplay"},
+            "input": {"headless": "chip8backends:ScriptedInput", "pygame": "chip8pygame:PygameInput", "shm": "chip8shm:SharedMemoryInput"},
+            "audio": {"headless": "chip8audio:NullSink", "null": "chip8audio:NullSink", "wav": "chip8audio:WavSink",
+                      "pygame": "chip8audio:PygameSink"},
+            "clock": {"headless": "chip8backends:VirtualClock", "realtime": "chip8backends:RealtimeClock"}}
+
+def register_backend(kind, name, location):
+    #Adds or replaces a component: location is "module:attribute", imported the first time the component is created
+    BACKENDS[kind][name] = location
+    return
+
+def load_backend(kind, name):
+    #Returns the class (or factory) registered under kind and name, importing its module now
+    try:
+        location = BACKENDS[kind][name]
+    except KeyError:
+        raise ValueError("no %s backend named %r; known: %s" % (kind, name, ", ".join(sorted(BACKENDS.get(kind, {})))))
+    module, _, attribute = location.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+def create_backend(kind, spec):
+    #spec is a name, a (name, keyword arguments) pair, or an already built component, which is returned as it is
+    if isinstance(spec, str):
+        return load_backend(kind, spec)()
+    elif isinstance(spec, tuple):
+        name, options = spec
+        return load_backend(kind, name)(**options)
+    return spec
+
+class NullDisplay:
+    #Draws nothing; counts the frames that would have been drawn
+    def __init__(self):
+        self.draws = 0
+        return
+
+    def open(self, cpu):
+        return
+
+    def draw(self, cpu):
+        cpu.draw_flag = False
+        self.draws += 1
+        return
+
+    def close(self):
+        return
+
+class ScriptedInput:
+    #Presses and releases keys from a list of [cycle, key, pressed] events (the chip8farm input script format) when the
+    #instruction count reaches them. Asks to quit when a program blocks on Fx0A with no events left.
+    def __init__(self, events=()):
+        self.events = sorted(([int(cycle), int(key), bool(pressed)] for cycle, key, pressed in events), key=lambda event: event[0])
+        self.index = 0
+        return
+
+    def open(self, cpu):
+        return
+
+    def poll(self, cpu, target):
+        events = self.events
+        while self.index < len(events) and events[self.index][0] <= cpu.instruction_count:
+            self.apply(target)
+        return True
+
+    def wait(self, cpu, target):
+        if self.index >= len(self.events):
+            return False
+        self.apply(target)
+        return True
+
+    def apply(self, target):
+        cycle, key, pressed = self.events[self.index]
+        self.index += 1
+        if pressed:
+            target.press_key(key)
+        else:
+            target.release_key(key)
+        return
+
+    def close(self):
+        return
+
+class RealtimeClock:
+    def now(self):
+        return time.perf_counter_ns()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return
+
+class VirtualClock:
+    #Never sleeps: sleeping just moves the reading forward, so frames run back to back at full speed with normal pacing logic
+    def __init__(self):
+        self.time_ns = 0
+        return
+
+    def now(self):
+        return self.time_ns
+
+    def sleep(self, seconds):
+        self.time_ns += int(seconds * 1000000000)
+        return
+
+class Frontend:
+    #Runs a CPU frame by frame through a FrameScheduler, with the four components plugged in
+    def __init__(self, cpu, display="headless", input="headless", audio="headless", clock="headless",
+                 instructions_per_second=500, frame_rate=60, target=None, frame_stream=None):
+        self.cpu = cpu
+        self.display = create_backend("display", display)
+        self.input = create_backend("input", input)
+        self.audio = create_backend("audio", audio)
+        self.clock = create_backend("clock", clock)
+        self.target = target if target is not None else cpu #Where input presses keys: the CPU or a recorder wrapping it
+        self.frame_stream = frame_stream #A chip8framestream.FrameStreamWriter capturing the screen at every frame boundary
+        self.scheduler = chip8scheduler.FrameScheduler(cpu, instructions_per_second, frame_rate, clock=self.clock.now,
+                                                       sleep=self.clock.sleep)
+        return
+
+    def run(self, frames=None):
+        #Runs until the input asks to quit or the given number of frames has passed, then closes the components
+        self.display.open(self.cpu)
+        self.input.open(self.cpu)
+        try:
+            self.scheduler.run(self.end_frame, frames)
+        finally:
+            self.close()
+        return
+
+    def end_frame(self, scheduler):
+        cpu = self.cpu
+        if self.frame_stream is not None:
+            self.frame_stream.write(scheduler.frames, cpu.framebuffer)
+        #Present the frame before anything can block, so a prompt drawn just before an Fx0A wait is on screen during it
+        self.audio.update(cpu.sound_timer)
+        if cpu.draw_flag:
+            self.display.draw(cpu)
+        if cpu.blocking_keypress:
+            #Nothing can run until a key arrives (Fx0A), so let the input block instead of polling it every frame
+            if not self.input.wait(cpu, self.target):
+                return False
+            scheduler.resync()
+        return self.input.poll(cpu, self.target)
+
+    def close(self):
+        if self.frame_stream is not None:
+            self.frame_stream.close()
+        self.audio.close()
+        self.input.close()
+        self.display.close()
+        return
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a CHIP-8 ROM with the chosen frontend components.")
+    parser.add_argument("rom")
+    parser.add_argument("--display", default="headless", choices=sorted(BACKENDS["display"]))
+    parser.add_argument("--input", default="headless", choices=sorted(BACKENDS["input"]))
+    parser.add_argument("--audio", default="headless", choices=sorted(BACKENDS["audio"]))
+    parser.add_argument("--clock", default="headless", choices=sorted(BACKENDS["clock"]))
+    parser.add_argument("--wav", default="chip8.wav", help="file the wav audio backend writes to")
+    parser.add_argument("--shm-name", default="chip8", help="name of the shared block the shm input creates")
+    parser.add_argument("--record-frames", metavar="FILE", default=None, help="capture the screen to a chip8framestream file")
+    parser.add_argument("--ips", type=int, default=500, help="instructions per second")
+    parser.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the Cxkk generator")
+    args = parser.parse_args(argv)
+    cpu = chip8.PETChip8CPU(0)
+    cpu.load(args.rom)
+    if args.seed is not None:
+        cpu.rng.seed(args.seed)
+    audio = ("wav", {"filename": args.wav}) if args.audio == "wav" else args.audio
+    input = ("shm", {"name": args.shm_name}) if args.input == "shm" else args.input
+    frame_stream = chip8framestream.FrameStreamWriter(args.record_frames) if args.record_frames else None
+    frontend = Frontend(cpu, args.display, input, audio, args.clock, args.ips, frame_stream=frame_stream)
+    frontend.run(args.frames)
+    print(json.dumps(frontend.scheduler.stats()))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
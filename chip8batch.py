@@ -0,0 +1,439 @@
+import array
+import random
+import sys
+
+import numpy as np
+
+import chip8
+
+#Lock-step engine for many CHIP-8 machines at once.
+#The state of N machines lives in NumPy arrays with one row (lane) per machine. Each step fetches one opcode per lane, groups
+#the lanes by handler using the same decode tables as PETChip8CPU, and runs one vectorised handler per group. Lanes blocked
+#on Fx0A sit out until a key is pressed, just as PETChip8CPU.run_cycles stops for them.
+#Where the interpreter would raise (stack overflow, memory accesses past 4 KB), the whole batch raises the same exception type.
+
+#Handler name -> small integer, and the handler index of every opcode
+HANDLER_NAMES = sorted(set(chip8.build_decode_tables()[0]))
+HANDLER_IDS = np.array([HANDLER_NAMES.index(name) for name in chip8.build_decode_tables()[0]], dtype=np.uint8)
+
+class Chip8Batch:
+    def __init__(self, lanes, seeds=None):
+        #seeds gives each lane's Cxkk generator a seed; lanes are seeded from system entropy when it is None
+        self.lanes = lanes
+        self.V = np.zeros((lanes, 16), dtype=np.uint8)
+        self.memory = np.zeros((lanes, 4096), dtype=np.uint8)
+        self.framebuffer = np.zeros((lanes, 256), dtype=np.uint8) #Same packed layout as PETChip8CPU.framebuffer; reshape to (lanes, 32, 8) for rows
+        self.dirty = np.full((lanes, 256), 0xFF, dtype=np.uint8)
+        self.stack = np.zeros((lanes, 16), dtype=np.int64)
+        self.program_counter = np.full(lanes, 0x200, dtype=np.int64)
+        self.address_register = np.zeros(lanes, dtype=np.int64)
+        self.stack_pointer = np.zeros(lanes, dtype=np.int64)
+        self.delay_timer = np.zeros(lanes, dtype=np.int64)
+        self.sound_timer = np.zeros(lanes, dtype=np.int64)
+        self.timer_centicycles = np.zeros(lanes, dtype=np.int64)
+        self.instruction_count = np.zeros(lanes, dtype=np.int64)
+        self.keys = np.zeros((lanes, 16), dtype=np.uint8)
+        self.blocking_keypress = np.zeros(lanes, dtype=bool)
+        self.rts_keypress = np.full(lanes, -1, dtype=np.int64)
+        self.draw_flag = np.ones(lanes, dtype=bool)
+        self.sound_just_started = np.zeros(lanes, dtype=bool)
+        if seeds is None:
+            self.rngs = [random.Random() for _ in range(0, lanes)]
+        else:
+            self.rngs = [random.Random(seed) for seed in seeds]
+        fonts = chip8.PETChip8CPU(0)
+        self.memory[:, 0:80] = np.frombuffer(bytes(fonts.memory[0:80]), dtype=np.uint8)
+        self.handlers = [getattr(self, "batch_" + name) for name in HANDLER_NAMES]
+        return
+
+    def load(self, filename):
+        #Loads the same ROM into every lane
+        fin = open(filename, "rb")
+        rom = fin.read(4096 - 512)
+        fin.close()
+        self.memory[:, 512:512 + len(rom)] = np.frombuffer(rom, dtype=np.uint8)
+        return
+
+    def step(self):
+        #Executes one opcode on every lane that is not waiting for a keypress, then accounts it against that lane's timers
+        lanes = np.flatnonzero(~self.blocking_keypress)
+        if len(lanes) == 0:
+            return 0
+        pc = self.program_counter[lanes]
+        opcodes = (self.memory[lanes, pc].astype(np.int64) << 8) | self.memory[lanes, pc + 1]
+        ids = HANDLER_IDS[opcodes]
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_ids)) + 1))
+        ends = np.concatenate((starts[1:], [len(order)]))
+        for start, end in zip(starts, ends):
+            group = order[start:end]
+            ops = opcodes[group]
+            self.handlers[sorted_ids[start]](lanes[group], (ops >> 8) & 0xF, (ops >> 4) & 0xF, ops & 0xF, ops & 0xFF, ops & 0xFFF)
+        self.instruction_count[lanes] += 1
+        centicycles = self.timer_centicycles[lanes] + chip8.PETChip8CPU.CENTICYCLES_PER_INSTRUCTION
+        tick = centicycles >= chip8.PETChip8CPU.TIMER_PERIOD_CENTICYCLES
+        centicycles[tick] -= chip8.PETChip8CPU.TIMER_PERIOD_CENTICYCLES
+        self.timer_centicycles[lanes] = centicycles
+        ticked = lanes[tick]
+        self.delay_timer[ticked] = np.maximum(self.delay_timer[ticked] - 1, 0)
+        self.sound_timer[ticked] = np.maximum(self.sound_timer[ticked] - 1, 0)
+        return len(lanes)
+
+    def run_cycles(self, cycles):
+        #Steps every lane up to the given number of opcodes; returns how many opcodes each lane executed
+        start = self.instruction_count.copy()
+        for _ in range(0, cycles):
+            if self.step() == 0:
+                break
+        return self.instruction_count - start
+
+    def press_key(self, lane, key):
+        #Holds a key down on one lane, releasing it from an Fx0A wait if it was blocked
+        self.keys[lane, key] = 1
+        if self.blocking_keypress[lane]:
+            self.V[lane, self.rts_keypress[lane]] = key
+            self.blocking_keypress[lane] = False
+        return
+
+    def release_key(self, lane, key):
+        self.keys[lane, key] = 0
+        return
+
+    def to_cpu(self, lane, cpu=None):
+        #Copies one lane into a PETChip8CPU, for inspection or to continue it on the scalar interpreter
+        if cpu is None:
+            cpu = chip8.PETChip8CPU(0)
+        cpu.V[0:16] = self.V[lane].tobytes()
+        if cpu.memory_share is not None:
+            cpu.own_memory()
+        cpu.memory[0:4096] = self.memory[lane].tobytes()
+        cpu.framebuffer[0:256] = self.framebuffer[lane].tobytes()
+        cpu.dirty[0:256] = self.dirty[lane].tobytes()
+        cpu.stack[0:16] = array.array("H", self.stack[lane].tolist())
+        cpu.keys[0:16] = self.keys[lane].tobytes()
+        cpu.program_counter = int(self.program_counter[lane])
+        cpu.address_register = int(self.address_register[lane])
+        cpu.stack_pointer = int(self.stack_pointer[lane])
+        cpu.delay_timer = int(self.delay_timer[lane])
+        cpu.sound_timer = int(self.sound_timer[lane])
+        cpu.timer_centicycles = int(self.timer_centicycles[lane])
+        cpu.instruction_count = int(self.instruction_count[lane])
+        cpu.blocking_keypress = bool(self.blocking_keypress[lane])
+        cpu.rts_keypress = int(self.rts_keypress[lane])
+        cpu.draw_flag = bool(self.draw_flag[lane])
+        cpu.sound_just_started = bool(self.sound_just_started[lane])
+        cpu.rng.setstate(self.rngs[lane].getstate())
+        if cpu.hasher is not None:
+            cpu.hasher.reset(cpu)
+        return cpu
+
+    #Vectorised handlers. Each receives the lanes in its group and the operand fields of their opcodes, and mirrors the
+    #PETChip8CPU method of the same name, including the order of its register writes.
+
+    def batch_op_00E0(self, lanes, x, y, n, kk, nnn):
+        lit = self.framebuffer[lanes].any(axis=1)
+        cleared = lanes[lit]
+        self.dirty[cleared] |= self.framebuffer[cleared]
+        self.framebuffer[cleared] = 0
+        self.draw_flag[cleared] = True
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_00EE(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] = self.stack[lanes, self.stack_pointer[lanes]] + 2
+        self.stack_pointer[lanes] -= 1
+        return
+
+    def batch_op_0000(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_0nnn(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] = nnn
+        return
+
+    def batch_op_1nnn(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] = nnn
+        return
+
+    def batch_op_2nnn(self, lanes, x, y, n, kk, nnn):
+        self.stack_pointer[lanes] += 1
+        self.stack[lanes, self.stack_pointer[lanes]] = self.program_counter[lanes]
+        self.program_counter[lanes] = nnn
+        return
+
+    def batch_op_3xkk(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] += np.where(self.V[lanes, x] == kk, 4, 2)
+        return
+
+    def batch_op_4xkk(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] += np.where(self.V[lanes, x] != kk, 4, 2)
+        return
+
+    def batch_op_5xy0(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] += np.where(self.V[lanes, x] == self.V[lanes, y], 4, 2)
+        return
+
+    def batch_op_6xkk(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = kk
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_7xkk(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = (self.V[lanes, x].astype(np.int64) + kk) & 0xFF
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy0(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = self.V[lanes, y]
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy1(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = self.V[lanes, x] | self.V[lanes, y]
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy2(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = self.V[lanes, x] & self.V[lanes, y]
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy3(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = self.V[lanes, x] ^ self.V[lanes, y]
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy4(self, lanes, x, y, n, kk, nnn):
+        #With a carry Vx gets the low byte and then VF becomes 1; without one VF becomes 0 and then Vx gets the sum
+        data = self.V[lanes, x].astype(np.int64) + self.V[lanes, y]
+        carry = data > 255
+        self.V[lanes, x] = data & 0xFF
+        self.V[lanes, 15] = np.where(carry, 1, np.where(x == 15, data, 0))
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy5(self, lanes, x, y, n, kk, nnn):
+        #Both operands are read first and VF is written last, as in the interpreter
+        vx = self.V[lanes, x].astype(np.int64)
+        vy = self.V[lanes, y].astype(np.int64)
+        self.V[lanes, x] = (vx - vy) & 0xFF
+        self.V[lanes, 15] = vx > vy
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy6(self, lanes, x, y, n, kk, nnn):
+        data = self.V[lanes, y]
+        self.V[lanes, 15] = data & 0x01
+        self.V[lanes, x] = data >> 1
+        self.V[lanes, y] = data >> 1
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xy7(self, lanes, x, y, n, kk, nnn):
+        vx = self.V[lanes, x].astype(np.int64)
+        vy = self.V[lanes, y].astype(np.int64)
+        self.V[lanes, x] = (vy - vx) & 0xFF
+        self.V[lanes, 15] = vy > vx
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_8xyE(self, lanes, x, y, n, kk, nnn):
+        data = self.V[lanes, y].astype(np.int64)
+        self.V[lanes, 15] = data & 0x80
+        self.V[lanes, x] = (data << 1) & 0xFF
+        self.V[lanes, y] = (data << 1) & 0xFF
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_skip_word(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_stall(self, lanes, x, y, n, kk, nnn):
+        return
+
+    def batch_op_9xy0(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] += np.where(self.V[lanes, x] != self.V[lanes, y], 4, 2)
+        return
+
+    def batch_op_Annn(self, lanes, x, y, n, kk, nnn):
+        self.address_register[lanes] = nnn
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Bnnn(self, lanes, x, y, n, kk, nnn):
+        self.program_counter[lanes] = nnn + self.V[lanes, 0]
+        return
+
+    def batch_op_Cxkk(self, lanes, x, y, n, kk, nnn):
+        #Each lane draws from its own generator, in the same order as a PETChip8CPU seeded the same way would
+        draws = np.array([self.rngs[lane].randint(0, 255) for lane in lanes], dtype=np.int64)
+        self.V[lanes, x] = draws & kk
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Dxyn(self, lanes, x, y, n, kk, nnn):
+        #Row by row across all the lanes in the group; a lane takes part in row r while r < its sprite height
+        xpos = self.V[lanes, x].astype(np.int64) & 63
+        ypos = self.V[lanes, y].astype(np.int64) & 31
+        address = self.address_register[lanes]
+        column = xpos >> 3
+        next_column = (column + 1) & 7
+        shift = xpos & 7
+        collision = np.zeros(len(lanes), dtype=bool)
+        drawn = np.zeros(len(lanes), dtype=bool)
+        for yline in range(0, int(n.max()) if len(n) else 0):
+            active = np.flatnonzero(n > yline)
+            lane = lanes[active]
+            sprite = self.memory[lane, address[active] + yline].astype(np.int64)
+            drawn[active] |= sprite != 0
+            row = ((ypos[active] + yline) & 31) << 3
+            left = sprite >> shift[active]
+            first = row + column[active]
+            collision[active] |= (self.framebuffer[lane, first] & left) != 0
+            self.framebuffer[lane, first] ^= left.astype(np.uint8)
+            self.dirty[lane, first] |= left.astype(np.uint8)
+            right = (sprite << (8 - shift[active])) & 0xFF
+            right[shift[active] == 0] = 0
+            second = row + next_column[active]
+            collision[active] |= (self.framebuffer[lane, second] & right) != 0
+            self.framebuffer[lane, second] ^= right.astype(np.uint8)
+            self.dirty[lane, second] |= right.astype(np.uint8)
+        self.V[lanes, 15] = collision
+        self.draw_flag[lanes[drawn]] = True
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Ex9E(self, lanes, x, y, n, kk, nnn):
+        key = self.V[lanes, x]
+        pressed = self.keys[lanes, key] != 0
+        self.program_counter[lanes] += np.where(pressed, 4, 2)
+        self.keys[lanes[pressed], key[pressed]] = 0
+        return
+
+    def batch_op_ExA1(self, lanes, x, y, n, kk, nnn):
+        key = self.V[lanes, x]
+        pressed = self.keys[lanes, key] != 0
+        self.program_counter[lanes] += np.where(pressed, 2, 4)
+        self.keys[lanes[pressed], key[pressed]] = 0
+        return
+
+    def batch_op_Fx07(self, lanes, x, y, n, kk, nnn):
+        self.V[lanes, x] = self.delay_timer[lanes]
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx0A(self, lanes, x, y, n, kk, nnn):
+        self.blocking_keypress[lanes] = True
+        self.rts_keypress[lanes] = x
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx15(self, lanes, x, y, n, kk, nnn):
+        self.delay_timer[lanes] = self.V[lanes, x]
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx18(self, lanes, x, y, n, kk, nnn):
+        self.sound_timer[lanes] = self.V[lanes, x]
+        self.sound_just_started[lanes] = True
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx1E(self, lanes, x, y, n, kk, nnn):
+        address = self.address_register[lanes] + self.V[lanes, x]
+        overflow = address > 0xFFF
+        self.address_register[lanes] = np.where(overflow, address & 0xFFF, address)
+        self.V[lanes[overflow], 15] = 1
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx29(self, lanes, x, y, n, kk, nnn):
+        self.address_register[lanes] = self.V[lanes, x].astype(np.int64) * 5
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx33(self, lanes, x, y, n, kk, nnn):
+        data = self.V[lanes, x]
+        address = self.address_register[lanes]
+        self.memory[lanes, address] = data // 100
+        self.memory[lanes, address + 1] = (data // 10) % 10
+        self.memory[lanes, address + 2] = data % 10
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx55(self, lanes, x, y, n, kk, nnn):
+        address = self.address_register[lanes]
+        if np.any(address + x >= 4096):
+            raise IndexError("Fx55 writes past the end of memory")
+        for i in range(0, int(x.max()) + 1):
+            active = np.flatnonzero(x >= i)
+            self.memory[lanes[active], address[active] + i] = self.V[lanes[active], i]
+        self.address_register[lanes] = address + x + 1
+        self.program_counter[lanes] += 2
+        return
+
+    def batch_op_Fx65(self, lanes, x, y, n, kk, nnn):
+        address = self.address_register[lanes]
+        if np.any(address + x >= 4096):
+            raise IndexError("Fx65 reads past the end of memory")
+        for i in range(0, int(x.max()) + 1):
+            active = np.flatnonzero(x >= i)
+            self.V[lanes[active], i] = self.memory[lanes[active], address[active] + i]
+        self.address_register[lanes] = address + x + 1
+        self.program_counter[lanes] += 2
+        return
+
+def lane_mismatches(batch, cpus):
+    #Compares every lane with the matching PETChip8CPU; returns a list of (lane, field) pairs that differ
+    mismatches = []
+    for lane in range(0, batch.lanes):
+        copy = batch.to_cpu(lane)
+        cpu = cpus[lane]
+        for field in ("V", "memory", "framebuffer", "dirty", "stack", "keys"):
+            if bytes(getattr(copy, field)) != bytes(getattr(cpu, field)):
+                mismatches.append((lane, field))
+        for field in ("program_counter", "address_register", "stack_pointer", "delay_timer", "sound_timer", "timer_centicycles",
+                      "instruction_count", "blocking_keypress", "rts_keypress", "draw_flag", "sound_just_started"):
+            if getattr(copy, field) != getattr(cpu, field):
+                mismatches.append((lane, field))
+    return mismatches
+
+def verify_lanes(filename, lanes, cycles, seed=0, chunk=100):
+    #Runs a ROM on a batch and on one PETChip8CPU per lane, seeded alike, and compares them lane for lane every chunk cycles.
+    #Lane i gets a different key held down so the lanes diverge. Returns the mismatches found at the first differing check.
+    batch = Chip8Batch(lanes, seeds=[seed + lane for lane in range(0, lanes)])
+    batch.load(filename)
+    cpus = []
+    for lane in range(0, lanes):
+        cpu = chip8.PETChip8CPU(0)
+        cpu.load(filename)
+        cpu.rng.seed(seed + lane)
+        cpus.append(cpu)
+    for lane in range(0, lanes):
+        batch.keys[lane, lane % 16] = 1
+        cpus[lane].keys[lane % 16] = 1
+    done = 0
+    while done < cycles:
+        step = min(chunk, cycles - done)
+        batch.run_cycles(step)
+        for cpu in cpus:
+            cpu.run_cycles(step)
+        done += step
+        mismatches = lane_mismatches(batch, cpus)
+        if mismatches:
+            return mismatches
+    return []
+
+if __name__ == '__main__':
+    #python chip8batch.py ROM [lanes] [cycles]: checks the batch engine against the interpreter on that ROM
+    rom = sys.argv[1] if len(sys.argv) > 1 else "PONG2"
+    lanes = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    mismatches = verify_lanes(rom, lanes, cycles)
+    if mismatches:
+        print("Lanes differ from the interpreter:", mismatches[:10])
+        sys.exit(1)
+    print("%d lanes matched the interpreter for %d cycles" % (lanes, cycles))
@@ -0,0 +1,168 @@
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+
+import chip8
+
+#Headless ROM farm: runs every (ROM, seed, input script) combination on a process pool and streams one JSON line per run.
+#Workers only import chip8, so nothing here needs pygame or a window.
+#
+#An input script is a JSON file holding {"name": ..., "events": [[cycle, key, pressed], ...]}: at the given instruction count
+#the key (0-15) is pressed (true) or released (false). A press also completes an Fx0A wait.
+
+def load_input_script(filename):
+    fin = open(filename)
+    script = json.load(fin)
+    fin.close()
+    script.setdefault("name", os.path.splitext(os.path.basename(filename))[0])
+    script["events"] = sorted(([int(cycle), int(key), bool(pressed)] for cycle, key, pressed in script.get("events", [])),
+                              key=lambda event: event[0]) #Stable, so events sharing a cycle keep their order
+    return script
+
+def run_headless(cpu, cycles, events=(), advance=None):
+    #Runs cpu for up to cycles opcodes, applying the [cycle, key, pressed] events when cpu.instruction_count reaches them.
+    #advance(limit) runs the CPU on towards instruction count limit; by default straight run_cycles, while
+    #chip8scheduler.FrameScheduler.run_headless passes its run_frame so the timers tick at frame boundaries instead.
+    #Returns early if the program blocks on Fx0A and no later event can release it.
+    #A blocked machine executes nothing, so the next event is applied straight away rather than at its cycle.
+    #Events falling exactly on the last cycle are applied before returning.
+    start = cpu.instruction_count
+    pending = [event for event in events if event[0] >= start]
+    index = 0
+    while True:
+        finished = cpu.instruction_count - start >= cycles
+        while index < len(pending) and (pending[index][0] <= cpu.instruction_count or (cpu.blocking_keypress and not finished)):
+            cycle, key, pressed = pending[index]
+            if pressed:
+                cpu.press_key(key)
+            else:
+                cpu.release_key(key)
+            index += 1
+        if finished or cpu.blocking_keypress:
+            break
+        limit = start + cycles
+        if index < len(pending):
+            limit = min(limit, pending[index][0])
+        if advance is None:
+            cpu.run_cycles(limit - cpu.instruction_count)
+        else:
+            advance(limit)
+    return cpu.instruction_count - start
+
+def machine_summary(cpu):
+    return {"framebuffer_sha1": hashlib.sha1(bytes(cpu.framebuffer)).hexdigest(),
+            "instruction_count": cpu.instruction_count,
+            "registers": list(cpu.V),
+            "program_counter": cpu.program_counter,
+            "address_register": cpu.address_register,
+            "stack_pointer": cpu.stack_pointer,
+            "delay_timer": cpu.delay_timer,
+            "sound_timer": cpu.sound_timer,
+            "blocking_keypress": cpu.blocking_keypress}
+
+def run_job(job):
+    #Runs one job dictionary (rom, seed, cycles, jit, script) in the current process and returns its result dictionary
+    result = {"rom": job["rom"], "seed": job["seed"], "script": job["script"]["name"] if job["script"] else None}
+    started = time.perf_counter()
+    try:
+        cpu = chip8.PETChip8CPU(0, jit=job["jit"])
+        cpu.load(job["rom"])
+        cpu.rng.seed(job["seed"])
+        executed = run_headless(cpu, job["cycles"], job["script"]["events"] if job["script"] else ())
+    except Exception as error:
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+        result["elapsed"] = time.perf_counter() - started
+        return result
+    result["elapsed"] = time.perf_counter() - started
+    result["cycles"] = executed
+    result.update(machine_summary(cpu))
+    return result
+
+def make_jobs(roms, seeds, scripts, cycles, jit):
+    return [{"rom": rom, "seed": seed, "script": script, "cycles": cycles, "jit": jit}
+            for rom, seed, script in itertools.product(roms, seeds, scripts or [None])]
+
+def run_farm(jobs, workers=None, output=sys.stdout, chunksize=None):
+    #Fans the jobs out across a process pool, writes each result as a JSON line as soon as it is back (in job order), and
+    #returns the per-ROM aggregate
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+    aggregate = {}
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run_job, jobs, chunksize=chunksize):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            add_to_aggregate(aggregate, result)
+    return finish_aggregate(aggregate, time.perf_counter() - started)
+
+def add_to_aggregate(aggregate, result):
+    entry = aggregate.setdefault(result["rom"], {"jobs": 0, "errors": 0, "instructions": 0, "cpu_seconds": 0.0, "framebuffers": set()})
+    entry["jobs"] += 1
+    entry["cpu_seconds"] += result["elapsed"]
+    if "error" in result:
+        entry["errors"] += 1
+    else:
+        entry["instructions"] += result["cycles"]
+        entry["framebuffers"].add(result["framebuffer_sha1"])
+    return
+
+def finish_aggregate(aggregate, wall_seconds):
+    #Turns the running totals into plain JSON-friendly numbers
+    roms = {}
+    instructions = 0
+    for rom, entry in aggregate.items():
+        roms[rom] = {"jobs": entry["jobs"], "errors": entry["errors"], "instructions": entry["instructions"],
+                     "distinct_framebuffers": len(entry["framebuffers"]),
+                     "instructions_per_cpu_second": entry["instructions"] / entry["cpu_seconds"] if entry["cpu_seconds"] else 0.0}
+        instructions += entry["instructions"]
+    return {"roms": roms, "instructions": instructions, "wall_seconds": wall_seconds,
+            "instructions_per_second": instructions / wall_seconds if wall_seconds else 0.0}
+
+def find_roms(paths):
+    #Expands directories into the files they contain, sorted so job order is reproducible
+    roms = []
+    for path in paths:
+        if os.path.isdir(path):
+            roms.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if os.path.isfile(os.path.join(path, name))))
+        else:
+            roms.append(path)
+    return roms
+
+def parse_seeds(text):
+    #"3" -> [3], "0-9" -> [0..9], "1,5,8" -> [1, 5, 8]
+    seeds = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            seeds.extend(range(int(first), int(last) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run CHIP-8 ROMs headless on a process pool and stream results as JSON lines.")
+    parser.add_argument("roms", nargs="+", help="ROM files or directories of ROMs")
+    parser.add_argument("--cycles", type=int, default=100000, help="opcodes to run per job")
+    parser.add_argument("--seeds", default="0", help="random seeds, e.g. 0-99 or 1,2,3")
+    parser.add_argument("--inputs", nargs="*", default=[], help="input script JSON files; every ROM and seed runs with each")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--jit", action="store_true", help="use the basic-block translation cache")
+    parser.add_argument("--output", default="-", help="JSON lines file to write results to (default: stdout)")
+    args = parser.parse_args(argv)
+    scripts = [load_input_script(filename) for filename in args.inputs]
+    jobs = make_jobs(find_roms(args.roms), parse_seeds(args.seeds), scripts, args.cycles, args.jit)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    summary = run_farm(jobs, args.workers, output)
+    if output is not sys.stdout:
+        output.close()
+    sys.stderr.write(json.dumps(summary, indent=2) + "\n")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import argparse
+import bisect
+import re
+import struct
+import sys
+import zlib
+
+#Compact capture of the screen, frame by frame.
+#A stream stores the packed 256-byte framebuffer only for frames where it changed. Each stored frame is XORed against the one
+#before it and the difference is run-length encoded: a list of (zero bytes skipped, literal length - 1, literal) runs, where a
+#literal may swallow gaps of up to two zero bytes because a new run header would cost as much. A typical DRW changes a
+#handful of bytes, so most frames take under 20 bytes before compression.
+#
+#Frames are grouped into chunks that each open with a full keyframe, so any frame can be rebuilt from the start of its chunk
+#without touching the rest of the file. A chunk is built in memory and written (optionally zlib-compressed) in one go when
+#the next keyframe starts or the stream is closed; a crash loses at most the chunk in progress.
+#
+#Layout, little-endian: the header, then chunks back to back. A chunk is its header followed by the payload; the payload is
+#its records back to back, each a record header and then the data (the keyframe's 256 bytes first, deltas after it).
+
+STREAM_MAGIC = b"C8FS"
+STREAM_VERSION = 1
+FLAG_ZLIB = 1
+HEADER_FORMAT = struct.Struct("<4sBBH") #Magic, version, flags, keyframe interval
+CHUNK_FORMAT = struct.Struct("<IHI") #Frame of the keyframe, records in the chunk, payload bytes as stored
+RECORD_FORMAT = struct.Struct("<IH") #Frame number, data bytes
+FRAMEBUFFER_SIZE = 256
+
+#Runs of changed bytes, merging gaps of one or two unchanged bytes into the literal
+CHANGED_RUN = re.compile(rb"[^\x00]+(?:\x00{1,2}[^\x00]+)*")
+
+def encode_delta(previous, current):
+    #The run-length encoded XOR of two framebuffers
+    difference = (int.from_bytes(previous, "big") ^ int.from_bytes(current, "big")).to_bytes(FRAMEBUFFER_SIZE, "big")
+    encoded = bytearray()
+    position = 0
+    for run in CHANGED_RUN.finditer(difference):
+        start, end = run.span()
+        encoded.append(start - position)
+        encoded.append(end - start - 1)
+        encoded += run.group()
+        position = end
+    return bytes(encoded)
+
+def apply_delta(framebuffer, delta):
+    #XORs an encoded delta into framebuffer (a bytearray) in place
+    position = 0
+    index = 0
+    while index < len(delta):
+        start = position + delta[index]
+        length = delta[index + 1] + 1
+        literal = delta[index + 2:index + 2 + length]
+        end = start + length
+        framebuffer[start:end] = (int.from_bytes(framebuffer[start:end], "big") ^ int.from_bytes(literal, "big")).to_bytes(length, "big")
+        position = end
+        index += 2 + length
+    return framebuffer
+
+class FrameStreamWriter:
+    #Writes frames to a stream file. Call write() at every frame boundary; unchanged frames cost one comparison.
+    def __init__(self, filename, keyframe_interval=300, compress=True, level=6):
+        if not 0 < keyframe_interval < 65536:
+            raise ValueError("keyframe_interval must be in range(1, 65536)")
+        self.keyframe_interval = keyframe_interval #Stored frames per chunk
+        self.level = level if compress else None
+        self.output = open(filename, "wb")
+        self.output.write(HEADER_FORMAT.pack(STREAM_MAGIC, STREAM_VERSION, FLAG_ZLIB if compress else 0, keyframe_interval))
+        self.previous = None #The last framebuffer stored, or None before the first frame
+        self.chunk = bytearray()
+        self.chunk_frame = 0
+        self.chunk_records = 0
+        self.frames = 0 #Frames stored
+        self.raw_bytes = 0 #What the stored frames would have taken as whole framebuffers
+        return
+
+    def write(self, frame, framebuffer):
+        #Stores framebuffer as frame number frame if it differs from the last one stored. Returns True if it was stored.
+        if framebuffer == self.previous:
+            return False
+        current = bytes(framebuffer)
+        if self.chunk_records == self.keyframe_interval:
+            self.flush()
+        if self.chunk_records == 0:
+            self.chunk_frame = frame
+            data = current
+        else:
+            data = encode_delta(self.previous, current)
+        self.chunk += RECORD_FORMAT.pack(frame, len(data))
+        self.chunk += data
+        self.chunk_records += 1
+        self.previous = current
+        self.frames += 1
+        self.raw_bytes += FRAMEBUFFER_SIZE
+        return True
+
+    def capture(self, cpu, frame):
+        #Frame-boundary hook for hosts: stores the CPU's screen as frame number frame
+        return self.write(frame, cpu.framebuffer)
+
+    def flush(self):
+        #Writes the chunk in progress; the next frame stored becomes a keyframe
+        if self.chunk_records == 0:
+            return
+        payload = bytes(self.chunk) if self.level is None else zlib.compress(self.chunk, self.level)
+        self.output.write(CHUNK_FORMAT.pack(self.chunk_frame, self.chunk_records, len(payload)))
+        self.output.write(payload)
+        self.chunk = bytearray()
+        self.chunk_records = 0
+        return
+
+    def close(self):
+        self.flush()
+        self.output.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+class FrameStreamReader:
+    #Reads a stream file. Opening it reads only the chunk headers; frame(n) then decodes one chunk at most, and reading
+    #frames in increasing order carries on from the last one decoded.
+    def __init__(self, filename):
+        self.input = open(filename, "rb")
+        magic, version, flags, self.keyframe_interval = HEADER_FORMAT.unpack(self.input.read(HEADER_FORMAT.size))
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError("%s is not a version %d frame stream" % (filename, STREAM_VERSION))
+        self.compressed = bool(flags & FLAG_ZLIB)
+        self.chunk_frames = [] #Frame of each chunk's keyframe, for bisecting
+        self.chunks = [] #(offset of the payload, records, payload bytes) per chunk
+        self.stored_bytes = HEADER_FORMAT.size #Bytes up to the end of the last complete chunk
+        size = self.input.seek(0, 2)
+        self.input.seek(HEADER_FORMAT.size)
+        while True:
+            header = self.input.read(CHUNK_FORMAT.size)
+            if len(header) < CHUNK_FORMAT.size:
+                break
+            frame, records, length = CHUNK_FORMAT.unpack(header)
+            offset = self.input.tell()
+            if offset + length > size:
+                break #A chunk cut short by a crash is ignored
+            self.input.seek(length, 1)
+            self.chunk_frames.append(frame)
+            self.chunks.append((offset, records, length))
+            self.stored_bytes = offset + length
+        self.frames = sum(records for _, records, _ in self.chunks)
+        self.loaded = None #Index of the chunk in records
+        self.records = [] #(frame, data) of the loaded chunk
+        self.record_frames = []
+        self.position = -1 #Index in records of the frame in framebuffer
+        self.framebuffer = bytearray(FRAMEBUFFER_SIZE)
+        return
+
+    def load_chunk(self, index):
+        if self.loaded == index:
+            return
+        offset, count, length = self.chunks[index]
+        self.input.seek(offset)
+        payload = self.input.read(length)
+        if len(payload) < length:
+            raise ValueError("frame stream is truncated")
+        if self.compressed:
+            payload = zlib.decompress(payload)
+        records = []
+        position = 0
+        for _ in range(count):
+            frame, size = RECORD_FORMAT.unpack_from(payload, position)
+            position += RECORD_FORMAT.size
+            records.append((frame, payload[position:position + size]))
+            position += size
+        self.loaded = index
+        self.records = records
+        self.record_frames = [frame for frame, _ in records]
+        self.position = -1
+        return
+
+    def frame(self, frame):
+        #The packed framebuffer on screen at frame number frame: the last one stored at or before it
+        index = bisect.bisect_right(self.chunk_frames, frame) - 1
+        if index < 0:
+            raise ValueError("frame %d is before the start of the stream" % frame)
+        self.load_chunk(index)
+        target = bisect.bisect_right(self.record_frames, frame) - 1
+        if target < self.position:
+            self.position = -1
+        if self.position < 0:
+            self.framebuffer[:] = self.records[0][1]
+            self.position = 0
+        for position in range(self.position + 1, target + 1):
+            apply_delta(self.framebuffer, self.records[position][1])
+        self.position = target
+        return bytes(self.framebuffer)
+
+    def __iter__(self):
+        #Every stored frame in order, as (frame number, packed framebuffer)
+        for index in range(len(self.chunks)):
+            self.load_chunk(index)
+            for frame in self.record_frames:
+                yield frame, self.frame(frame)
+        return
+
+    def __len__(self):
+        return self.frames
+
+    def close(self):
+        self.input.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def render_text(framebuffer):
+    #The screen as 32 lines of '#' and '.'
+    return "\n".join("".join("#" if framebuffer[(y << 3) | (x >> 3)] & (0x80 >> (x & 7)) else "." for x in range(64))
+                     for y in range(32))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a frame stream, or print one of its frames.")
+    parser.add_argument("stream")
+    parser.add_argument("--frame", type=int, default=None, help="print the screen at this frame number")
+    args = parser.parse_args(argv)
+    with FrameStreamReader(args.stream) as reader:
+        if args.frame is not None:
+            print(render_text(reader.frame(args.frame)))
+            return 0
+        first = reader.chunk_frames[0] if reader.chunks else None
+        print("%d frames stored in %d chunks, %d bytes (%.1f bytes per frame, %s), first frame %s" %
+              (len(reader), len(reader.chunks), reader.stored_bytes, reader.stored_bytes / len(reader) if len(reader) else 0.0,
+               "zlib" if reader.compressed else "uncompressed", first))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import collections
+
+import chip8
+
+#Basic-block translation for PETChip8CPU.
+#A block is the straight line of opcodes starting at some address, up to and including the first one that can change the
+#program counter non-sequentially, block on a keypress or write memory. Each block is turned into the source of one Python
+#function, compiled once, and cached by address. Running a block has the same effect as interpreting its opcodes one by one.
+#The gain depends on how much of the time goes on opcodes that can be inlined: benchmarks/jit.py measures about 3x on a loop
+#of register arithmetic but only 1.3-1.4x on PONG2, where most of the time is spent in DRW, which is always called.
+
+MAX_BLOCK_LENGTH = 64
+MAX_COMPILED_BLOCKS = 4096 #Shared compiled blocks kept before the least recently used is dropped
+
+#Opcodes that end a block: jumps, calls, returns and skips, the keypress wait, the memory writers (which may rewrite the
+#block itself) and unrecognised Ex?? opcodes, which never advance the program counter
+TERMINATORS = {"op_00EE", "op_0nnn", "op_1nnn", "op_2nnn", "op_3xkk", "op_4xkk", "op_5xy0", "op_9xy0", "op_Bnnn",
+               "op_Ex9E", "op_ExA1", "op_stall", "op_Fx0A", "op_Fx33", "op_Fx55"}
+#Opcodes that see the timers. The timers are only brought up to date between blocks, so these may only start one
+TIMER_OPCODES = {"op_Fx07", "op_Fx15", "op_Fx18"}
+
+#Compiled block functions, shared by every CPU running the same code: (class, address, code bytes) -> (function, length).
+#Least recently used first. A block dropped from here stays in the BlockCaches that hold it; it is only no longer shared.
+_compiled_blocks = collections.OrderedDict()
+
+def inline_source(name, operands, address):
+    #Returns source lines equivalent to the stock handler, or None if the opcode should call its handler instead.
+    #Skips and jumps set the program counter themselves; everything else relies on the caller to keep it in step.
+    if name == "op_6xkk":
+        return ["V[%d] = %d" % operands]
+    elif name == "op_7xkk":
+        return ["V[%d] = (V[%d] + %d) & 0xFF" % (operands[0], operands[0], operands[1])]
+    elif name == "op_8xy0":
+        return ["V[%d] = V[%d]" % operands]
+    elif name == "op_8xy1":
+        return ["V[%d] |= V[%d]" % operands]
+    elif name == "op_8xy2":
+        return ["V[%d] &= V[%d]" % operands]
+    elif name == "op_8xy3":
+        return ["V[%d] ^= V[%d]" % operands]
+    elif name == "op_8xy4":
+        x, y = operands
+        return ["t = V[%d] + V[%d]" % (x, y),
+                "if t > 255:",
+                "    V[%d] = t & 0xFF" % x,
+                "    V[15] = 1",
+                "else:",
+                "    V[15] = 0",
+                "    V[%d] = t" % x]
+    elif name == "op_8xy5":
+        x, y = operands
+        return ["a = V[%d]" % x,
+                "b = V[%d]" % y,
+                "V[%d] = (a - b) & 0xFF" % x,
+                "V[15] = 1 if a > b else 0"]
+    elif name == "op_8xy6":
+        x, y = operands
+        return ["t = V[%d]" % y,
+                "V[15] = t & 0x01",
+                "V[%d] = t >> 1" % x,
+                "V[%d] = t >> 1" % y]
+    elif name == "op_8xy7":
+        x, y = operands
+        return ["a = V[%d]" % x,
+                "b = V[%d]" % y,
+                "V[%d] = (b - a) & 0xFF" % x,
+                "V[15] = 1 if b > a else 0"]
+    elif name == "op_8xyE":
+        x, y = operands
+        return ["t = V[%d]" % y,
+                "V[15] = t & 0x80",
+                "V[%d] = (t << 1) & 0xFF" % x,
+                "V[%d] = (t << 1) & 0xFF" % y]
+    elif name == "op_Annn":
+        return ["cpu.address_register = %d" % operands]
+    elif name == "op_Fx07":
+        return ["V[%d] = cpu.delay_timer" % operands]
+    elif name == "op_Fx15":
+        return ["cpu.delay_timer = V[%d]" % operands]
+    elif name == "op_Fx18":
+        return ["cpu.sound_timer = V[%d]" % operands,
+                "cpu.sound_just_started = True"]
+    elif name == "op_Fx1E":
+        return ["t = cpu.address_register + V[%d]" % operands,
+                "if t > 0xFFF:",
+                "    t &= 0xFFF",
+                "    V[15] = 1",
+                "cpu.address_register = t"]
+    elif name == "op_Fx29":
+        return ["cpu.address_register = V[%d] * 5" % operands]
+    elif name == "op_0000" or name == "op_skip_word":
+        return []
+    elif name == "op_1nnn":
+        return ["cpu.program_counter = %d" % operands]
+    elif name == "op_3xkk":
+        return ["cpu.program_counter = %d if V[%d] == %d else %d" % (address + 4, operands[0], operands[1], address + 2)]
+    elif name == "op_4xkk":
+        return ["cpu.program_counter = %d if V[%d] != %d else %d" % (address + 4, operands[0], operands[1], address + 2)]
+    elif name == "op_5xy0":
+        return ["cpu.program_counter = %d if V[%d] == V[%d] else %d" % (address + 4, operands[0], operands[1], address + 2)]
+    elif name == "op_9xy0":
+        return ["cpu.program_counter = %d if V[%d] != V[%d] else %d" % (address + 4, operands[0], operands[1], address + 2)]
+    return None
+
+def scan_block(memory, start):
+    #Returns the list of (address, name, operands) making up the block at start
+    names, operands = chip8.build_decode_tables()
+    instructions = []
+    address = start
+    while address + 1 < len(memory) and len(instructions) < MAX_BLOCK_LENGTH:
+        opcode = (memory[address] << 8) | memory[address + 1]
+        name = names[opcode]
+        if name in TIMER_OPCODES and instructions:
+            break
+        instructions.append((address, name, operands[opcode]))
+        address += 2
+        if name in TERMINATORS:
+            break
+    return instructions
+
+def compile_block(cpu_class, instructions):
+    #Generates and compiles the function for a block. Handlers the class overrides are always called, never inlined.
+    lines = ["def block(cpu):", "    V = cpu.V"]
+    namespace = {}
+    pc_synced = True #Whether cpu.program_counter currently holds the address of the next opcode
+    for address, name, operands in instructions:
+        body = None
+        if getattr(cpu_class, name) is getattr(chip8.PETChip8CPU, name):
+            body = inline_source(name, operands, address)
+        if body is None:
+            if not pc_synced:
+                lines.append("    cpu.program_counter = %d" % address)
+            namespace[name] = getattr(cpu_class, name)
+            lines.append("    %s(cpu%s)" % (name, "".join(", %d" % operand for operand in operands)))
+            pc_synced = True
+        else:
+            lines.extend("    " + line for line in body)
+            pc_synced = name in TERMINATORS
+    if not pc_synced:
+        last = instructions[-1][0]
+        lines.append("    cpu.program_counter = %d" % (last + 2))
+    source = "\n".join(lines) + "\n"
+    exec(compile(source, "<chip8 block 0x%03X>" % instructions[0][0], "exec"), namespace)
+    return namespace["block"]
+
+class BlockCache:
+    #Per-CPU cache of translated blocks, keyed by start address
+    __slots__ = ("blocks", "code_mask")
+
+    def __init__(self):
+        self.blocks = {} #Start address -> (function, length, end address)
+        self.code_mask = 0 #Bit n is set when address n belongs to some cached block
+        return
+
+    def translate(self, cpu, start):
+        instructions = scan_block(cpu.memory, start)
+        end = instructions[-1][0] + 2
+        key = (type(cpu), start, bytes(cpu.memory[start:end]))
+        compiled = _compiled_blocks.get(key)
+        if compiled is None:
+            compiled = (compile_block(type(cpu), instructions), len(instructions))
+            if len(_compiled_blocks) >= MAX_COMPILED_BLOCKS:
+                _compiled_blocks.popitem(last=False)
+            _compiled_blocks[key] = compiled
+        else:
+            _compiled_blocks.move_to_end(key)
+        function, length = compiled
+        block = (function, length, end)
+        self.blocks[start] = block
+        self.code_mask |= ((1 << (end - start)) - 1) << start
+        return block
+
+    def invalidate(self, start, end):
+        #Drops every cached block overlapping memory[start:end], after a write to that range
+        if (self.code_mask >> start) & ((1 << (end - start)) - 1) == 0:
+            return
+        mask = 0
+        for address, block in list(self.blocks.items()):
+            if address < end and block[2] > start:
+                del self.blocks[address]
+            else:
+                mask |= ((1 << (block[2] - address)) - 1) << address
+        self.code_mask = mask
+        return
+
+    def clear(self):
+        self.blocks.clear()
+        self.code_mask = 0
+        return
+
+    def run_cycles(self, cpu, cycles, timers=True):
+        #Same contract as PETChip8CPU.run_cycles. Whole blocks run while they fit in the remaining budget, the tail is interpreted.
+        #The timers are brought up to date after every block, which is exact because only a block's first opcode may look at them.
+        executed = 0
+        blocks = self.blocks
+        period = cpu.TIMER_PERIOD_CENTICYCLES
+        step = cpu.CENTICYCLES_PER_INSTRUCTION if timers else 0
+        while executed < cycles:
+            if cpu.blocking_keypress:
+                break
+            pc = cpu.program_counter
+            block = blocks.get(pc)
+            if block is None:
+                block = self.translate(cpu, pc)
+            function, length, end = block
+            if length > cycles - executed:
+                executed += cpu.interpret_cycles(cycles - executed, timers)
+                return executed
+            try:
+                function(cpu)
+            except Exception:
+                #Every handler that can raise is called with the program counter on its own address, so this counts the
+                #opcodes before it, just as interpret_cycles would have, and the timers stay in step with the interpreter
+                done = (cpu.program_counter - pc) // 2
+                cpu.instruction_count += done
+                centicycles = cpu.timer_centicycles + step * done
+                while centicycles >= period:
+                    centicycles -= period
+                    cpu.tick_timers()
+                cpu.timer_centicycles = centicycles
+                raise
+            executed += length
+            cpu.instruction_count += length
+            centicycles = cpu.timer_centicycles + step * length
+            if centicycles >= period:
+                while centicycles >= period:
+                    centicycles -= period
+                    cpu.tick_timers()
+                cpu.timer_centicycles = centicycles
+                if cpu.program_counter in cpu.idle_loops and executed < cycles:
+                    skipped = cpu.skip_idle_loop(cycles - executed)
+                    executed += skipped
+                    cpu.instruction_count += skipped
+            else:
+                cpu.timer_centicycles = centicycles
+        return executed
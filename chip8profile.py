@@ -0,0 +1,153 @@
+import argparse
+import json
+import sys
+import time
+
+import chip8
+
+#Opt-in instrumentation for PETChip8CPU.
+#cpu.start_profiling() makes run_cycles go through Profiler.run_cycles, a copy of the interpreter loop that times every
+#handler call. The stock loop is untouched, so a CPU that is not being profiled pays nothing per opcode.
+#
+#For each opcode family (handler name) and each program counter address the profiler keeps an execution count and the
+#cumulative handler time in nanoseconds. It follows 2NNN/00EE with a shadow stack of subroutine entry points, which gives
+#the call graph edges and lets every opcode's time be charged to the chain of calls it ran under, for flame graphs.
+#While profiling, the JIT is bypassed so the numbers describe the interpreter.
+
+class Profiler:
+    __slots__ = ("families", "addresses", "calls", "stacks", "shadow_stack", "instructions", "elapsed_ns")
+
+    def __init__(self):
+        self.families = {} #Handler name -> [count, ns]
+        self.addresses = {} #Address -> [count, ns]; the counts are the PC heat map
+        self.calls = {} #(caller entry, callee entry) -> count, one per 2NNN executed
+        self.stacks = {} #Tuple of subroutine entries, outermost first -> ns spent in opcodes run under that chain
+        self.shadow_stack = [0x200] #Entry points of the subroutines currently running, the program itself at the bottom
+        self.instructions = 0
+        self.elapsed_ns = 0
+        return
+
+    def run_cycles(self, cpu, cycles, timers=True):
+        #Same contract and timer accounting as PETChip8CPU.interpret_cycles
+        executed = 0
+        cache = cpu.opcode_cache
+        names = cpu.opcode_names
+        step = cpu.CENTICYCLES_PER_INSTRUCTION if timers else 0
+        period = cpu.TIMER_PERIOD_CENTICYCLES
+        centicycles = cpu.timer_centicycles
+        clock = time.perf_counter_ns
+        families = self.families
+        addresses = self.addresses
+        stacks = self.stacks
+        shadow_stack = self.shadow_stack
+        frames = tuple(shadow_stack)
+        started = clock()
+        try:
+            while executed < cycles:
+                if cpu.blocking_keypress:
+                    break
+                pc = cpu.program_counter
+                memory = cpu.memory
+                opcode = (memory[pc] << 8) | memory[pc + 1]
+                try:
+                    handler = cache[opcode]
+                except KeyError:
+                    handler = cpu.bind_opcode(opcode)
+                before = clock()
+                handler()
+                elapsed = clock() - before
+                name = names[opcode]
+                entry = families.get(name)
+                if entry is None:
+                    families[name] = [1, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+                entry = addresses.get(pc)
+                if entry is None:
+                    addresses[pc] = [1, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+                stacks[frames] = stacks.get(frames, 0) + elapsed
+                if name == "op_2nnn":
+                    callee = cpu.program_counter
+                    edge = (shadow_stack[-1], callee)
+                    self.calls[edge] = self.calls.get(edge, 0) + 1
+                    shadow_stack.append(callee)
+                    frames = tuple(shadow_stack)
+                elif name == "op_00EE" and len(shadow_stack) > 1:
+                    shadow_stack.pop()
+                    frames = tuple(shadow_stack)
+                executed += 1
+                centicycles += step
+                if centicycles >= period:
+                    centicycles -= period
+                    cpu.tick_timers()
+        finally:
+            self.elapsed_ns += clock() - started
+            cpu.timer_centicycles = centicycles
+            cpu.instruction_count += executed
+            self.instructions += executed
+        return executed
+
+    def report(self):
+        #The whole profile as a JSON-friendly dictionary. Addresses are written as "0x2A4" strings.
+        return {"instructions": self.instructions, "elapsed_ns": self.elapsed_ns,
+                "families": {name: {"count": count, "ns": ns} for name, (count, ns) in
+                             sorted(self.families.items(), key=lambda item: -item[1][1])},
+                "addresses": {"0x%03X" % address: {"count": count, "ns": ns} for address, (count, ns) in
+                              sorted(self.addresses.items())},
+                "calls": [{"caller": "0x%03X" % caller, "callee": "0x%03X" % callee, "count": count} for (caller, callee), count in
+                          sorted(self.calls.items())]}
+
+    def collapsed_stacks(self):
+        #Lines in the collapsed-stack format read by flamegraph.pl and speedscope: "main;sub_2A4;sub_2F0 <ns>"
+        lines = []
+        for frames, ns in sorted(self.stacks.items()):
+            names = ["main"] + ["sub_%03X" % address for address in frames[1:]]
+            lines.append("%s %d" % (";".join(names), ns))
+        return lines
+
+    def write_json(self, filename):
+        fout = open(filename, "w")
+        json.dump(self.report(), fout, indent=2)
+        fout.close()
+        return
+
+    def write_collapsed(self, filename):
+        fout = open(filename, "w")
+        fout.write("\n".join(self.collapsed_stacks()) + "\n")
+        fout.close()
+        return
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile a CHIP-8 ROM per opcode family and per address.")
+    parser.add_argument("rom")
+    parser.add_argument("--cycles", type=int, default=100000, help="opcodes to run")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the Cxkk generator")
+    parser.add_argument("--json", default=None, help="write the full profile here as JSON")
+    parser.add_argument("--collapsed", default=None, help="write collapsed stacks here, for flamegraph.pl")
+    parser.add_argument("--top", type=int, default=10, help="rows to print per table")
+    args = parser.parse_args(argv)
+    cpu = chip8.PETChip8CPU(0)
+    cpu.load(args.rom)
+    cpu.rng.seed(args.seed)
+    profiler = cpu.start_profiling()
+    cpu.run_cycles(args.cycles)
+    cpu.stop_profiling()
+    if args.json is not None:
+        profiler.write_json(args.json)
+    if args.collapsed is not None:
+        profiler.write_collapsed(args.collapsed)
+    total = sum(ns for count, ns in profiler.families.values()) or 1
+    print("%-10s %10s %12s %7s" % ("family", "count", "ns/op", "time"))
+    for name, (count, ns) in sorted(profiler.families.items(), key=lambda item: -item[1][1])[:args.top]:
+        print("%-10s %10d %12.0f %6.1f%%" % (name, count, ns / count, ns * 100 / total))
+    print("\n%-10s %10s %12s %7s" % ("address", "count", "ns/op", "time"))
+    for address, (count, ns) in sorted(profiler.addresses.items(), key=lambda item: -item[1][1])[:args.top]:
+        print("0x%03X      %10d %12.0f %6.1f%%" % (address, count, ns / count, ns * 100 / total))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
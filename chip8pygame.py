@@ -0,0 +1,87 @@
+import pygame
+
+#pygame display and input components for chip8backends. Only imported when one of them is chosen.
+
+#The usual layout of the hex keypad on a QWERTY keyboard, indexed by CHIP-8 key
+DEFAULT_KEY_MAP = [pygame.K_x, pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_q, pygame.K_w, pygame.K_e, pygame.K_a, pygame.K_s,
+                   pygame.K_d, pygame.K_z, pygame.K_c, pygame.K_4, pygame.K_r, pygame.K_f, pygame.K_v]
+
+class PygameDisplay:
+    #Draws the framebuffer into a 64x32 palettized surface, converts it to the window's format through a second 64x32
+    #surface (scale needs both sides in the same format) and scales that onto the window in one blit, then pushes only the
+    #areas the core reports as changed to the screen
+    def __init__(self, scale=16, palette=((0, 0, 0), (255, 255, 255)), caption="Chip-8 Emulator"):
+        self.scale = scale #Window pixels per CHIP-8 pixel
+        self.palette = [pygame.Color(*palette[0]), pygame.Color(*palette[1])] #Colours of unlit and lit pixels
+        self.caption = caption
+        self.window = None
+        self.surface = None
+        self.converted = None #The 64x32 frame in the window's pixel format, reused every draw
+        self.dirty_rects = [] #Window rectangles changed by the last draw
+        return
+
+    def open(self, cpu):
+        pygame.init()
+        pygame.display.set_caption(self.caption)
+        self.window = pygame.display.set_mode((64 * self.scale, 32 * self.scale))
+        self.surface = pygame.Surface((64, 32), 0, 8)
+        self.surface.set_palette(self.palette)
+        self.converted = pygame.Surface((64, 32), 0, self.window)
+        return
+
+    def draw(self, cpu):
+        cpu.draw_flag = False
+        scale = self.scale
+        self.dirty_rects = [pygame.Rect(x * scale, y * scale, width * scale, height * scale)
+                            for x, y, width, height in cpu.consume_dirty_regions()]
+        if not self.dirty_rects:
+            return
+        self.surface.get_buffer().write(cpu.unpacked_framebuffer(), 0)
+        self.converted.blit(self.surface, (0, 0))
+        pygame.transform.scale(self.converted, self.window.get_size(), self.window)
+        pygame.display.update(self.dirty_rects)
+        return
+
+    def close(self):
+        pygame.quit()
+        return
+
+class PygameInput:
+    #Turns key presses and releases in the window into CHIP-8 key transitions. Needs the pygame display to be open.
+    def __init__(self, key_map=None):
+        self.key_map = {key: index for index, key in enumerate(key_map or DEFAULT_KEY_MAP)}
+        return
+
+    def open(self, cpu):
+        return
+
+    def poll(self, cpu, target):
+        for event in pygame.event.get():
+            if not self.handle(event, target):
+                return False
+        #Ex9E and ExA1 clear a key when they test it, so keys still held down are pressed again every frame; going through
+        #target keeps recordings exact. Not while waiting on Fx0A, where only a new press should count.
+        if not cpu.blocking_keypress:
+            held = pygame.key.get_pressed()
+            keys = cpu.keys
+            for key, index in self.key_map.items():
+                if held[key] and not keys[index]:
+                    target.press_key(index)
+        return True
+
+    def wait(self, cpu, target):
+        #Sleeps on the event queue until something arrives
+        return self.handle(pygame.event.wait(), target)
+
+    def handle(self, event, target):
+        #Returns False when the window is closed
+        if event.type == pygame.QUIT:
+            return False
+        elif event.type == pygame.KEYDOWN and event.key in self.key_map:
+            target.press_key(self.key_map[event.key])
+        elif event.type == pygame.KEYUP and event.key in self.key_map:
+            target.release_key(self.key_map[event.key])
+        return True
+
+    def close(self):
+        return
@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+import chip8
+import chip8farm
+import chip8scheduler
+
+#Deterministic input recording and replay.
+#A recorder attaches to a freshly loaded CPU, reseeds its Cxkk generator and logs every key transition at the instruction
+#count it happened at, along with every byte the generator hands out. Replaying the log on a headless PETChip8CPU runs the
+#exact same workload, which is what throughput benchmarks and regression bisects need.
+#
+#A recording is a JSON file holding {"name", "rom", "seed", "cycles", "timing", "events": [[cycle, key, pressed], ...],
+#"draws": [...], "framebuffer_sha1"}, so it is also a valid chip8farm input script. Events are kept in the order they happened.
+#Draws are logged in the order Cxkk consumed them: the interpreter only brings instruction_count up to date at the end of a
+#run_cycles call, so the order is the exact key for them, and the seed alone reproduces them on the same Python version.
+#Sessions recorded under a chip8scheduler.FrameScheduler carry its rates in "timing", and are replayed frame by frame so the
+#timers tick at the same instruction counts.
+
+class RecordingRandom(random.Random):
+    #A seeded generator that appends every value it returns to draws
+    def __init__(self, seed, draws):
+        super().__init__(seed)
+        self.draws = draws
+
+    def randint(self, a, b):
+        value = super().randint(a, b)
+        self.draws.append(value)
+        return value
+
+class ReplayRandom(random.Random):
+    #Hands back the recorded draws in order, then carries on from the seeded generator if the replay runs past the recording
+    def __init__(self, seed, draws):
+        super().__init__(seed)
+        self.draws = list(draws)
+        self.index = 0
+
+    def randint(self, a, b):
+        if self.index < len(self.draws):
+            value = self.draws[self.index]
+            self.index += 1
+            return value
+        return super().randint(a, b)
+
+class InputRecorder:
+    #Logs key transitions and Cxkk draws for one CPU. Attach it before the first opcode runs, and send the host's key
+    #changes through press_key/release_key (or set_keys, for hosts that poll the whole keyboard) instead of the CPU's own.
+    def __init__(self, cpu, rom, seed=None, name=None, timing=None):
+        if cpu.instruction_count != 0:
+            raise ValueError("the recorder must be attached before the CPU runs")
+        if seed is None:
+            seed = int.from_bytes(os.urandom(4), "little")
+        self.cpu = cpu
+        self.rom = rom
+        self.seed = seed
+        self.name = name if name is not None else os.path.splitext(os.path.basename(rom))[0]
+        self.timing = timing #{"instructions_per_second", "frame_rate"} of the host's FrameScheduler, or None for run_cycles
+        self.events = []
+        self.draws = []
+        cpu.rng = RecordingRandom(seed, self.draws)
+        return
+
+    def press_key(self, key):
+        self.events.append([self.cpu.instruction_count, key, True])
+        self.cpu.press_key(key)
+        return
+
+    def release_key(self, key):
+        self.events.append([self.cpu.instruction_count, key, False])
+        self.cpu.release_key(key)
+        return
+
+    def set_keys(self, pressed):
+        #Takes the state of all 16 keys and logs only the ones that changed
+        for key in range(16):
+            if bool(pressed[key]) != bool(self.cpu.keys[key]):
+                if pressed[key]:
+                    self.press_key(key)
+                else:
+                    self.release_key(key)
+        return
+
+    def recording(self):
+        return {"name": self.name, "rom": self.rom, "seed": self.seed, "cycles": self.cpu.instruction_count, "timing": self.timing,
+                "events": [list(event) for event in self.events], "draws": list(self.draws),
+                "framebuffer_sha1": hashlib.sha1(bytes(self.cpu.framebuffer)).hexdigest()}
+
+    def save(self, filename):
+        fout = open(filename, "w")
+        json.dump(self.recording(), fout)
+        fout.close()
+        return
+
+def load_recording(filename):
+    fin = open(filename)
+    recording = json.load(fin)
+    fin.close()
+    recording["events"] = [[int(cycle), int(key), bool(pressed)] for cycle, key, pressed in recording["events"]]
+    return recording
+
+def replay(recording, jit=False, cycles=None):
+    #Runs a recording on a fresh headless CPU and returns the CPU. By default it stops where the recording stopped.
+    cpu = chip8.PETChip8CPU(0, jit=jit)
+    cpu.load(recording["rom"])
+    cpu.rng = ReplayRandom(recording["seed"], recording.get("draws", ()))
+    cycles = recording["cycles"] if cycles is None else cycles
+    timing = recording.get("timing")
+    if timing:
+        scheduler = chip8scheduler.FrameScheduler(cpu, timing["instructions_per_second"], timing["frame_rate"])
+        scheduler.run_headless(cycles, recording["events"])
+    else:
+        chip8farm.run_headless(cpu, cycles, recording["events"])
+    return cpu
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a CHIP-8 input recording headless and report throughput.")
+    parser.add_argument("recording", help="recording JSON file")
+    parser.add_argument("--repeat", type=int, default=3, help="number of replays; the best rate is reported")
+    parser.add_argument("--jit", action="store_true", help="use the basic-block translation cache")
+    args = parser.parse_args(argv)
+    recording = load_recording(args.recording)
+    best = 0.0
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        cpu = replay(recording, args.jit)
+        best = max(best, cpu.instruction_count / (time.perf_counter() - started))
+    matches = hashlib.sha1(bytes(cpu.framebuffer)).hexdigest() == recording.get("framebuffer_sha1")
+    print(json.dumps({"recording": args.recording, "instructions": cpu.instruction_count, "instructions_per_second": best,
+                      "framebuffer_matches": matches}))
+    return 0 if matches else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import time
+
+#Frame-paced execution for interactive hosts.
+#Time is cut into frames at frame_rate (60 Hz, the timer rate). Each frame runs the opcodes owed for it in one batch with the
+#timers held, then ticks the timers once. Frame f ends at instruction base + (f + 1) * instructions_per_second // frame_rate,
+#so the number of opcodes per frame has no rounding drift, and because the tick points depend only on the instruction count a
+#session can be replayed headless exactly. Wall-clock deadlines come from time.perf_counter_ns, counted from one epoch rather
+#than accumulated, so host load delays frames but does not shift the schedule.
+#A frame that blocks on Fx0A stays open, with the timers held, until a key releases it.
+
+class FrameScheduler:
+    __slots__ = ("cpu", "instructions_per_second", "frame_rate", "frame_ns", "clock", "sleep", "max_lag_frames", "base",
+                 "frames", "epoch", "deadlines", "dropped", "started_ns", "started_instructions")
+
+    def __init__(self, cpu, instructions_per_second=500, frame_rate=60, clock=time.perf_counter_ns, sleep=time.sleep,
+                 max_lag_frames=5):
+        self.cpu = cpu
+        self.instructions_per_second = instructions_per_second
+        self.frame_rate = frame_rate
+        self.frame_ns = 1000000000 // frame_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.max_lag_frames = max_lag_frames #How far behind the host may fall before missed frames are dropped
+        self.base = cpu.instruction_count
+        self.frames = 0 #Frames completed, each one ending in a timer tick
+        self.epoch = None #Clock reading that deadline 0 is counted from
+        self.deadlines = 0 #Deadlines passed since the epoch
+        self.dropped = 0 #Deadlines skipped because the host fell too far behind
+        self.started_ns = None
+        self.started_instructions = cpu.instruction_count
+        return
+
+    def frame_end(self, frame):
+        #The instruction count at which the given frame ends
+        return self.base + (frame + 1) * self.instructions_per_second // self.frame_rate
+
+    def run_frame(self, limit=None):
+        #Runs the current frame's remaining opcodes, or up to instruction count limit if that comes first, then ticks the
+        #timers if the frame is finished. Returns True when a frame was completed.
+        cpu = self.cpu
+        end = self.frame_end(self.frames)
+        stop = end if limit is None else min(end, limit)
+        if stop > cpu.instruction_count:
+            cpu.run_cycles(stop - cpu.instruction_count, timers=False)
+        if cpu.instruction_count < end:
+            return False
+        cpu.tick_timers()
+        self.frames += 1
+        return True
+
+    def resync(self):
+        #Starts the wall-clock schedule afresh from now, e.g. after the host has been asleep waiting for input
+        self.epoch = self.clock()
+        self.deadlines = 0
+        if self.started_ns is None:
+            self.started_ns = self.epoch
+        return
+
+    def wait(self):
+        #Sleeps until the next frame is due. A host more than max_lag_frames behind skips the missed deadlines instead of
+        #running them back to back, and they are counted in dropped.
+        if self.epoch is None:
+            self.resync()
+        self.deadlines += 1
+        now = self.clock()
+        deadline = self.epoch + self.deadlines * self.frame_ns
+        if deadline > now:
+            self.sleep((deadline - now) / 1000000000)
+        elif now - deadline > self.max_lag_frames * self.frame_ns:
+            missed = (now - deadline) // self.frame_ns
+            self.deadlines += missed
+            self.dropped += missed
+        return
+
+    def run(self, on_frame, frames=None):
+        #Runs frames until on_frame(scheduler), called after each one, returns False, or until the given number of frames
+        self.resync()
+        count = 0
+        while frames is None or count < frames:
+            self.run_frame()
+            count += 1
+            if on_frame(self) is False:
+                break
+            self.wait()
+        return
+
+    def run_headless(self, cycles, events=()):
+        #Frame-paced counterpart of chip8farm.run_headless, with no sleeping: runs up to cycles opcodes, applying the
+        #[cycle, key, pressed] events when the instruction count reaches them. Used to replay sessions recorded under a scheduler.
+        #The event loop is the farm's, imported here so interactive hosts do not load the farm.
+        import chip8farm
+        return chip8farm.run_headless(self.cpu, cycles, events, self.run_frame)
+
+    def achieved_instructions_per_second(self):
+        if self.started_ns is None:
+            return 0.0
+        elapsed = self.clock() - self.started_ns
+        return (self.cpu.instruction_count - self.started_instructions) * 1000000000 / elapsed if elapsed else 0.0
+
+    def stats(self):
+        #Target against achieved rates since the scheduler started
+        elapsed = self.clock() - self.started_ns if self.started_ns is not None else 0
+        return {"target_instructions_per_second": self.instructions_per_second,
+                "achieved_instructions_per_second": self.achieved_instructions_per_second(),
+                "target_frames_per_second": self.frame_rate,
+                "achieved_frames_per_second": self.frames * 1000000000 / elapsed if elapsed else 0.0,
+                "frames": self.frames, "dropped_frames": self.dropped}
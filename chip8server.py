@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import chip8
+import chip8scheduler
+
+#Asyncio host serving many CHIP-8 sessions from one process.
+#Every session is a PETChip8CPU with its own task. A single clock task wakes the session tasks once per 60 Hz frame; each
+#drains its key queue, runs one frame through a chip8scheduler.FrameScheduler (so sessions keep the same timing as the
+#desktop host and can be recorded and replayed the same way), and sends the rows of the screen that changed to its subscribers.
+#
+#The protocol is JSON lines over a local TCP socket. Requests:
+#  {"op": "create", "rom": NAME}                          -> {"type": "created", "session": ID}
+#  {"op": "subscribe", "session": ID}                     -> {"type": "keyframe", ...} then {"type": "delta", ...} per change
+#  {"op": "key", "session": ID, "key": K, "pressed": B}
+#  {"op": "close", "session": ID}                         -> {"type": "closed", "session": ID}
+#  {"op": "stats"}                                        -> {"type": "stats", ...}
+#A keyframe holds the whole 256-byte framebuffer in hex; a delta holds [row, hex] pairs for the 8-byte rows that changed since
+#the last frame sent. Errors come back as {"type": "error", "message": ...}. A session whose program faults is removed, and its
+#subscribers get {"type": "error", "session": ID, "message": ...}.
+
+FRAME_RATE = 60
+ROW_BYTES = 8
+MAX_WRITE_BUFFER = 64 * 1024 #A subscriber with more than this unsent is skipped, and gets a keyframe once it catches up
+
+class Subscriber:
+    __slots__ = ("writer", "needs_keyframe")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.needs_keyframe = True
+        return
+
+class Session:
+    __slots__ = ("id", "rom", "cpu", "scheduler", "keys", "subscribers", "last_sent", "task")
+
+    def __init__(self, session_id, rom, instructions_per_second, jit=False):
+        self.id = session_id
+        self.rom = rom
+        self.cpu = chip8.PETChip8CPU(0, jit=jit)
+        self.cpu.load(rom)
+        self.scheduler = chip8scheduler.FrameScheduler(self.cpu, instructions_per_second, FRAME_RATE)
+        self.keys = asyncio.Queue() #(key, pressed) pairs from clients, applied at the start of the next frame
+        self.subscribers = []
+        self.last_sent = bytes(self.cpu.framebuffer)
+        self.task = None
+        return
+
+    def step(self):
+        #One frame: apply the queued keys, run the frame, publish what changed
+        cpu = self.cpu
+        keys = self.keys
+        while not keys.empty():
+            key, pressed = keys.get_nowait()
+            if pressed:
+                cpu.press_key(key)
+            else:
+                cpu.release_key(key)
+        self.scheduler.run_frame()
+        if cpu.draw_flag:
+            cpu.draw_flag = False
+            self.publish()
+        elif any(subscriber.needs_keyframe for subscriber in self.subscribers):
+            self.publish()
+        return
+
+    def publish(self):
+        framebuffer = bytes(self.cpu.framebuffer)
+        last = self.last_sent
+        rows = [[row, framebuffer[start:start + ROW_BYTES].hex()] for row, start in enumerate(range(0, 256, ROW_BYTES))
+                if framebuffer[start:start + ROW_BYTES] != last[start:start + ROW_BYTES]]
+        self.last_sent = framebuffer
+        frame = self.scheduler.frames
+        delta = None
+        for subscriber in list(self.subscribers):
+            writer = subscriber.writer
+            if writer.is_closing():
+                self.subscribers.remove(subscriber)
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                subscriber.needs_keyframe = True
+                continue
+            if subscriber.needs_keyframe:
+                writer.write(encode({"type": "keyframe", "session": self.id, "frame": frame, "framebuffer": framebuffer.hex()}))
+                subscriber.needs_keyframe = False
+            elif rows:
+                if delta is None:
+                    delta = encode({"type": "delta", "session": self.id, "frame": frame, "rows": rows})
+                writer.write(delta)
+        return
+
+def encode(message):
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+class Host:
+    #Owns the sessions, the frame clock and the socket server
+    def __init__(self, rom_dir, instructions_per_second=500, jit=False):
+        self.rom_dir = rom_dir
+        self.instructions_per_second = instructions_per_second
+        self.jit = jit
+        self.sessions = {}
+        self.next_id = 1
+        self.tick = asyncio.Event() #Set and cleared once per frame, releasing every session task
+        self.connections = set() #Tasks serving connected clients
+        self.frames = 0
+        self.busy_ns = 0 #Time spent stepping sessions, for stats
+        self.started_ns = time.perf_counter_ns()
+        self.clock_task = None
+        return
+
+    def create_session(self, rom):
+        #ROMs are looked up by file name in rom_dir only
+        name = os.path.basename(rom)
+        path = os.path.join(self.rom_dir, name)
+        if not name or not os.path.isfile(path):
+            raise ValueError("no such ROM: %s" % rom)
+        session = Session(self.next_id, path, self.instructions_per_second, self.jit)
+        self.next_id += 1
+        self.sessions[session.id] = session
+        session.task = asyncio.get_running_loop().create_task(self.run_session(session))
+        return session
+
+    def close_session(self, session_id):
+        session = self.sessions.pop(session_id)
+        session.task.cancel()
+        return
+
+    async def run_session(self, session):
+        clock = time.perf_counter_ns
+        while True:
+            await self.tick.wait()
+            started = clock()
+            try:
+                session.step()
+            except Exception as error:
+                #The ROM faulted (a call past the top of the stack, say): drop the session and tell whoever is watching it
+                self.busy_ns += clock() - started
+                self.fail_session(session, error)
+                return
+            self.busy_ns += clock() - started
+
+    def fail_session(self, session, error):
+        if self.sessions.get(session.id) is session:
+            del self.sessions[session.id]
+        message = encode({"type": "error", "session": session.id, "message": "%s: %s" % (type(error).__name__, error)})
+        for subscriber in session.subscribers:
+            if not subscriber.writer.is_closing():
+                subscriber.writer.write(message)
+        session.subscribers.clear()
+        return
+
+    async def run_clock(self):
+        #Releases the session tasks once per frame against deadlines counted from one epoch, so ticks do not drift
+        frame_ns = 1000000000 // FRAME_RATE
+        epoch = time.perf_counter_ns()
+        frame = 0
+        while True:
+            frame += 1
+            delay = (epoch + frame * frame_ns - time.perf_counter_ns()) / 1000000000
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -0.25:
+                #Too far behind to catch up: start the schedule again from now
+                epoch = time.perf_counter_ns()
+                frame = 0
+            self.tick.set()
+            self.tick.clear() #Tasks already waiting are released by set() even though the event is cleared straight away
+            self.frames += 1
+
+    def stats(self):
+        elapsed = time.perf_counter_ns() - self.started_ns
+        return {"type": "stats", "sessions": len(self.sessions), "frames": self.frames,
+                "frames_per_second": self.frames * 1000000000 / elapsed if elapsed else 0.0,
+                "busy_fraction": self.busy_ns / elapsed if elapsed else 0.0, #Share of wall time spent running frames
+                "instructions": sum(session.cpu.instruction_count for session in self.sessions.values())}
+
+    async def handle_client(self, reader, writer):
+        owned = [] #Sessions this connection created, closed when it goes away
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = self.handle_request(json.loads(line), writer, owned)
+                except (ValueError, KeyError, TypeError) as error:
+                    reply = {"type": "error", "message": "%s: %s" % (type(error).__name__, error)}
+                if reply is not None:
+                    writer.write(encode(reply))
+                    await writer.drain()
+        finally:
+            for session_id in owned:
+                if session_id in self.sessions:
+                    self.close_session(session_id)
+            writer.close()
+            self.connections.discard(asyncio.current_task())
+        return
+
+    def handle_request(self, request, writer, owned):
+        op = request["op"]
+        if op == "create":
+            session = self.create_session(request["rom"])
+            owned.append(session.id)
+            return {"type": "created", "session": session.id}
+        elif op == "subscribe":
+            self.sessions[request["session"]].subscribers.append(Subscriber(writer))
+            return None
+        elif op == "key":
+            key = int(request["key"])
+            if not 0 <= key < 16:
+                raise ValueError("key must be in range(0, 16)")
+            self.sessions[request["session"]].keys.put_nowait((key, bool(request["pressed"])))
+            return None
+        elif op == "close":
+            self.close_session(request["session"])
+            return {"type": "closed", "session": request["session"]}
+        elif op == "stats":
+            return self.stats()
+        raise ValueError("unknown op: %s" % op)
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        self.clock_task = asyncio.get_running_loop().create_task(self.run_clock())
+        server = await asyncio.start_server(self.handle_client, host, port)
+        return server
+
+class Client:
+    #Minimal client for the protocol, for tests and tools
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.framebuffers = {} #Session -> bytearray, kept up to date from keyframes and deltas
+        return
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def send(self, **request):
+        self.writer.write(encode(request))
+        await self.writer.drain()
+        return
+
+    async def receive(self):
+        #Reads one message, applying frame updates to framebuffers. Returns the message, or None once the server hangs up.
+        line = await self.reader.readline()
+        if not line:
+            return None
+        message = json.loads(line)
+        if message["type"] == "keyframe":
+            self.framebuffers[message["session"]] = bytearray.fromhex(message["framebuffer"])
+        elif message["type"] == "delta":
+            framebuffer = self.framebuffers[message["session"]]
+            for row, data in message["rows"]:
+                framebuffer[row * ROW_BYTES:(row + 1) * ROW_BYTES] = bytes.fromhex(data)
+        return message
+
+    async def request(self, **request):
+        #Sends a request and returns the first reply that is not a frame update
+        await self.send(**request)
+        while True:
+            message = await self.receive()
+            if message is None or message["type"] not in ("keyframe", "delta"):
+                return message
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        return
+
+async def load_test(rom, sessions, seconds, port, instructions_per_second):
+    #Serves sessions copies of rom to one local client and reports the host's stats afterwards
+    host = Host(os.path.dirname(os.path.abspath(rom)), instructions_per_second)
+    server = await host.serve(port=port)
+    client = await Client.connect(port=port)
+    ids = []
+    for _ in range(sessions):
+        ids.append((await client.request(op="create", rom=os.path.basename(rom)))["session"])
+        await client.send(op="subscribe", session=ids[-1])
+    deadline = time.perf_counter() + seconds
+    messages = 0
+    while time.perf_counter() < deadline:
+        try:
+            if await asyncio.wait_for(client.receive(), timeout=deadline - time.perf_counter()) is not None:
+                messages += 1
+        except asyncio.TimeoutError:
+            break
+    #Stop the clock and read everything already sent, so the client's copies of the screens can be checked against the host's.
+    #Subscribers skipped while their buffers were full get a keyframe from the last publish.
+    host.clock_task.cancel()
+    stats = await client.request(op="stats")
+    for session in host.sessions.values():
+        session.publish()
+    await client.request(op="stats")
+    stats["messages_received"] = messages
+    stats["screens_match"] = all(client.framebuffers.get(session_id) == host.sessions[session_id].last_sent for session_id in ids)
+    await client.close()
+    await asyncio.gather(*host.connections)
+    server.close()
+    await server.wait_closed()
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve CHIP-8 sessions over a local JSON-lines socket.")
+    parser.add_argument("--roms", default=".", help="directory the sessions' ROMs are loaded from")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ips", type=int, default=500, help="instructions per second per session")
+    parser.add_argument("--jit", action="store_true", help="use the basic-block translation cache")
+    parser.add_argument("--load-test", metavar="ROM", default=None, help="run SESSIONS copies of ROM against a local client and print stats")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+    if args.load_test is not None:
+        print(json.dumps(asyncio.run(load_test(args.load_test, args.sessions, args.seconds, args.port, args.ips)), indent=2))
+        return 0
+
+    async def serve_forever():
+        server = await Host(args.roms, args.ips, args.jit).serve(port=args.port)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve_forever())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
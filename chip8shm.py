@@ -0,0 +1,262 @@
+import argparse
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import chip8framestream
+
+#A CPU's screen, registers and keys in a multiprocessing.shared_memory block, for viewers in other processes.
+#SharedMachine rebinds the CPU's framebuffer, V and keys to memoryviews over the block, so the interpreter writes them in
+#place with no copying. At every frame boundary the host publishes a consistent copy of them, with PC, I, SP and the
+#timers, under a seqlock: the sequence number is made odd, the published region written, and the sequence made even again.
+#A reader copies the published region and keeps the copy only if it saw the same even sequence before and after. Readers
+#never block the emulator, and the live views are there for anyone happy to see a frame half drawn.
+#Viewers press keys by writing 1 or 0 into the key request bytes; the host turns changes into press_key/release_key calls
+#at the next frame boundary, so Fx0A waits complete and an InputRecorder sees them.
+#
+#Block layout, little-endian:
+#  0   magic, version, control (bit 0: a viewer asked the host to quit), 2 pad bytes, sequence (8 bytes at offset 8)
+#  16  published region: PUBLISHED_FORMAT, then framebuffer, V0-VF and keys at the offsets below, relative to its start
+#  336 live framebuffer, 592 live V0-VF, 608 live keys, 624 key requests
+
+SHM_MAGIC = b"C8SM"
+SHM_VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sBB")
+CONTROL_OFFSET = 5
+CONTROL_QUIT = 1
+SEQUENCE_FORMAT = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+PUBLISHED_OFFSET = 16
+#Frame number, instruction count, PC, I, SP, delay timer, sound timer, flags (bit 0 blocking on Fx0A)
+PUBLISHED_FORMAT = struct.Struct("<QQHHHBBB")
+PUBLISHED_FRAMEBUFFER = 32
+PUBLISHED_V = 288
+PUBLISHED_KEYS = 304
+PUBLISHED_SIZE = 320
+LIVE_FRAMEBUFFER = PUBLISHED_OFFSET + PUBLISHED_SIZE
+LIVE_V = LIVE_FRAMEBUFFER + 256
+LIVE_KEYS = LIVE_V + 16
+KEY_REQUESTS = LIVE_KEYS + 16
+BLOCK_SIZE = KEY_REQUESTS + 16
+
+def unpack_published(published):
+    #The fields of a published region (as returned by SharedMachineView.read) as a dictionary
+    frame, instructions, pc, address, sp, delay, sound, flags = PUBLISHED_FORMAT.unpack_from(published, 0)
+    return {"frame": frame, "instruction_count": instructions, "program_counter": pc, "address_register": address,
+            "stack_pointer": sp, "delay_timer": delay, "sound_timer": sound, "blocking_keypress": bool(flags & 1),
+            "framebuffer": bytes(published[PUBLISHED_FRAMEBUFFER:PUBLISHED_V]), "V": bytes(published[PUBLISHED_V:PUBLISHED_KEYS]),
+            "keys": bytes(published[PUBLISHED_KEYS:PUBLISHED_SIZE])}
+
+class SharedMachine:
+    #The host side: creates the block and moves cpu's framebuffer, V and keys into it until close()
+    def __init__(self, cpu, name=None):
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=BLOCK_SIZE)
+        self.name = self.shm.name
+        self.buffer = self.shm.buf
+        self.buffer[0:BLOCK_SIZE] = bytes(BLOCK_SIZE)
+        HEADER_FORMAT.pack_into(self.buffer, 0, SHM_MAGIC, SHM_VERSION, 0)
+        self.cpu = cpu
+        self.views = (self.buffer[LIVE_FRAMEBUFFER:LIVE_V], self.buffer[LIVE_V:LIVE_KEYS], self.buffer[LIVE_KEYS:KEY_REQUESTS])
+        self.views[0][:] = cpu.framebuffer
+        self.views[1][:] = cpu.V
+        self.views[2][:] = cpu.keys
+        cpu.framebuffer, cpu.V, cpu.keys = self.views
+        self.sequence = 0
+        self.requests = bytes(16) #Key requests as last applied
+        return
+
+    def publish(self, frame):
+        #Copies the live state into the published region under the seqlock
+        cpu = self.cpu
+        buffer = self.buffer
+        SEQUENCE_FORMAT.pack_into(buffer, SEQUENCE_OFFSET, self.sequence + 1)
+        PUBLISHED_FORMAT.pack_into(buffer, PUBLISHED_OFFSET, frame, cpu.instruction_count, cpu.program_counter,
+                                   cpu.address_register, cpu.stack_pointer & 0xFFFF, cpu.delay_timer, cpu.sound_timer,
+                                   1 if cpu.blocking_keypress else 0)
+        buffer[PUBLISHED_OFFSET + PUBLISHED_FRAMEBUFFER:LIVE_FRAMEBUFFER] = buffer[LIVE_FRAMEBUFFER:KEY_REQUESTS]
+        self.sequence += 2
+        SEQUENCE_FORMAT.pack_into(buffer, SEQUENCE_OFFSET, self.sequence)
+        return
+
+    def take_keys(self, target):
+        #Applies the viewers' key changes since the last call through target.press_key/release_key. Returns True if a key went down.
+        #Ex9E and ExA1 clear a key when they test it, so requested keys the CPU has cleared are pressed again, except while
+        #it waits on Fx0A, where only a new press should count.
+        requests = bytes(self.buffer[KEY_REQUESTS:BLOCK_SIZE])
+        pressed = False
+        if requests != self.requests:
+            for key in range(16):
+                if requests[key] != self.requests[key]:
+                    if requests[key]:
+                        target.press_key(key)
+                        pressed = True
+                    else:
+                        target.release_key(key)
+            self.requests = requests
+        cpu = self.cpu
+        if any(requests) and not cpu.blocking_keypress:
+            keys = cpu.keys
+            for key in range(16):
+                if requests[key] and not keys[key]:
+                    target.press_key(key)
+        return pressed
+
+    def quit_requested(self):
+        return bool(self.buffer[CONTROL_OFFSET] & CONTROL_QUIT)
+
+    def close(self):
+        #Gives the CPU private copies of its state back and removes the block
+        cpu = self.cpu
+        cpu.framebuffer = bytearray(self.views[0])
+        cpu.V = bytearray(self.views[1])
+        cpu.keys = bytearray(self.views[2])
+        for view in self.views:
+            view.release()
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+        return
+
+class SharedMachineView:
+    #The viewer side: maps a block created by SharedMachine in another process
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        #Attaching registers the block with this process's resource tracker, which would remove it when the viewer exits;
+        #only the host owns it
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.buffer = self.shm.buf
+        magic, version, control = HEADER_FORMAT.unpack_from(self.buffer, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            self.close()
+            raise ValueError("%s is not a version %d CHIP-8 shared block" % (name, SHM_VERSION))
+        #Live views, written by the emulator as it runs: zero-copy, but may show a frame half drawn
+        self.framebuffer = self.buffer[LIVE_FRAMEBUFFER:LIVE_V]
+        self.V = self.buffer[LIVE_V:LIVE_KEYS]
+        self.keys = self.buffer[LIVE_KEYS:KEY_REQUESTS]
+        return
+
+    def sequence(self):
+        #Even between publishes, odd while one is being written; goes up by 2 per frame published
+        return SEQUENCE_FORMAT.unpack_from(self.buffer, SEQUENCE_OFFSET)[0]
+
+    def read(self, published=None, timeout=1.0):
+        #Copies the latest published frame into published (a PUBLISHED_SIZE bytearray, made if not given) and returns it with
+        #its sequence number. Retries while the host is part way through publishing, and raises TimeoutError if no consistent
+        #copy turns up within timeout seconds (a host that died mid-publish leaves the sequence odd for good).
+        if published is None:
+            published = bytearray(PUBLISHED_SIZE)
+        buffer = self.buffer
+        deadline = None
+        while True:
+            before = SEQUENCE_FORMAT.unpack_from(buffer, SEQUENCE_OFFSET)[0]
+            if not before & 1:
+                published[:] = buffer[PUBLISHED_OFFSET:LIVE_FRAMEBUFFER]
+                if SEQUENCE_FORMAT.unpack_from(buffer, SEQUENCE_OFFSET)[0] == before:
+                    return before, published
+            if deadline is None:
+                deadline = time.perf_counter() + timeout
+            elif time.perf_counter() >= deadline:
+                raise TimeoutError("no consistent frame published in %.1f s" % timeout)
+            time.sleep(0)
+
+    def wait(self, after, timeout=None, interval=0.001):
+        #Sleeps until a frame newer than sequence after has been published. Returns its sequence, or None on timeout.
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            sequence = self.sequence()
+            if sequence > after and not sequence & 1:
+                return sequence
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            time.sleep(interval)
+
+    def press_key(self, key):
+        self.buffer[KEY_REQUESTS + key] = 1
+        return
+
+    def release_key(self, key):
+        self.buffer[KEY_REQUESTS + key] = 0
+        return
+
+    def request_quit(self):
+        self.buffer[CONTROL_OFFSET] |= CONTROL_QUIT
+        return
+
+    def close(self):
+        for view in (getattr(self, "framebuffer", None), getattr(self, "V", None), getattr(self, "keys", None)):
+            if view is not None:
+                view.release()
+        self.buffer = None
+        self.shm.close()
+        return
+
+class SharedMemoryInput:
+    #chip8backends input component: publishes every frame to the block and takes keys from its viewers
+    def __init__(self, name=None, interval=0.001):
+        self.name = name #Name of the block, or None for a generated one (machine.name once opened)
+        self.interval = interval #How often to look for a key while the program waits on Fx0A
+        self.machine = None
+        self.frames = 0
+        return
+
+    def open(self, cpu):
+        self.machine = SharedMachine(cpu, self.name)
+        self.machine.publish(0)
+        return
+
+    def poll(self, cpu, target):
+        self.frames += 1
+        self.machine.publish(self.frames)
+        self.machine.take_keys(target)
+        return not self.machine.quit_requested()
+
+    def wait(self, cpu, target):
+        self.machine.publish(self.frames)
+        while not self.machine.take_keys(target) and cpu.blocking_keypress:
+            if self.machine.quit_requested():
+                return False
+            time.sleep(self.interval)
+        return True
+
+    def close(self):
+        if self.machine is not None:
+            self.machine.close()
+            self.machine = None
+        return
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a CHIP-8 machine shared by chip8backends.py --input shm.")
+    parser.add_argument("name", help="name of the shared block")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long to watch")
+    parser.add_argument("--show", action="store_true", help="print the last frame seen")
+    parser.add_argument("--press", type=int, action="append", default=[], help="hold this key while watching")
+    parser.add_argument("--quit", action="store_true", help="ask the host to stop afterwards")
+    args = parser.parse_args(argv)
+    view = SharedMachineView(args.name)
+    try:
+        for key in args.press:
+            view.press_key(key)
+        published = bytearray(PUBLISHED_SIZE)
+        sequence, _ = view.read(published)
+        first = unpack_published(published)["frame"]
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            if view.wait(sequence, deadline - time.perf_counter()) is None:
+                break
+            sequence, _ = view.read(published)
+        frame = unpack_published(published)
+        print("saw frames %d to %d, %.1f frames per second" % (first, frame["frame"], (frame["frame"] - first) / args.seconds))
+        if args.show:
+            print(chip8framestream.render_text(frame["framebuffer"]))
+        if args.quit:
+            view.request_quit()
+    finally:
+        #Releases the live views even when printing fails (a closed pipe), or closing the block raises BufferError at exit
+        for key in args.press:
+            view.release_key(key)
+        view.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+import argparse
+import collections
+import functools
+import random
+import sys
+import time
+
+import chip8
+
+#Incremental machine-state hashing for state-space search.
+#The state is treated as a row of byte cells (the 4 KB of memory, the 256-byte packed framebuffer, V0-VF, the keys and the
+#stack) plus seven scalars (PC, I, SP, both timers, the timer phase in centicycles and the Fx0A wait). Its Zobrist hash is
+#the XOR of one random 64-bit key per (cell, value) and per (scalar, value), so changing a byte costs two XORs. Cell keys are
+#tabulated per nibble and scalar keys per byte (a key is the XOR of one key per part), and the keys for a zero byte are zero,
+#so blank memory and screen cost nothing. The instruction count is left out on purpose: two states that differ only in it
+#behave the same from then on. The state of the Cxkk generator (cpu.rng) is left out too, so equal hashes mean equal machine
+#state, not equal futures: two states with the same hash can still diverge at the next RND. A search pruning on the hash
+#treats them as one.
+#
+#cpu.start_hashing() makes run_cycles go through StateHasher.run_cycles, which runs the stock interpreter loop with a
+#different handler table: the handlers that write memory or the screen (Fx33, Fx55, Dxyn, 00E0) are wrapped to XOR the
+#bytes they changed into the hash, and every other opcode runs unwrapped. The registers, keys, stack and scalars are small
+#enough to be compared against the last values hashed whenever the hash is read, which also picks up press_key,
+#tick_timers and the like done between runs. Bulk writes (load, load_state) recompute everything. While hashing, the JIT is bypassed.
+
+MEMORY_CELL = 0
+SCREEN_CELL = 4096
+REGISTER_CELL = 4352
+KEY_CELL = 4368
+STACK_CELL = 4384 #The 16 stack words, little-endian
+CELLS = 4416
+SCALARS = 7
+KEY_SEED = 0xC8
+
+#Per-nibble key tables, built once per process on first use
+_zobrist_keys = None
+
+def zobrist_keys():
+    #Returns (low, high, scalar_low, scalar_high). The key of cell c holding a byte is low[(c << 4) | (byte & 15)] ^
+    #high[(c << 4) | (byte >> 4)]; the key of scalar s holding a 16-bit value is scalar_low[s][value & 0xFF] ^ scalar_high[s][value >> 8].
+    global _zobrist_keys
+    if _zobrist_keys is None:
+        generator = random.Random(KEY_SEED) #Fixed, so hashes agree across processes and runs
+        low = [generator.getrandbits(64) for _ in range(CELLS << 4)]
+        high = [generator.getrandbits(64) for _ in range(CELLS << 4)]
+        for cell in range(CELLS):
+            low[cell << 4] = 0
+            high[cell << 4] = 0
+        scalar_low = [[0] + [generator.getrandbits(64) for _ in range(255)] for _ in range(SCALARS)]
+        scalar_high = [[0] + [generator.getrandbits(64) for _ in range(255)] for _ in range(SCALARS)]
+        _zobrist_keys = (low, high, scalar_low, scalar_high)
+    return _zobrist_keys
+
+def scalar_fields(cpu):
+    #PC, I, SP, delay timer, sound timer, timer phase and Fx0A wait (target register + 1, or 0 when not waiting)
+    return (cpu.program_counter, cpu.address_register, cpu.stack_pointer & 0xFFFF, cpu.delay_timer, cpu.sound_timer,
+            cpu.timer_centicycles, cpu.rts_keypress + 1 if cpu.blocking_keypress else 0)
+
+def full_hash(cpu):
+    #The hash computed from scratch, visiting every non-zero cell
+    low, high, scalar_low, scalar_high = zobrist_keys()
+    value = 0
+    for cell, data in ((MEMORY_CELL, cpu.memory), (SCREEN_CELL, cpu.framebuffer), (REGISTER_CELL, cpu.V), (KEY_CELL, cpu.keys),
+                       (STACK_CELL, cpu.stack.tobytes())):
+        for index, byte in enumerate(data):
+            if byte:
+                slot = (cell + index) << 4
+                value ^= low[slot | (byte & 15)] ^ high[slot | (byte >> 4)]
+    for index, field in enumerate(scalar_fields(cpu)):
+        value ^= scalar_low[index][field & 0xFF] ^ scalar_high[index][field >> 8]
+    return value
+
+class HashingHandlers(dict):
+    #Opcode -> handler table used in place of cpu.opcode_cache while hashing; handlers are bound and wrapped on first use
+    __slots__ = ("cpu", "hasher")
+
+    def __init__(self, cpu, hasher):
+        super().__init__()
+        self.cpu = cpu
+        self.hasher = hasher
+        return
+
+    def __missing__(self, opcode):
+        cpu = self.cpu
+        name = cpu.opcode_names[opcode]
+        operands = cpu.opcode_operands[opcode]
+        handler = functools.partial(getattr(cpu, name), *operands)
+        wrap = WRAPPERS.get(name)
+        if wrap is not None:
+            handler = wrap(self.hasher, cpu, handler, *operands)
+        self[opcode] = handler
+        return handler
+
+def wrap_screen_write(hasher, cpu, handler, *operands):
+    def write():
+        before = bytes(cpu.framebuffer)
+        try:
+            handler()
+        finally:
+            hasher.update(SCREEN_CELL, before, cpu.framebuffer)
+        return
+    return write
+
+def wrap_memory_write(hasher, cpu, handler, x, length):
+    #Fx33 writes 3 bytes at I, Fx55 writes x + 1
+    def write():
+        address = cpu.address_register
+        before = cpu.memory[address:address + length]
+        try:
+            handler()
+        finally:
+            hasher.update(MEMORY_CELL + address, before, cpu.memory[address:address + len(before)])
+        return
+    return write
+
+WRAPPERS = {"op_Dxyn": wrap_screen_write, "op_00E0": wrap_screen_write,
+            "op_Fx33": lambda hasher, cpu, handler, x: wrap_memory_write(hasher, cpu, handler, x, 3),
+            "op_Fx55": lambda hasher, cpu, handler, x: wrap_memory_write(hasher, cpu, handler, x, x + 1)}
+
+class StateHasher:
+    #Keeps the Zobrist hash of one CPU's state up to date. Read it with hash(cpu).
+    __slots__ = ("value", "V", "keys", "stack", "scalars", "handlers", "low", "high", "scalar_low", "scalar_high")
+
+    def __init__(self, cpu):
+        self.low, self.high, self.scalar_low, self.scalar_high = zobrist_keys()
+        self.handlers = HashingHandlers(cpu, self)
+        self.reset(cpu)
+        return
+
+    def reset(self, cpu):
+        #Recomputes the hash from scratch, after writes the hasher did not see
+        self.value = full_hash(cpu)
+        self.V = bytes(cpu.V) #The small parts of the state as last hashed, to compare against when the hash is read
+        self.keys = bytes(cpu.keys)
+        self.stack = cpu.stack.tobytes()
+        self.scalars = scalar_fields(cpu)
+        return
+
+    def update(self, cell, before, after):
+        #XORs out the keys of the bytes that differ between before and after (equal lengths) and XORs in their new keys
+        difference = int.from_bytes(before, "little") ^ int.from_bytes(after, "little")
+        if not difference:
+            return
+        low = self.low
+        high = self.high
+        value = self.value
+        while difference:
+            index = ((difference & -difference).bit_length() - 1) >> 3
+            difference &= ~(0xFF << (index << 3))
+            old = before[index]
+            new = after[index]
+            slot = (cell + index) << 4
+            value ^= low[slot | (old & 15)] ^ high[slot | (old >> 4)] ^ low[slot | (new & 15)] ^ high[slot | (new >> 4)]
+        self.value = value
+        return
+
+    def hash(self, cpu):
+        #The current 64-bit hash of cpu's state
+        if cpu.V != self.V:
+            self.update(REGISTER_CELL, self.V, cpu.V)
+            self.V = bytes(cpu.V)
+        if cpu.keys != self.keys:
+            self.update(KEY_CELL, self.keys, cpu.keys)
+            self.keys = bytes(cpu.keys)
+        stack = cpu.stack.tobytes()
+        if stack != self.stack:
+            self.update(STACK_CELL, self.stack, stack)
+            self.stack = stack
+        scalars = scalar_fields(cpu)
+        if scalars != self.scalars:
+            value = self.value
+            for index, old, new in zip(range(SCALARS), self.scalars, scalars):
+                if old != new:
+                    low = self.scalar_low[index]
+                    high = self.scalar_high[index]
+                    value ^= low[old & 0xFF] ^ high[old >> 8] ^ low[new & 0xFF] ^ high[new >> 8]
+            self.value = value
+            self.scalars = scalars
+        return self.value
+
+    def run_cycles(self, cpu, cycles, timers=True):
+        #Same contract as PETChip8CPU.interpret_cycles, which it runs with the wrapped handlers swapped in. While profiling,
+        #the profiler's loop runs instead, dispatching through the same wrapped handlers, so the hash still sees every write.
+        cache = cpu.opcode_cache
+        cpu.opcode_cache = self.handlers
+        try:
+            if cpu.profiler is not None:
+                return cpu.profiler.run_cycles(cpu, cycles, timers)
+            return cpu.interpret_cycles(cycles, timers)
+        finally:
+            cpu.opcode_cache = cache
+
+    def fork(self, child):
+        #A hasher for a fork of the CPU, starting from the same hash
+        hasher = object.__new__(StateHasher)
+        hasher.low = self.low
+        hasher.high = self.high
+        hasher.scalar_low = self.scalar_low
+        hasher.scalar_high = self.scalar_high
+        hasher.value = self.value
+        hasher.V = self.V
+        hasher.keys = self.keys
+        hasher.stack = self.stack
+        hasher.scalars = self.scalars
+        hasher.handlers = HashingHandlers(child, hasher)
+        return hasher
+
+class TranspositionTable:
+    #A bounded hash -> value map that evicts the least recently used entry once it holds capacity entries
+    def __init__(self, capacity=1 << 20):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        #The value stored under key, marking it recently used
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value=None):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+        elif len(entries) >= self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+        entries[key] = value
+        return
+
+    def visit(self, key, value=None):
+        #Returns True if key was already present (refreshing it), otherwise stores it with value and returns False
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        if len(entries) >= self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+        entries[key] = value
+        return False
+
+    def stats(self):
+        return {"entries": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+def explore(cpu, frames, cycles_per_frame=8, max_states=100000, table=None, check=False):
+    #Breadth-first search over input: every frame, each state branches into one child per key held for that frame and one
+    #with no key held. Children whose state was already seen are pruned. Returns (states expanded, states pruned, table).
+    if table is None:
+        table = TranspositionTable()
+    hasher = cpu.start_hashing()
+    table.visit(hasher.hash(cpu))
+    frontier = [cpu]
+    expanded = 0
+    pruned = 0
+    for _ in range(frames):
+        next_frontier = []
+        for state in frontier:
+            for key in range(-1, 16):
+                child = state.fork()
+                if key >= 0:
+                    child.press_key(key)
+                child.run_cycles(cycles_per_frame)
+                if key >= 0:
+                    child.release_key(key)
+                value = child.hasher.hash(child)
+                if check and value != full_hash(child):
+                    raise AssertionError("incremental hash diverged from the full hash")
+                expanded += 1
+                if table.visit(value):
+                    pruned += 1
+                elif len(next_frontier) < max_states:
+                    next_frontier.append(child)
+        frontier = next_frontier
+        if not frontier:
+            break
+    return expanded, pruned, table
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Explore a CHIP-8 ROM's input space, pruning states already seen.")
+    parser.add_argument("rom")
+    parser.add_argument("--frames", type=int, default=4, help="search depth in 60 Hz frames")
+    parser.add_argument("--max-states", type=int, default=20000, help="widest frontier kept per frame")
+    parser.add_argument("--capacity", type=int, default=1 << 20, help="transposition table entries")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the Cxkk generator")
+    parser.add_argument("--check", action="store_true", help="verify every incremental hash against a full recomputation (neither covers the Cxkk generator's state)")
+    args = parser.parse_args(argv)
+    cpu = chip8.PETChip8CPU(0)
+    cpu.load(args.rom)
+    cpu.rng.seed(args.seed)
+    started = time.perf_counter()
+    expanded, pruned, table = explore(cpu, args.frames, max_states=args.max_states,
+                                      table=TranspositionTable(args.capacity), check=args.check)
+    elapsed = time.perf_counter() - started
+    print("%d states expanded, %d pruned as already seen, %.1f s" % (expanded, pruned, elapsed))
+    print(table.stats())
+    if args.check:
+        print("every incremental hash matched a full recomputation; the Cxkk generator state is not hashed, so states pruned "
+              "as already seen may still differ at their next RND")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
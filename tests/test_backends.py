@@ -0,0 +1,28 @@
+import chip8
+import chip8backends
+
+class RecordingInput(chip8backends.ScriptedInput):
+    #Notes what the display had drawn each time the frontend blocks on Fx0A
+    def __init__(self, display, events=()):
+        super().__init__(events)
+        self.display = display
+        self.draws_at_wait = []
+        return
+
+    def wait(self, cpu, target):
+        self.draws_at_wait.append(self.display.draws)
+        return super().wait(cpu, target)
+
+def test_frame_is_drawn_before_waiting_for_a_key(tmp_path):
+    #LD V0, 0; LD F, V0; DRW V0, V0, 5; LD V1, K; JP 0x208
+    rom = tmp_path / "prompt.ch8"
+    rom.write_bytes(bytes.fromhex("6000F029D005F10A1208"))
+    cpu = chip8.PETChip8CPU(0)
+    cpu.load(str(rom))
+    display = chip8backends.NullDisplay()
+    input = RecordingInput(display, [[0, 7, True]])
+    frontend = chip8backends.Frontend(cpu, display=display, input=input, instructions_per_second=600)
+    frontend.run(frames=5)
+    assert input.draws_at_wait == [1]
+    assert cpu.V[1] == 7
+    assert not cpu.blocking_keypress
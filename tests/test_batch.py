@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import chip8
+import chip8batch
+
+ROM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PONG2")
+
+#Draws a random digit at a random place every pass and stores its registers, so seeded lanes soon hold different screens
+#and memory: RND V0, 0x3F; RND V1, 0x1F; RND V2, 0x0F; LD F, V2; DRW V0, V1, 5; ADD V3, 1; LD I, 0x300; LD [I], V3; JP 0x200
+RANDOM_SPRITES = bytes.fromhex("C03FC11FC20FF229D0157301A300F3551200")
+
+@pytest.mark.parametrize("seed", [0, 1000])
+def test_batch_lanes_match_the_interpreter_on_pong2(seed):
+    assert chip8batch.verify_lanes(ROM, 8, 3000, seed=seed) == []
+
+def test_seeded_lanes_match_the_interpreter_lane_for_lane(tmp_path):
+    rom = tmp_path / "random_sprites.ch8"
+    rom.write_bytes(RANDOM_SPRITES)
+    lanes = 6
+    batch = chip8batch.Chip8Batch(lanes, seeds=list(range(lanes)))
+    batch.load(str(rom))
+    cpus = []
+    for lane in range(lanes):
+        cpu = chip8.PETChip8CPU(0)
+        cpu.load(str(rom))
+        cpu.rng.seed(lane)
+        cpus.append(cpu)
+    for _ in range(10):
+        batch.run_cycles(150)
+        for cpu in cpus:
+            cpu.run_cycles(150)
+        for lane, cpu in enumerate(cpus):
+            assert bytes(batch.V[lane]) == bytes(cpu.V)
+            assert bytes(batch.memory[lane]) == bytes(cpu.memory)
+            assert bytes(batch.framebuffer[lane]) == bytes(cpu.framebuffer)
+        assert chip8batch.lane_mismatches(batch, cpus) == []
+    #The check means something only if the seeds really sent the lanes different ways
+    assert len({bytes(cpu.framebuffer) for cpu in cpus}) == lanes
@@ -0,0 +1,18 @@
+import pytest
+
+import chip8
+
+def test_graphics_is_a_read_only_snapshot_of_the_screen(tmp_path):
+    #LD V0, 0; LD F, V0; DRW V0, V0, 5 puts the font's 0 in the top left corner
+    rom = tmp_path / "zero.ch8"
+    rom.write_bytes(bytes.fromhex("6000F029D005"))
+    cpu = chip8.PETChip8CPU(0)
+    cpu.load(str(rom))
+    cpu.run_cycles(3)
+    graphics = cpu.graphics
+    assert isinstance(graphics, bytes)
+    assert len(graphics) == 64 * 32
+    assert [graphics[y * 64 + x] for y in range(5) for x in range(4)] == [cpu.get_pixel(x, y) for y in range(5) for x in range(4)]
+    assert any(graphics)
+    with pytest.raises(TypeError):
+        graphics[0] = 0
@@ -0,0 +1,35 @@
+import pytest
+
+import chip8
+import chip8jit
+
+def machine_state(cpu):
+    return (bytes(cpu.V), cpu.address_register, cpu.program_counter, cpu.stack_pointer, bytes(cpu.stack), bytes(cpu.memory),
+            bytes(cpu.framebuffer), cpu.delay_timer, cpu.sound_timer, cpu.timer_centicycles, cpu.instruction_count)
+
+def test_fault_inside_a_block_leaves_the_same_state_as_the_interpreter(tmp_path):
+    #LD V0, 1; ADD V0, 1; CALL 0x200 recurses until the stack overflows part way through a block
+    rom = tmp_path / "overflow.ch8"
+    rom.write_bytes(bytes.fromhex("600170012200"))
+    states = []
+    for jit in (False, True):
+        cpu = chip8.PETChip8CPU(0, jit=jit)
+        cpu.load(str(rom))
+        with pytest.raises(IndexError):
+            cpu.run_cycles(1000)
+        states.append(machine_state(cpu))
+    assert states[0] == states[1]
+    assert states[0][-1] > 0
+
+def test_shared_block_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(chip8jit, "MAX_COMPILED_BLOCKS", 4)
+    monkeypatch.setattr(chip8jit, "_compiled_blocks", type(chip8jit._compiled_blocks)())
+    for value in range(10):
+        #Each ROM loads a different constant, so each compiles a different block
+        rom = tmp_path / ("r%d.ch8" % value)
+        rom.write_bytes(bytes([0x60, value, 0x12, 0x00]))
+        cpu = chip8.PETChip8CPU(0, jit=True)
+        cpu.load(str(rom))
+        cpu.run_cycles(20)
+        assert cpu.V[0] == value
+    assert len(chip8jit._compiled_blocks) == 4
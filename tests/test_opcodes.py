@@ -0,0 +1,40 @@
+import pytest
+
+import chip8
+import chip8batch
+
+def run_registers(engine, path, cycles):
+    #Runs the ROM at path for the given number of opcodes and returns V0-VF
+    if engine == "batch":
+        batch = chip8batch.Chip8Batch(1, seeds=[0])
+        batch.load(path)
+        batch.run_cycles(cycles)
+        return [int(value) for value in batch.V[0]]
+    cpu = chip8.PETChip8CPU(0, jit=engine == "jit")
+    cpu.load(path)
+    cpu.run_cycles(cycles)
+    return list(cpu.V)
+
+#(V0, V1, VF before, opcode, register checked, its value after, VF after). Results wrap mod 256 and VF is written last,
+#so when x is F the flag is what VF holds afterwards.
+SUBTRACTIONS = [
+    (3, 5, 0, 0x8015, 0x0, 0xFE, 0), #8xy5 underflow: wraps, not the absolute difference
+    (5, 3, 0, 0x8015, 0x0, 0x02, 1),
+    (4, 4, 1, 0x8015, 0x0, 0x00, 0), #Equal operands borrow nothing but still clear VF
+    (5, 3, 0, 0x8017, 0x0, 0xFE, 0), #8xy7 underflow
+    (3, 5, 0, 0x8017, 0x0, 0x02, 1),
+    (0, 5, 3, 0x8F15, 0xF, 0x00, 0), #x = F: 3 - 5 borrows, and the flag overwrites the difference
+    (0, 5, 7, 0x8F15, 0xF, 0x01, 1),
+    (0, 5, 3, 0x8F17, 0xF, 0x01, 1),
+    (5, 0, 3, 0x80F5, 0x0, 0x02, 1), #y = F: VF is read as an operand before the flag is written
+    (5, 0, 3, 0x80F7, 0x0, 0xFE, 0),
+]
+
+@pytest.mark.parametrize("engine", ["interpreter", "jit", "batch"])
+@pytest.mark.parametrize("v0, v1, vf, opcode, register, value, flag", SUBTRACTIONS)
+def test_subtraction_wraps_and_sets_vf_last(tmp_path, engine, v0, v1, vf, opcode, register, value, flag):
+    rom = tmp_path / "sub.ch8"
+    rom.write_bytes(bytes([0x60, v0, 0x61, v1, 0x6F, vf, opcode >> 8, opcode & 0xFF]))
+    registers = run_registers(engine, str(rom), 4)
+    assert registers[register] == value
+    assert registers[15] == flag
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+pygame = pytest.importorskip("pygame")
+
+import chip8
+import chip8pygame
+
+ROM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PONG2")
+
+@pytest.fixture
+def headless_video(monkeypatch):
+    #The dummy driver gives a real display surface without opening a window
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.setenv("SDL_AUDIODRIVER", "dummy")
+    yield
+    pygame.quit()
+
+def test_draw_scales_the_framebuffer_onto_the_window(headless_video):
+    cpu = chip8.PETChip8CPU(0)
+    cpu.load(ROM)
+    cpu.run_cycles(500)
+    display = chip8pygame.PygameDisplay(scale=4, palette=((0, 0, 0), (255, 255, 255)))
+    display.open(cpu)
+    display.draw(cpu)
+    assert not cpu.draw_flag
+    assert display.dirty_rects
+    pixels = cpu.unpacked_framebuffer()
+    assert any(pixels)
+    for y in range(32):
+        for x in range(64):
+            lit = tuple(display.window.get_at((x * 4 + 2, y * 4 + 2)))[:3] == (255, 255, 255)
+            assert lit == bool(pixels[y * 64 + x]), (x, y)